@@ -0,0 +1,160 @@
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+
+class AccountSnapshot():
+    """Cache of account balances and asset prices, kept up to date by a
+    background thread, so that logging and risk checks can read them without
+    making REST calls. Balances are fetched for every asset in one call to
+    get_account, and prices for every symbol in one call to
+    get_symbol_ticker. Between refreshes, fills are applied to the cached
+    balances as they happen (see apply_fill). If a fill is applied while
+    balances are being fetched, the balances fetched may not include it, so
+    they are discarded and the cached balances, which do, are kept until the
+    next refresh.
+
+    Attributes
+    ----------
+    client : Any
+        The Binance client (or a stub with the same methods) used to refresh
+    refresh_interval_secs : float
+        Time between background refreshes
+    max_age_secs : float
+        Age after which the snapshot is considered stale
+    balances_updated_at : float
+        time.time() at which balances were last fetched, or 0 if never
+    prices_updated_at : float
+        time.time() at which prices were last fetched, or 0 if never
+    """
+    def __init__(self, client: Any, refresh_interval_secs: float = 30,
+                    max_age_secs: float = 120) -> None:
+        self.client = client
+        self.refresh_interval_secs = refresh_interval_secs
+        self.max_age_secs = max_age_secs
+        self.balances_updated_at = 0.0
+        self.prices_updated_at = 0.0
+        self._balances = {}
+        self._prices = {}
+        self._num_fills = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """Fetches the snapshot, then starts refreshing it in the background.
+        If the first fetch fails, the error is printed and the snapshot is
+        left empty until the next refresh.
+        """
+        self._refresh_quietly()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._refresh_loop,
+                                        name="account-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _refresh_loop(self) -> None:
+        while not self._stop_event.wait(self.refresh_interval_secs):
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Error refreshing account snapshot:", e)
+
+    def refresh(self) -> None:
+        """Fetches balances and prices now, blocking until done. If a refresh
+        is already running, waits for it instead of starting another.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            with self._refresh_lock:
+                return
+        try:
+            with self._lock:
+                num_fills = self._num_fills
+            account = self.client.get_account()
+            balances = {balance['asset']: float(balance['free'])
+                        for balance in account['balances']}
+            balances_updated_at = time.time()
+            with self._lock:
+                if self._num_fills == num_fills:
+                    self._balances = balances
+                    self.balances_updated_at = balances_updated_at
+
+            tickers = self.client.get_symbol_ticker()
+            prices = {ticker['symbol']: float(ticker['price']) for ticker in tickers}
+            prices_updated_at = time.time()
+            with self._lock:
+                self._prices = prices
+                self.prices_updated_at = prices_updated_at
+        finally:
+            self._refresh_lock.release()
+
+    def refresh_in_background(self) -> None:
+        """Starts a refresh without waiting for it, e.g. when the snapshot is
+        found to be stale on the trading path
+        """
+        threading.Thread(target=self._refresh_quietly, daemon=True).start()
+
+    def _refresh_quietly(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            print("Error refreshing account snapshot:", e)
+
+    def age_secs(self) -> float:
+        """Time since the older of the balances and prices was fetched
+        """
+        return time.time() - min(self.balances_updated_at, self.prices_updated_at)
+
+    def is_stale(self) -> bool:
+        return self.age_secs() > self.max_age_secs
+
+    def get_balance(self, asset: str) -> float:
+        with self._lock:
+            return self._balances.get(asset, 0.0)
+
+    def get_price(self, symbol: str) -> Optional[float]:
+        with self._lock:
+            return self._prices.get(symbol)
+
+    def get_usd_price(self, asset: str) -> Optional[float]:
+        if asset == "USDT":
+            return 1.0
+        return self.get_price(f"{asset}USDT")
+
+    def get_balance_usd(self, assets: Iterable[str]) -> float:
+        """Total value in USD of the balances of the assets given, raising a
+        KeyError if the price of any of them is unknown
+        """
+        total = 0.0
+        for asset in assets:
+            usd_price = self.get_usd_price(asset)
+            if usd_price is None:
+                raise KeyError(f"No price held for {asset}")
+            total += self.get_balance(asset)*usd_price
+        return total
+
+    def apply_fill(self, order: dict, base_asset: str, quote_asset: str) -> None:
+        """Updates the cached balances for an order returned by create_order,
+        so that they stay current until the next refresh
+        """
+        with self._lock:
+            self._num_fills += 1
+            sign = 1 if order['side'] == "BUY" else -1
+            for fill in order.get('fills', []):
+                qty = float(fill['qty'])
+                quote_qty = qty*float(fill['price'])
+                self._balances[base_asset] = self._balances.get(base_asset, 0.0) + sign*qty
+                self._balances[quote_asset] = (self._balances.get(quote_asset, 0.0)
+                                                - sign*quote_qty)
+
+                commission_asset = fill.get('commissionAsset')
+                if commission_asset:
+                    self._balances[commission_asset] = (
+                        self._balances.get(commission_asset, 0.0)
+                        - float(fill['commission']))
@@ -0,0 +1,200 @@
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from utilities import RingBuffer
+
+# Number of seconds in each unit an interval can be given in
+INTERVAL_UNIT_SECS = {"s": 1, "m": 60, "h": 60*60, "d": 24*60*60}
+
+
+def parse_interval(interval: str) -> int:
+    """Returns the length in seconds of an interval given in the format used
+    by Binance, e.g. "15s", "1m", "5m" or "1h"
+    """
+    try:
+        interval_secs = int(interval[:-1])*INTERVAL_UNIT_SECS[interval[-1]]
+    except (KeyError, ValueError, IndexError):
+        raise ValueError(f"Invalid interval {interval!r}")
+    if interval_secs <= 0:
+        raise ValueError(f"Invalid interval {interval!r}")
+    return interval_secs
+
+
+class BarAggregator():
+    """Builds OHLCV bars of a single interval, either from individual trades
+    or from bars of a shorter interval (e.g. 5 minute bars from 1 minute
+    candles). Bars are aligned to multiples of the interval since the epoch,
+    and completed bars are held in ring buffers, so that the most recent
+    capacity bars can be read as views without copying.
+
+    Bars built from trades are completed by the first trade of a later bar,
+    and any intervals without trades are filled with flat bars of zero
+    volume, so that the bars held are evenly spaced. Bars built from shorter
+    bars are completed as soon as the last shorter bar within them is added.
+
+    Attributes
+    ----------
+    interval : str
+        The interval of the bars, e.g. "15s"
+    interval_ms : int
+        The length of the interval in milliseconds
+    bars : RingBuffer
+        Completed bars, as rows of (open, high, low, close, volume)
+    closes : RingBuffer
+        Closing prices of the completed bars, held separately so that they
+        are contiguous
+    open_times : RingBuffer
+        Time at which each completed bar opened, in milliseconds since the
+        epoch
+    """
+    def __init__(self, interval: str, capacity: int = 1000) -> None:
+        self.interval = interval
+        self.interval_ms = parse_interval(interval)*1000
+        self.bars = RingBuffer(capacity, width=5)
+        self.closes = RingBuffer(capacity)
+        self.open_times = RingBuffer(capacity, dtype=np.int64)
+        self._bar_open_ms = -1
+        self._bar = None
+        self._completed_open_ms = -1
+
+    def __len__(self) -> int:
+        return len(self.bars)
+
+    def _complete_bar(self) -> None:
+        self.bars.append(self._bar)
+        self.closes.append(self._bar[3])
+        self.open_times.append(self._bar_open_ms)
+        self._completed_open_ms = self._bar_open_ms
+        self._bar = None
+
+    def add_trade(self, ts_ms: int, price: float, quantity: float) -> int:
+        """Adds a trade, returning the number of bars completed by it
+        """
+        bar_open_ms = ts_ms - ts_ms % self.interval_ms
+        # Trades and bars for bars which have already been completed are
+        # ignored
+        if bar_open_ms < self._bar_open_ms or bar_open_ms <= self._completed_open_ms:
+            return 0
+
+        num_completed = 0
+        if bar_open_ms > self._bar_open_ms and self._bar is not None:
+            last_close = self._bar[3]
+            self._complete_bar()
+            num_completed += 1
+
+            # Filling intervals without trades with flat bars, of which no more
+            # than the capacity of the buffers are needed
+            num_missing = (bar_open_ms - self._bar_open_ms)//self.interval_ms - 1
+            num_filled = min(num_missing, self.bars.capacity)
+            if num_filled > 0:
+                first_filled_ms = bar_open_ms - num_filled*self.interval_ms
+                self.bars.extend(np.tile([last_close, last_close, last_close,
+                                            last_close, 0.0], (num_filled, 1)))
+                self.closes.extend(np.full(num_filled, last_close))
+                self.open_times.extend(first_filled_ms
+                                        + self.interval_ms*np.arange(num_filled))
+                num_completed += num_filled
+
+        if self._bar is None:
+            self._bar_open_ms = bar_open_ms
+            self._bar = [price, price, price, price, quantity]
+        else:
+            bar = self._bar
+            if price > bar[1]:
+                bar[1] = price
+            if price < bar[2]:
+                bar[2] = price
+            bar[3] = price
+            bar[4] += quantity
+        return num_completed
+
+    def add_bar(self, open_ms: int, interval_ms: int,
+                    ohlcv: Tuple[float, float, float, float, float]) -> int:
+        """Adds a completed bar of a shorter interval which divides this one,
+        e.g. a closed 1 minute candle, returning the number of bars completed
+        by it
+        """
+        bar_open_ms = open_ms - open_ms % self.interval_ms
+        # Trades and bars for bars which have already been completed are
+        # ignored
+        if bar_open_ms < self._bar_open_ms or bar_open_ms <= self._completed_open_ms:
+            return 0
+
+        num_completed = 0
+        if bar_open_ms > self._bar_open_ms and self._bar is not None:
+            # The last shorter bar of the previous bar was missed
+            self._complete_bar()
+            num_completed += 1
+
+        open_price, high, low, close, volume = ohlcv
+        if self._bar is None:
+            self._bar_open_ms = bar_open_ms
+            self._bar = [open_price, high, low, close, volume]
+        else:
+            bar = self._bar
+            bar[1] = max(bar[1], high)
+            bar[2] = min(bar[2], low)
+            bar[3] = close
+            bar[4] += volume
+
+        if open_ms + interval_ms >= bar_open_ms + self.interval_ms:
+            self._complete_bar()
+            num_completed += 1
+        return num_completed
+
+
+class MultiTimeframeAggregator():
+    """Holds bars of several intervals at once for a single symbol, all built
+    from the same stream. Intervals which are multiples of the kline interval
+    are built from closed klines, and shorter intervals from individual
+    trades, so that a single kline stream, plus a trade stream if any
+    sub-minute intervals are needed, serves every interval.
+
+    Attributes
+    ----------
+    aggregators : Dict[str, BarAggregator]
+        The aggregator for each interval, keyed by interval
+    kline_interval_ms : int
+        The interval of the klines received, in milliseconds
+    """
+    def __init__(self, intervals: Iterable[str], capacity: int = 1000,
+                    kline_interval: str = "1m") -> None:
+        self.kline_interval_ms = parse_interval(kline_interval)*1000
+        self.aggregators = {interval: BarAggregator(interval, capacity)
+                            for interval in intervals}
+        self._kline_aggregators = []
+        self._trade_aggregators = []
+        for aggregator in self.aggregators.values():
+            if aggregator.interval_ms >= self.kline_interval_ms:
+                if aggregator.interval_ms % self.kline_interval_ms:
+                    raise ValueError(f"Interval {aggregator.interval} is not a "
+                                        f"multiple of {kline_interval}")
+                self._kline_aggregators.append(aggregator)
+            else:
+                self._trade_aggregators.append(aggregator)
+
+    def __getitem__(self, interval: str) -> BarAggregator:
+        return self.aggregators[interval]
+
+    @property
+    def needs_trades(self) -> bool:
+        """Whether any interval is shorter than the kline interval, and so
+        needs to be built from trades
+        """
+        return bool(self._trade_aggregators)
+
+    def add_trade(self, ts_ms: int, price: float, quantity: float) -> List[str]:
+        """Adds a trade to the intervals built from trades, returning the
+        intervals for which bars were completed
+        """
+        return [aggregator.interval for aggregator in self._trade_aggregators
+                if aggregator.add_trade(ts_ms, price, quantity)]
+
+    def add_kline(self, open_ms: int,
+                    ohlcv: Tuple[float, float, float, float, float]) -> List[str]:
+        """Adds a closed kline to the intervals built from klines, returning
+        the intervals for which bars were completed
+        """
+        return [aggregator.interval for aggregator in self._kline_aggregators
+                if aggregator.add_bar(open_ms, self.kline_interval_ms, ohlcv)]
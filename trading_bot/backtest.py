@@ -0,0 +1,275 @@
+# Core Python modules
+import argparse
+import time
+from typing import Tuple
+
+# Project modules
+from candle_store import CANDLE_FILE_EXTENSION, open_candle_file
+from strategies import (StrategyInterface, BasicRSI, RSIWithBreakoutConfirmation,
+                        MultiTimeframeRSI, BasicLSTM)
+
+# Additional modules
+import numpy as np
+import pandas as pd
+
+# Defaults match the trailing stop loss used by trading_bot.py
+STOP_LOSS_THRESHOLD = 0.5/100
+STOP_LOSS_COOL_DOWN_MINS = 5
+TRADE_QUANTITY = 0.001
+
+
+class BacktestResult():
+    """Trades made during a backtest, stored as arrays with one entry per
+    round trip (buy followed by sell).
+
+    Attributes
+    ----------
+    entry_idx : np.ndarray
+        Index of the candle at which each position was opened
+    exit_idx : np.ndarray
+        Index of the candle at which each position was closed
+    entry_price : np.ndarray
+        Closing price at entry_idx
+    exit_price : np.ndarray
+        Closing price at exit_idx
+    stop_loss_triggered : np.ndarray
+        Whether the trailing stop loss had been reached when each position was
+        closed
+    pnl : np.ndarray
+        Profit or loss of each trade, in units of the asset sold
+    open_position_idx : int
+        Index of the candle at which a position was opened but not closed
+        before the end of the data, or -1 if no position was left open
+    """
+    def __init__(self, entry_idx: np.ndarray, exit_idx: np.ndarray,
+                    stop_loss_triggered: np.ndarray, closes_arr: np.ndarray,
+                    quantity: float, fee_rate: float,
+                    open_position_idx: int) -> None:
+        self.entry_idx = entry_idx
+        self.exit_idx = exit_idx
+        self.entry_price = closes_arr[entry_idx]
+        self.exit_price = closes_arr[exit_idx]
+        self.stop_loss_triggered = stop_loss_triggered
+        self.pnl = (quantity*(self.exit_price - self.entry_price)
+                    - fee_rate*quantity*(self.entry_price + self.exit_price))
+        self.open_position_idx = open_position_idx
+
+    @property
+    def num_trades(self) -> int:
+        return len(self.pnl)
+
+    @property
+    def total_pnl(self) -> float:
+        return float(self.pnl.sum())
+
+    @property
+    def win_rate(self) -> float:
+        if self.num_trades == 0:
+            return 0.0
+        return float((self.pnl > 0).mean())
+
+    @property
+    def max_drawdown(self) -> float:
+        """Largest fall in cumulative PnL from a previous peak, measured
+        between trades
+        """
+        if self.num_trades == 0:
+            return 0.0
+        cumulative_pnl = np.concatenate([[0], np.cumsum(self.pnl)])
+        drawdowns = np.maximum.accumulate(cumulative_pnl) - cumulative_pnl
+        return float(drawdowns.max())
+
+    def summary(self) -> str:
+        return (f"trades: {self.num_trades}, "
+                f"stop losses: {int(self.stop_loss_triggered.sum())}, "
+                f"win rate: {self.win_rate:.2%}, "
+                f"total PnL: {self.total_pnl:.4f}, "
+                f"max drawdown: {self.max_drawdown:.4f}")
+
+
+def load_historical_closes(csv_path: str, close_col: str = "close") -> np.ndarray:
+    """Loads the closing prices from a historical 1-minute candle CSV, such as
+    the BTCUSDT_historial_binance_*.csv file used to train the LSTM, or from a
+    candle store file (see candle_store.py), which is memory-mapped rather
+    than parsed.
+    """
+    if csv_path.endswith(CANDLE_FILE_EXTENSION):
+        return np.ascontiguousarray(open_candle_file(csv_path)["close"])
+    df = pd.read_csv(csv_path, usecols=[close_col], dtype={close_col: np.float64})
+    return df[close_col].values
+
+
+def first_stop_loss_idx(closes_arr: np.ndarray, entry_idx: int, end_idx: int,
+                            stop_loss_threshold: float) -> int:
+    """Returns the index of the first candle after entry_idx, and no later than
+    end_idx, at which the trailing stop loss is reached, or -1 if it is not
+    reached. The price is scanned in chunks of increasing size, so that short
+    positions are cheap to check and long ones need few iterations.
+    """
+    max_price_since_buy = closes_arr[entry_idx]
+    start = entry_idx + 1
+    chunk_size = 64
+    while start <= end_idx:
+        prices = closes_arr[start:min(start + chunk_size, end_idx + 1)]
+        max_prices = np.maximum.accumulate(prices)
+        np.maximum(max_prices, max_price_since_buy, out=max_prices)
+
+        hits = np.flatnonzero(prices <= (1 - stop_loss_threshold)*max_prices)
+        if hits.size:
+            return start + int(hits[0])
+
+        max_price_since_buy = max_prices[-1]
+        start += len(prices)
+        chunk_size *= 2
+    return -1
+
+
+def simulate_trades(closes_arr: np.ndarray, should_sell: np.ndarray,
+                        should_buy: np.ndarray,
+                        stop_loss_threshold: float = STOP_LOSS_THRESHOLD,
+                        cool_down_mins: int = STOP_LOSS_COOL_DOWN_MINS
+                        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """Applies the position, trailing stop loss and cool-down logic of
+    consider_trade to precomputed signal arrays. Rather than stepping through
+    every candle, this jumps straight from each entry to the next exit and
+    back, so the cost scales with the number of trades made.
+
+    Parameters
+    ----------
+    closes_arr : np.ndarray
+        Numpy array of closing prices
+    should_sell : np.ndarray
+        Boolean array, True where the strategy would sell if a position is held
+    should_buy : np.ndarray
+        Boolean array, True where the strategy would buy if no position is held
+    stop_loss_threshold : float
+        Fall from the maximum price since buying at which the position is sold
+    cool_down_mins : int
+        Number of candles after a stop loss before another buy is allowed
+
+    Returns
+    -------
+    entry_idx, exit_idx, stop_loss_triggered : np.ndarray
+        Arrays describing each completed round trip
+    open_position_idx : int
+        Index of the entry of a position still open at the end of the data, or
+        -1 if there is none
+    """
+    num_candles = len(closes_arr)
+    buy_idx = np.flatnonzero(should_buy)
+    sell_idx = np.flatnonzero(should_sell)
+
+    entries, exits, stops = [], [], []
+    open_position_idx = -1
+    last_position_stop_triggered = -1000
+
+    # As in on_candle_close, at least two closing prices are required before
+    # a trade is considered
+    cur_idx = 1
+    while True:
+        earliest_buy = max(cur_idx, last_position_stop_triggered + cool_down_mins)
+        k = np.searchsorted(buy_idx, earliest_buy)
+        if k == len(buy_idx):
+            break
+        entry_idx = int(buy_idx[k])
+
+        # The position is closed at the next sell signal, unless the trailing
+        # stop loss is reached first
+        k = np.searchsorted(sell_idx, entry_idx, side='right')
+        signal_exit_idx = int(sell_idx[k]) if k < len(sell_idx) else num_candles - 1
+        exit_idx = first_stop_loss_idx(closes_arr, entry_idx, signal_exit_idx,
+                                        stop_loss_threshold)
+        if exit_idx == -1:
+            if k == len(sell_idx):
+                open_position_idx = entry_idx
+                break
+            exit_idx = signal_exit_idx
+
+        # The stop loss flag is set whenever the threshold has been reached,
+        # even if the strategy would have sold anyway
+        max_price_since_buy = closes_arr[entry_idx:exit_idx + 1].max()
+        stop_loss_triggered = (closes_arr[exit_idx]
+                                <= (1 - stop_loss_threshold)*max_price_since_buy)
+        if stop_loss_triggered:
+            last_position_stop_triggered = exit_idx
+
+        entries.append(entry_idx)
+        exits.append(exit_idx)
+        stops.append(stop_loss_triggered)
+        cur_idx = exit_idx + 1
+
+    return (np.array(entries, dtype=np.int64), np.array(exits, dtype=np.int64),
+            np.array(stops, dtype=bool), open_position_idx)
+
+
+def run_backtest(strategy: StrategyInterface, closes_arr: np.ndarray,
+                    stop_loss_threshold: float = STOP_LOSS_THRESHOLD,
+                    cool_down_mins: int = STOP_LOSS_COOL_DOWN_MINS,
+                    quantity: float = TRADE_QUANTITY,
+                    fee_rate: float = 0) -> BacktestResult:
+    """Backtests a strategy over a series of closing prices. The strategy's
+    signals are computed for the whole series at once, using its
+    vectorised_signals method, and are then passed to simulate_trades.
+
+    Note that the RSI strategies compute the RSI over the whole series, which
+    matches the values given by their update method, rather than over a window
+    of RSI_PERIOD + 2 prices as their calc method does.
+    """
+    closes_arr = np.asarray(closes_arr, dtype=float)
+    should_sell, should_buy = strategy.vectorised_signals(closes_arr)
+    return run_backtest_on_signals(closes_arr, should_sell, should_buy,
+                                    stop_loss_threshold, cool_down_mins,
+                                    quantity, fee_rate)
+
+
+def run_backtest_on_signals(closes_arr: np.ndarray, should_sell: np.ndarray,
+                                should_buy: np.ndarray,
+                                stop_loss_threshold: float = STOP_LOSS_THRESHOLD,
+                                cool_down_mins: int = STOP_LOSS_COOL_DOWN_MINS,
+                                quantity: float = TRADE_QUANTITY,
+                                fee_rate: float = 0) -> BacktestResult:
+    """Backtests signals which have already been computed, e.g. from features
+    shared between several parameter sets (see optimise.py)
+    """
+    entry_idx, exit_idx, stop_loss_triggered, open_position_idx = simulate_trades(
+        closes_arr, should_sell, should_buy, stop_loss_threshold, cool_down_mins)
+    return BacktestResult(entry_idx, exit_idx, stop_loss_triggered, closes_arr,
+                            quantity, fee_rate, open_position_idx)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest a strategy on "
+                                        "historical 1-minute closing prices")
+    parser.add_argument("csv_path", help="CSV of historical candles, or a candle "
+                        "store file")
+    parser.add_argument("--strategy", choices=["rsi", "rsi_breakout", "mtf_rsi", "lstm"],
+                        default="lstm")
+    parser.add_argument("--model-path", default="../../models/LSTM/model_save")
+    parser.add_argument("--rsi-period", type=int, default=14)
+    parser.add_argument("--rsi-overbought", type=float, default=70)
+    parser.add_argument("--rsi-oversold", type=float, default=30)
+    parser.add_argument("--confirmation-interval", default="15m")
+    parser.add_argument("--percent-buy-threshold", type=float, default=0.1)
+    parser.add_argument("--percent-sell-threshold", type=float, default=1)
+    parser.add_argument("--fee-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    if args.strategy == "rsi":
+        strategy = BasicRSI(args.rsi_period, args.rsi_overbought, args.rsi_oversold)
+    elif args.strategy == "rsi_breakout":
+        strategy = RSIWithBreakoutConfirmation(args.rsi_period,
+                                                args.rsi_overbought,
+                                                args.rsi_oversold)
+    elif args.strategy == "mtf_rsi":
+        strategy = MultiTimeframeRSI(args.rsi_period, args.rsi_overbought,
+                                        args.rsi_oversold, args.confirmation_interval)
+    else:
+        strategy = BasicLSTM(args.model_path, args.percent_buy_threshold,
+                                args.percent_sell_threshold)
+
+    closes = load_historical_closes(args.csv_path)
+    start_time = time.perf_counter()
+    result = run_backtest(strategy, closes, fee_rate=args.fee_rate)
+    print(f"Backtested {len(closes)} candles in "
+          f"{time.perf_counter() - start_time:.2f}s")
+    print(result.summary())
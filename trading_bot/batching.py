@@ -0,0 +1,81 @@
+import threading
+from typing import Any, Callable, Hashable, Iterable, List
+
+
+class CandleBatcher():
+    """Collects the candle closes of several symbols for the same minute, so
+    that they can be processed together (e.g. with a single batched model
+    prediction) rather than one at a time. A batch is processed as soon as
+    every expected symbol has closed its candle, or once max_wait_secs has
+    passed since the first symbol closed, whichever comes first. Candles
+    arriving after their batch has been processed are processed immediately,
+    on their own.
+
+    Attributes
+    ----------
+    process_batch : Callable[[List[Any]], None]
+        Function called with the list of items submitted for a minute
+    expected_keys : set
+        Keys (e.g. symbols) expected to submit an item for each minute
+    max_wait_secs : float
+        Maximum time to wait for the remaining keys once a batch has started
+    """
+    def __init__(self, process_batch: Callable[[List[Any]], None],
+                    expected_keys: Iterable[Hashable],
+                    max_wait_secs: float = 2.0) -> None:
+        self.process_batch = process_batch
+        self.expected_keys = set(expected_keys)
+        self.max_wait_secs = max_wait_secs
+        self._lock = threading.Lock()
+        self._batch_ts = None
+        self._pending = {}
+        self._timer = None
+        self._last_processed_ts = None
+
+    def submit(self, candle_ts: Hashable, key: Hashable, item: Any) -> None:
+        """Adds the item for key to the batch for candle_ts, processing the
+        batch if it is now complete
+        """
+        batches = []
+        with self._lock:
+            if candle_ts == self._last_processed_ts:
+                batches.append([item])
+            else:
+                # A new minute beginning means the previous batch will not be
+                # completed, so it is processed before starting the next one
+                if self._pending and candle_ts != self._batch_ts:
+                    batches.append(self._take_batch())
+                self._batch_ts = candle_ts
+                self._pending[key] = item
+                if self.expected_keys.issubset(self._pending):
+                    batches.append(self._take_batch())
+                elif self._timer is None:
+                    self._timer = threading.Timer(self.max_wait_secs,
+                                                    self._on_timeout, (candle_ts,))
+                    self._timer.daemon = True
+                    self._timer.start()
+
+        for batch in batches:
+            self.process_batch(batch)
+
+    def _on_timeout(self, candle_ts: Hashable) -> None:
+        with self._lock:
+            if candle_ts != self._batch_ts or not self._pending:
+                return
+            batch = self._take_batch()
+        try:
+            self.process_batch(batch)
+        except Exception as e:
+            print("Error processing candle batch:", e)
+
+    def _take_batch(self) -> List[Any]:
+        """Removes and returns the pending items. Must be called with the lock
+        held.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = list(self._pending.values())
+        self._pending = {}
+        self._last_processed_ts = self._batch_ts
+        return batch
@@ -0,0 +1,451 @@
+# Core Python modules
+import argparse
+import contextlib
+from datetime import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+# Project modules
+from aggregation import MultiTimeframeAggregator
+from optimise import create_strategy
+from replay import import_stub_bot, read_recording, shutdown_bot
+from stream_parsing import KlineUpdate, MS_PER_MINUTE, parse_stream_message
+from utilities import append_data, CSVLogWriter, RingBuffer
+
+# Additional modules
+import numpy as np
+
+# Results of each run are saved to a JSON file in this directory, so that
+# runs can be compared
+BENCHMARK_RESULTS_DIR = "../Benchmarks"
+
+# Benchmarks which can be run, in the order they are run
+BENCHMARKS = ("messages", "strategies", "append_data", "plot")
+
+# Units of the LSTM layers in the model built by the training notebook, used
+# for the randomly weighted model benchmarked when no model is given
+LSTM_LAYER_UNITS = (64, 128, 64, 32)
+
+# Strategies benchmarked, named as in backtest.py and optimise.py
+STRATEGY_NAMES = ("rsi", "rsi_breakout", "mtf_rsi", "lstm")
+
+# Sizes of the synthetic inputs for a full run, and for a quick run (--quick)
+FULL_SIZES = {
+    "stream_minutes": 600,
+    "updates_per_minute": 30,
+    "strategy_candles": 2000,
+    "predictions": 200,
+    "append_rows": 20_000,
+    "plot_rows": (1_000, 10_000, 100_000, 1_000_000),
+}
+QUICK_SIZES = {
+    "stream_minutes": 200,
+    "updates_per_minute": 10,
+    "strategy_candles": 300,
+    "predictions": 20,
+    "append_rows": 2_000,
+    "plot_rows": (1_000, 10_000),
+}
+
+# A benchmark is reported as a regression if it is this much worse (as a
+# fraction) than the baseline it is compared with
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+
+
+def synthetic_closes(num_closes: int, start_price: float = 20_000,
+                        seed: int = 0) -> np.ndarray:
+    """Returns a random walk of closing prices, the same for a given seed
+    """
+    rng = np.random.default_rng(seed)
+    return start_price*np.exp(np.cumsum(rng.normal(0, 1e-3, num_closes)))
+
+
+def synthetic_kline_messages(symbols: Sequence[str], num_minutes: int,
+                                updates_per_minute: int, start_ms: int = 1_600_000_000_000,
+                                seed: int = 0) -> List[str]:
+    """Returns combined stream messages for the 1 minute klines of each symbol,
+    in the format sent by Binance, with updates_per_minute updates to each
+    candle, the last of which closes it
+    """
+    rng = np.random.default_rng(seed)
+    messages = []
+    prices = {symbol: synthetic_closes(num_minutes*updates_per_minute,
+                                        seed=seed + i)
+                for i, symbol in enumerate(symbols)}
+    for minute in range(num_minutes):
+        open_ms = start_ms + minute*MS_PER_MINUTE
+        for update in range(updates_per_minute):
+            event_ms = open_ms + (update + 1)*MS_PER_MINUTE//updates_per_minute - 1
+            for symbol in symbols:
+                candle_prices = prices[symbol][minute*updates_per_minute:
+                                                minute*updates_per_minute + update + 1]
+                kline = {
+                    "t": open_ms, "T": open_ms + MS_PER_MINUTE - 1, "s": symbol,
+                    "i": "1m", "o": f"{candle_prices[0]:.2f}",
+                    "c": f"{candle_prices[-1]:.2f}", "h": f"{candle_prices.max():.2f}",
+                    "l": f"{candle_prices.min():.2f}",
+                    "v": f"{rng.uniform(0, 10)*(update + 1):.5f}",
+                    "x": update == updates_per_minute - 1,
+                }
+                messages.append(json.dumps({
+                    "stream": f"{symbol.lower()}@kline_1m",
+                    "data": {"e": "kline", "E": event_ms, "s": symbol, "k": kline},
+                }))
+    return messages
+
+
+def write_random_lstm_weights(weights_path: str,
+                                layer_units: Sequence[int] = LSTM_LAYER_UNITS,
+                                seed: int = 0) -> None:
+    """Writes randomly initialised weights for a model with the layers of the
+    one built by the training notebook, in the format read by
+    lstm_numpy.NumpyLSTMModel, so that predictions can be benchmarked without
+    a trained model
+    """
+    rng = np.random.default_rng(seed)
+    arrays = {}
+    layer_types = []
+    num_inputs = 1
+    for i, units in enumerate(layer_units):
+        arrays[f"layer_{i}_kernel"] = rng.normal(0, 0.1, (num_inputs, 4*units))
+        arrays[f"layer_{i}_recurrent_kernel"] = rng.normal(0, 0.1, (units, 4*units))
+        arrays[f"layer_{i}_bias"] = np.zeros(4*units)
+        arrays[f"layer_{i}_return_sequences"] = np.array(i < len(layer_units) - 1)
+        layer_types.append("LSTM")
+        num_inputs = units
+    i = len(layer_units)
+    arrays[f"layer_{i}_kernel"] = rng.normal(0, 0.1, (num_inputs, 1))
+    arrays[f"layer_{i}_bias"] = np.ones(1)
+    layer_types.append("Dense")
+    np.savez_compressed(weights_path, layer_types=np.array(layer_types), **arrays)
+
+
+def secs_per_call(func: Callable[[], Any], number: int, repeat: int = 3) -> float:
+    """Returns the time taken by each call of func, from the fastest of repeat
+    runs of number calls, as timeit recommends
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start_time)
+    return best/number
+
+
+def result(value: float, unit: str, higher_is_better: bool = False) -> Dict[str, Any]:
+    return {"value": float(value), "unit": unit, "higher_is_better": higher_is_better}
+
+
+def bench_messages(messages: List[str], work_dir: str, model_path: str) -> Dict[str, dict]:
+    """Measures the rate at which on_message_helper in trading_bot.py handles
+    stream messages (passed to it through on_message, as by the websocket, so
+    that any exceptions are caught as they are when trading), and the cost of
+    the messages which close a candle (which includes the strategy, LSTM
+    inference and logging). The bot is run against the stub exchange, with
+    its CSVs and candle store written under work_dir, so nothing is sent to
+    the exchange.
+    """
+    prev_dir = os.getcwd()
+    try:
+        trading_bot = import_stub_bot(work_dir, model_path)
+        trading_bot.price_printer.min_interval_secs = float("inf")
+
+        # Messages are timed one at a time, so that those closing a candle
+        # can be reported separately
+        closes_candle = [isinstance(update, KlineUpdate) and update.is_closed
+                            for update in map(parse_stream_message, messages)]
+        durations = np.empty(len(messages))
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for i, message in enumerate(messages):
+                start_time = time.perf_counter()
+                trading_bot.on_message(None, message)
+                durations[i] = time.perf_counter() - start_time
+
+        shutdown_bot(trading_bot)
+    finally:
+        os.chdir(prev_dir)
+
+    closes_candle = np.array(closes_candle, dtype=bool)
+    results = {"messages.ticks_per_sec": result(len(messages)/durations.sum(),
+                                                "ticks/s", True)}
+    if (~closes_candle).any():
+        results["messages.update_us"] = result(np.median(durations[~closes_candle])*1e6,
+                                                "us")
+    if closes_candle.any():
+        results["messages.candle_close_ms"] = result(durations[closes_candle].mean()*1e3,
+                                                        "ms")
+    return results
+
+
+def bench_strategies(closes: np.ndarray, model_path: str,
+                        num_predictions: int) -> Dict[str, dict]:
+    """Measures the cost per candle of each strategy, as it is used when each
+    candle closes in trading_bot.py, and the cost of a single LSTM prediction
+    """
+    results = {}
+    for strategy_name in STRATEGY_NAMES:
+        strategy = create_strategy(strategy_name, {}, model_path)
+        closes_buffer = RingBuffer(strategy.MAX_MINS_OF_PRICES_HELD_IN_MEMORY)
+        extra_timeframes = [interval for interval in strategy.TIMEFRAMES if interval != "1m"]
+        timeframes = MultiTimeframeAggregator(extra_timeframes) if extra_timeframes else None
+
+        # The strategy is warmed up first, so that every candle timed can
+        # be traded on
+        num_warm_up = strategy.MAX_MINS_OF_PRICES_HELD_IN_MEMORY
+        closes_buffer.extend(closes[:num_warm_up])
+        strategy.warm_up(closes[:num_warm_up])
+
+        in_long_position = False
+        start_time = time.perf_counter()
+        for minute in range(num_warm_up, len(closes)):
+            close = closes[minute]
+            closes_buffer.append(close)
+            if timeframes is not None:
+                completed = timeframes.add_kline(minute*MS_PER_MINUTE, (close,)*4 + (0,))
+                for interval in completed:
+                    strategy.on_bar(interval, timeframes[interval].closes.view())
+            closes_arr = closes_buffer.view()
+            features = strategy.calc_after_update(closes_arr, strategy.update(close))
+            should_sell, should_buy = strategy.should_sell_and_buy(features, closes_arr,
+                                                                    in_long_position)
+            in_long_position = (in_long_position or should_buy) and not should_sell
+        num_candles = len(closes) - num_warm_up
+        results[f"strategies.{type(strategy).__name__}_us_per_candle"] = result(
+            (time.perf_counter() - start_time)/num_candles*1e6, "us")
+
+        if strategy_name == "lstm":
+            window = np.array(closes[-120:])
+            results["strategies.BasicLSTM.predict_30_min_price_ms"] = result(
+                secs_per_call(lambda: strategy.predict_30_min_price(window),
+                                num_predictions)*1e3, "ms")
+    return results
+
+
+def bench_append_data(work_dir: str, num_rows: int) -> Dict[str, dict]:
+    """Measures the rate at which rows of trading data are written with
+    append_data, which opens the CSV for every row, and with CSVLogWriter
+    """
+    col_names = ["datetime_collected", "datetime", "price", "trade_made"]
+    session = str(datetime(2021, 1, 1))
+    rows = [[session, str(datetime.fromtimestamp(1_600_000_000 + 60*i)), 20_000 + i, "None"]
+            for i in range(num_rows)]
+
+    csv_path = os.path.join(work_dir, "append_data.csv")
+    start_time = time.perf_counter()
+    for row in rows:
+        append_data(csv_path, col_names, row)
+    append_data_secs = time.perf_counter() - start_time
+
+    csv_path = os.path.join(work_dir, "log_writer.csv")
+    start_time = time.perf_counter()
+    log_writer = CSVLogWriter(flush_interval_secs=3600)
+    for row in rows:
+        log_writer.append(csv_path, col_names, row)
+    log_writer.close()
+    log_writer_secs = time.perf_counter() - start_time
+
+    return {
+        "append_data.rows_per_sec": result(num_rows/append_data_secs, "rows/s", True),
+        "append_data.log_writer_rows_per_sec": result(num_rows/log_writer_secs,
+                                                        "rows/s", True),
+    }
+
+
+def bench_plot(work_dir: str, row_counts: Sequence[int]) -> Dict[str, dict]:
+    """Measures the time taken by plot_trade_data in visualise.py to refresh
+    the plot, including drawing it, as the trading data CSV grows. Both the
+    first refresh, which reads the whole current session, and a later
+    refresh, after another candle has been appended, are timed.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import visualise
+
+    col_names = visualise.TradeDataTail.COL_NAMES
+    session = str(datetime(2021, 1, 1))
+    closes = synthetic_closes(max(row_counts) + 1)
+    trades = np.random.default_rng(0).choice(["None", "buy", "sell"], len(closes),
+                                                p=[0.98, 0.01, 0.01])
+    rows = [[session, str(datetime.fromtimestamp(1_600_000_000 + 60*i)),
+                round(closes[i], 2), trades[i]] for i in range(len(closes))]
+
+    results = {}
+    for num_rows in row_counts:
+        csv_path = os.path.join(work_dir, f"plot_{num_rows}.csv")
+        append_data(csv_path, col_names, rows[0])
+        log_writer = CSVLogWriter(flush_interval_secs=3600)
+        for row in rows[1:num_rows]:
+            log_writer.append(csv_path, col_names, row)
+        log_writer.close()
+
+        trade_data_tail = visualise.TradeDataTail(csv_path)
+        start_time = time.perf_counter()
+        visualise.plot_trade_data(trade_data_tail)
+        visualise.fig.canvas.draw()
+        first_refresh_secs = time.perf_counter() - start_time
+
+        append_data(csv_path, col_names, rows[num_rows])
+        start_time = time.perf_counter()
+        visualise.plot_trade_data(trade_data_tail)
+        visualise.fig.canvas.draw()
+        refresh_secs = time.perf_counter() - start_time
+
+        results[f"plot.first_refresh_ms[rows={num_rows}]"] = result(first_refresh_secs*1e3, "ms")
+        results[f"plot.refresh_ms[rows={num_rows}]"] = result(refresh_secs*1e3, "ms")
+    return results
+
+
+def run_benchmarks(benchmarks: Sequence[str] = BENCHMARKS, quick: bool = False,
+                    recording_path: Optional[str] = None,
+                    model_path: Optional[str] = None) -> Dict[str, dict]:
+    """Runs the benchmarks named, on synthetic data (and the recorded stream
+    messages at recording_path, if given) in a temporary directory, returning
+    the result of each measurement keyed by name. If no model is given, a
+    NumPy model with random weights is used for the LSTM.
+    """
+    sizes = QUICK_SIZES if quick else FULL_SIZES
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        if model_path is None:
+            model_path = os.path.join(work_dir, "random_lstm.npz")
+            write_random_lstm_weights(model_path)
+        model_path = os.path.abspath(model_path)
+
+        for benchmark in benchmarks:
+            print(f"Running {benchmark} benchmarks")
+            if benchmark == "messages":
+                if recording_path is not None:
+                    messages = [message for _, message in read_recording(recording_path)]
+                else:
+                    messages = synthetic_kline_messages(["BTCUSDT"], sizes["stream_minutes"],
+                                                        sizes["updates_per_minute"])
+                results.update(bench_messages(messages, work_dir, model_path))
+            elif benchmark == "strategies":
+                results.update(bench_strategies(synthetic_closes(sizes["strategy_candles"]),
+                                                model_path, sizes["predictions"]))
+            elif benchmark == "append_data":
+                results.update(bench_append_data(work_dir, sizes["append_rows"]))
+            elif benchmark == "plot":
+                results.update(bench_plot(work_dir, sizes["plot_rows"]))
+            else:
+                raise ValueError(f"Unknown benchmark {benchmark}")
+    return results
+
+
+def git_commit() -> Optional[str]:
+    """Returns the hash of the commit checked out, if known
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results: Dict[str, dict], results_dir: str = BENCHMARK_RESULTS_DIR,
+                    run_info: Optional[Dict[str, Any]] = None) -> str:
+    """Saves the results, along with details of the machine and commit they
+    were measured on, to a new JSON file in results_dir, returning its path
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    created_at = datetime.now()
+    run = {
+        "created_at": str(created_at),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "run_info": run_info or {},
+        "results": results,
+    }
+    path = os.path.join(results_dir, f"benchmarks_{created_at:%Y%m%d_%H%M%S}.json")
+    with open(path, "w") as f:
+        json.dump(run, f, indent=2)
+    return path
+
+
+def latest_results_path(results_dir: str = BENCHMARK_RESULTS_DIR) -> Optional[str]:
+    """Returns the path of the most recent results saved in results_dir
+    """
+    paths = sorted(glob.glob(os.path.join(results_dir, "benchmarks_*.json")))
+    return paths[-1] if paths else None
+
+
+def compare_results(results: Dict[str, dict], baseline: Dict[str, dict],
+                        threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> List[str]:
+    """Prints the change in each result from the baseline, returning the names
+    of those which are worse by more than threshold (as a fraction)
+    """
+    regressions = []
+    for name, cur in results.items():
+        if name not in baseline or not baseline[name]["value"]:
+            print(f"{name:60} {cur['value']:12.3f} {cur['unit']}")
+            continue
+        change = cur["value"]/baseline[name]["value"] - 1
+        worse_by = -change if cur["higher_is_better"] else change
+        flag = ""
+        if worse_by > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:60} {cur['value']:12.3f} {cur['unit']:7} "
+                f"({change:+.1%} vs {baseline[name]['value']:.3f}){flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark message handling, "
+                                        "strategies and logging, saving the results "
+                                        "so that runs can be compared")
+    parser.add_argument("benchmarks", nargs="*",
+                        help="Benchmarks to run, from " + ", ".join(BENCHMARKS)
+                                + " (by default, all of them)")
+    parser.add_argument("--quick", action="store_true",
+                        help="Use smaller inputs, e.g. as a quick check before committing")
+    parser.add_argument("--recording", default=None,
+                        help="Recording of the stream (see replay.py) to benchmark "
+                                "message handling with, instead of a synthetic stream")
+    parser.add_argument("--model-path", default=None,
+                        help="LSTM model to benchmark (by default a NumPy model with "
+                                "random weights and the trained model's layers)")
+    parser.add_argument("--results-dir", default=BENCHMARK_RESULTS_DIR)
+    parser.add_argument("--baseline", default=None,
+                        help="Results file to compare with (by default the latest "
+                                "saved in the results directory)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="Fraction by which a result must be worse than the "
+                                "baseline to count as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with an error if any result has regressed")
+    args = parser.parse_args()
+
+    baseline_path = args.baseline or latest_results_path(args.results_dir)
+    results = run_benchmarks(args.benchmarks or BENCHMARKS, args.quick,
+                                args.recording, args.model_path)
+    run_info = {"quick": args.quick, "recording": args.recording,
+                "model_path": args.model_path}
+    results_path = save_results(results, args.results_dir, run_info)
+
+    baseline = {}
+    if baseline_path is not None:
+        with open(baseline_path) as f:
+            baseline_run = json.load(f)
+        print(f"\nCompared with {baseline_path} "
+                f"(commit {baseline_run.get('git_commit')}):")
+        if baseline_run.get("run_info", {}).get("quick") != args.quick:
+            print("Warning: the baseline was run with different input sizes")
+        baseline = baseline_run["results"]
+    regressions = compare_results(results, baseline, args.threshold)
+    print(f"\nSaved results to {results_path}")
+    if regressions and args.fail_on_regression:
+        sys.exit(f"{len(regressions)} benchmarks regressed by more than "
+                    f"{args.threshold:.0%}")
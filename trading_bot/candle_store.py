@@ -0,0 +1,313 @@
+# Core Python modules
+import argparse
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+# Additional modules
+import numpy as np
+import pandas as pd
+
+# Project modules
+from aggregation import parse_interval
+
+# Each candle is stored as a fixed-width record, so that a file of candles can
+# be memory-mapped directly as an array of them
+CANDLE_DTYPE = np.dtype([
+    ("open_time", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+])
+CANDLE_FILE_EXTENSION = ".candles"
+
+# Columns which may hold the open time of each candle in a historical CSV
+TIME_COLUMNS = ("open_time", "timestamp", "date", "datetime", "time")
+
+# A merge is given up on if the file keeps being appended to by another
+# process while it is rewritten
+MAX_MERGE_ATTEMPTS = 3
+
+
+def open_candle_file(path: str) -> np.ndarray:
+    """Memory-maps a file of candles written by CandleStore, returning a
+    read-only array of CANDLE_DTYPE records. Any partially written record at
+    the end of the file is left out.
+    """
+    num_candles = os.path.getsize(path)//CANDLE_DTYPE.itemsize if os.path.exists(path) else 0
+    if num_candles == 0:
+        return np.zeros(0, dtype=CANDLE_DTYPE)
+    return np.memmap(path, dtype=CANDLE_DTYPE, mode="r", shape=(num_candles,))
+
+
+def to_ms(times: pd.Series) -> np.ndarray:
+    """Converts times, given either as datetime strings or as milliseconds
+    since the epoch, to milliseconds since the epoch
+    """
+    if pd.api.types.is_numeric_dtype(times):
+        return times.to_numpy(dtype=np.int64)
+    return pd.to_datetime(times).to_numpy().astype("datetime64[ms]").astype(np.int64)
+
+
+class CandleStore():
+    """Store of candles on disk, holding one file per symbol of fixed-width
+    binary records (see CANDLE_DTYPE) in order of open time.
+
+    Files are memory-mapped when read, so loading years of 1 minute candles
+    takes milliseconds rather than the seconds needed to parse a CSV, and
+    since the records are sorted, the candles in a time range are found by
+    binary search on the open times, without reading the rest of the file.
+    Candles appended which are not newer than the last one stored are
+    ignored, so the same candles can safely be appended more than once.
+    Older candles, e.g. earlier history or those missing from a gap, are
+    added with merge instead, which rewrites the file.
+
+    Several processes may write to the same file, e.g. the bot appending
+    live candles while download.py runs. Before each write, a store checks
+    whether the file has changed since it last wrote to it, and if so reads
+    the last candle stored again, and reopens the file if it was replaced
+    by a merge.
+
+    Attributes
+    ----------
+    store_dir : str
+        Directory in which the file for each symbol is kept
+    interval : str
+        The interval of the candles stored, e.g. "1m"
+    """
+    def __init__(self, store_dir: str, interval: str = "1m") -> None:
+        self.store_dir = store_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._files = {}
+        self._last_open_times = {}
+        self._memmaps = {}
+        self._file_states = {}
+
+    def path(self, symbol: str) -> str:
+        return os.path.join(self.store_dir,
+                            f"{symbol}_{self.interval}{CANDLE_FILE_EXTENSION}")
+
+    def _candles(self, symbol: str) -> np.ndarray:
+        """Returns every candle stored for the symbol, memory-mapping the file
+        again only if it has grown since it was last mapped
+        """
+        path = self.path(symbol)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        cached = self._memmaps.get(symbol)
+        if cached is None or cached[0] != size:
+            cached = (size, open_candle_file(path))
+            self._memmaps[symbol] = cached
+        return cached[1]
+
+    def read(self, symbol: str, start_ms: Optional[int] = None,
+                end_ms: Optional[int] = None) -> np.ndarray:
+        """Returns the candles for the symbol which opened at or after start_ms
+        and before end_ms (given in milliseconds since the epoch), as a
+        read-only view of the memory-mapped file
+        """
+        candles = self._candles(symbol)
+        open_times = candles["open_time"]
+        start = 0 if start_ms is None else np.searchsorted(open_times, start_ms, "left")
+        end = len(candles) if end_ms is None else np.searchsorted(open_times, end_ms, "left")
+        return candles[start:end]
+
+    def closes(self, symbol: str, start_ms: Optional[int] = None,
+                end_ms: Optional[int] = None) -> np.ndarray:
+        """Returns the closing prices of the candles read, as a contiguous
+        array (e.g. for talib)
+        """
+        return np.ascontiguousarray(self.read(symbol, start_ms, end_ms)["close"])
+
+    def last_open_time(self, symbol: str) -> int:
+        """Returns the open time of the last candle stored for the symbol, or
+        -1 if there are none
+        """
+        with self._lock:
+            self._check_file(symbol)
+            return self._last_open_time(symbol)
+
+    def _last_open_time(self, symbol: str) -> int:
+        if symbol not in self._last_open_times:
+            candles = self._candles(symbol)
+            self._last_open_times[symbol] = int(candles["open_time"][-1]) if len(candles) else -1
+        return self._last_open_times[symbol]
+
+    def _file_state(self, symbol: str) -> Optional[Tuple[int, int]]:
+        """Returns the inode and size of the symbol's file, or None if there
+        is none
+        """
+        try:
+            stat = os.stat(self.path(symbol))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size
+
+    def _check_file(self, symbol: str) -> None:
+        """Drops what is held about the symbol's file if it has changed since
+        this store last wrote to it. Must be called with the lock held.
+        """
+        state = self._file_state(symbol)
+        if state != self._file_states.get(symbol):
+            candle_file = self._files.pop(symbol, None)
+            if candle_file is not None:
+                candle_file.close()
+            self._last_open_times.pop(symbol, None)
+            self._file_states[symbol] = state
+
+    def append(self, symbol: str, candles: np.ndarray) -> int:
+        """Appends an array of CANDLE_DTYPE records to the file for the symbol,
+        returning the number appended. Candles are sorted by open time, and
+        any not newer than the last one stored (or duplicated) are dropped.
+        """
+        candles = np.asarray(candles, dtype=CANDLE_DTYPE)
+        with self._lock:
+            self._check_file(symbol)
+            candles = np.sort(candles, order="open_time", kind="stable")
+            if len(candles):
+                # Keeping the last of any candles with the same open time
+                is_last = np.append(np.diff(candles["open_time"]) != 0, True)
+                candles = candles[is_last]
+                candles = candles[candles["open_time"] > self._last_open_time(symbol)]
+            if len(candles) == 0:
+                return 0
+
+            candle_file = self._files.get(symbol)
+            if candle_file is None:
+                os.makedirs(self.store_dir, exist_ok=True)
+                candle_file = open(self.path(symbol), "ab")
+                self._files[symbol] = candle_file
+            candle_file.write(candles.tobytes())
+            candle_file.flush()
+            self._last_open_times[symbol] = int(candles["open_time"][-1])
+            self._file_states[symbol] = self._file_state(symbol)
+        return len(candles)
+
+    def merge(self, symbol: str, candles: np.ndarray) -> int:
+        """Adds an array of CANDLE_DTYPE records to the file for the symbol,
+        whatever their open times, returning the number added. Candles with
+        the same open time as one already stored are dropped. The file is
+        rewritten to a temporary file which then replaces it in one step, and
+        if another process appends to it meanwhile, the merge is started
+        again, so that its candles are not lost.
+        """
+        candles = np.asarray(candles, dtype=CANDLE_DTYPE)
+        path = self.path(symbol)
+        tmp_path = f"{path}.tmp"
+        with self._lock:
+            for _ in range(MAX_MERGE_ATTEMPTS):
+                self._check_file(symbol)
+                state = self._file_states[symbol]
+                stored = self._candles(symbol)
+
+                # Sorting is stable, so keeping the first of any candles with
+                # the same open time keeps those already stored
+                merged = np.sort(np.concatenate([stored, candles]), order="open_time",
+                                    kind="stable")
+                if len(merged):
+                    is_first = np.insert(np.diff(merged["open_time"]) != 0, 0, True)
+                    merged = merged[is_first]
+                num_added = len(merged) - len(stored)
+                if num_added == 0:
+                    return 0
+
+                os.makedirs(self.store_dir, exist_ok=True)
+                merged.tofile(tmp_path)
+                if self._file_state(symbol) != state:
+                    continue
+                candle_file = self._files.pop(symbol, None)
+                if candle_file is not None:
+                    candle_file.close()
+                self._memmaps.pop(symbol, None)
+                os.replace(tmp_path, path)
+                self._last_open_times[symbol] = int(merged["open_time"][-1])
+                self._file_states[symbol] = self._file_state(symbol)
+                return num_added
+        os.remove(tmp_path)
+        raise RuntimeError(f"{path} kept changing while candles were merged into it")
+
+    def append_candle(self, symbol: str, open_ms: int,
+                        ohlcv: Tuple[float, float, float, float, float]) -> int:
+        """Appends a single candle, e.g. as each live candle closes
+        """
+        return self.append(symbol, np.array([(open_ms, *ohlcv)], dtype=CANDLE_DTYPE))
+
+    def import_csv(self, symbol: str, csv_path: str, time_col: Optional[str] = None,
+                    chunk_size: int = 1_000_000) -> int:
+        """Appends the candles in a CSV to the store, returning the number
+        appended. Two layouts are understood:
+
+        - Historical candle CSVs, such as the historical Binance CSV, with a
+          close column, open, high, low and volume columns where available,
+          and the open time of each candle in time_col (by default, the first
+          of TIME_COLUMNS present)
+        - The trading data CSVs written by trading_bot.py, with a price column
+          and a datetime column labelling each candle by the minute at which
+          it closed. Only closing prices are known, so every price of the
+          candle is set to the close, and the volume to NaN.
+
+        The CSV is read in chunks of chunk_size rows.
+        """
+        num_appended = 0
+        interval_ms = parse_interval(self.interval)*1000
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+            if "close" in chunk.columns:
+                col = time_col or next((col for col in TIME_COLUMNS
+                                        if col in chunk.columns), None)
+                if col is None:
+                    raise ValueError(f"No time column found in {csv_path}, so "
+                                        "time_col must be given")
+                open_times = to_ms(chunk[col])
+                closes = chunk["close"].to_numpy(dtype=float)
+                prices = [chunk[name].to_numpy(dtype=float) if name in chunk.columns
+                            else closes for name in ("open", "high", "low")]
+                volumes = (chunk["volume"].to_numpy(dtype=float) if "volume" in chunk.columns
+                            else np.full(len(chunk), np.nan))
+            else:
+                # Header rows repeated within the file, e.g. if it was
+                # recreated while the bot was running, are skipped
+                col = time_col or "datetime"
+                chunk = chunk[chunk[col] != col]
+                open_times = to_ms(chunk[col]) - interval_ms
+                closes = chunk["price"].to_numpy(dtype=float)
+                prices = [closes]*3
+                volumes = np.full(len(chunk), np.nan)
+
+            candles = np.empty(len(open_times), dtype=CANDLE_DTYPE)
+            candles["open_time"] = open_times
+            candles["open"], candles["high"], candles["low"] = prices
+            candles["close"] = closes
+            candles["volume"] = volumes
+            num_appended += self.append(symbol, candles)
+        return num_appended
+
+    def close(self) -> None:
+        with self._lock:
+            for candle_file in self._files.values():
+                candle_file.close()
+            self._files = {}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import candles from a CSV into "
+                                        "the candle store")
+    parser.add_argument("symbol")
+    parser.add_argument("csv_path")
+    parser.add_argument("--store-dir", default="../Candle store")
+    parser.add_argument("--interval", default="1m")
+    parser.add_argument("--time-col", default=None)
+    args = parser.parse_args()
+
+    candle_store = CandleStore(args.store_dir, args.interval)
+    start_time = time.perf_counter()
+    num_appended = candle_store.import_csv(args.symbol, args.csv_path, args.time_col)
+    candle_store.close()
+    print(f"Imported {num_appended} candles in {time.perf_counter() - start_time:.2f}s")
+
+    start_time = time.perf_counter()
+    closes = candle_store.closes(args.symbol)
+    print(f"Loaded {len(closes)} closing prices from the store in "
+          f"{(time.perf_counter() - start_time)*1000:.1f}ms")
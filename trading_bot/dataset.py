@@ -0,0 +1,170 @@
+# Core Python modules
+import argparse
+from typing import Iterator, Optional, Tuple
+
+# Additional modules
+import numpy as np
+import pandas as pd
+
+# Project modules
+from candle_store import CANDLE_FILE_EXTENSION, open_candle_file
+
+
+def save_closes(csv_path: str, npy_path: str, close_col: str = "close") -> np.ndarray:
+    """Saves the closing prices in a CSV (such as the historical Binance CSV)
+    to a .npy file, which can then be memory-mapped by load_closes instead of
+    parsing the CSV each time
+    """
+    closes = pd.read_csv(csv_path, usecols=[close_col])[close_col].to_numpy(dtype=float)
+    np.save(npy_path, closes)
+    return closes
+
+
+def load_closes(npy_path: str) -> np.ndarray:
+    """Memory-maps closing prices saved by save_closes, or held in a candle
+    store file (see candle_store.py), so that only the parts of the series
+    actually used are read from disk
+    """
+    if npy_path.endswith(CANDLE_FILE_EXTENSION):
+        return open_candle_file(npy_path)["close"]
+    return np.load(npy_path, mmap_mode="r")
+
+
+def format_data(data_in: np.ndarray, mins_in_advance_to_predict: int = 30,
+                    window_length: int = 120, stride: Optional[int] = None
+                    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorised equivalent of format_data in the LSTM training notebook,
+    returning (X_normalised, Y_normalised, means) for windows of
+    window_length prices starting every stride prices. By default stride is
+    window_length, giving the non-overlapping windows used by the notebook.
+    This holds every window in memory, so WindowDataset should be used for
+    overlapping windows over long series.
+    """
+    dataset = WindowDataset(data_in, window_length, mins_in_advance_to_predict,
+                            stride or window_length)
+    return dataset.batch(np.arange(len(dataset)), dtype=float)
+
+
+class WindowDataset():
+    """Windows of closing prices, with the price mins_in_advance_to_predict
+    minutes after each as its target, for training the LSTM used by BasicLSTM.
+    Each window, and its target, is normalised by the mean of the window, as
+    when making predictions.
+
+    Windows are read as a zero-copy sliding_window_view over the closing
+    prices, which may be memory-mapped (see load_closes), and are only
+    gathered and normalised a batch at a time, so every overlapping window of
+    years of minute data can be trained on without holding them all in
+    memory.
+
+    Attributes
+    ----------
+    closes : np.ndarray
+        The closing prices the windows are taken from
+    window_length : int
+        The number of prices in each window
+    mins_in_advance_to_predict : int
+        The number of minutes after the end of each window at which its
+        target is taken. As in the training notebook, the target of the
+        window closes[i:i + window_length] is
+        closes[i + window_length + mins_in_advance_to_predict]
+    window_starts : np.ndarray
+        Index in closes of the first price of each window in the dataset
+    """
+    def __init__(self, closes: np.ndarray, window_length: int = 120,
+                    mins_in_advance_to_predict: int = 30, stride: int = 1,
+                    window_starts: Optional[np.ndarray] = None) -> None:
+        self.closes = closes
+        self.window_length = window_length
+        self.mins_in_advance_to_predict = mins_in_advance_to_predict
+        num_windows = max(len(closes) - window_length - mins_in_advance_to_predict, 0)
+        if window_starts is None:
+            window_starts = np.arange(0, num_windows, stride)
+        self.window_starts = window_starts
+        self._windows = np.lib.stride_tricks.sliding_window_view(closes, window_length)
+
+    def __len__(self) -> int:
+        return len(self.window_starts)
+
+    def subset(self, window_starts: np.ndarray) -> "WindowDataset":
+        """Returns a dataset of the windows starting at window_starts, sharing
+        the same closing prices
+        """
+        return WindowDataset(self.closes, self.window_length,
+                                self.mins_in_advance_to_predict,
+                                window_starts=window_starts)
+
+    def split(self, test_split: float = 0.1) -> Tuple["WindowDataset", "WindowDataset"]:
+        """Splits the dataset chronologically into training and test datasets.
+        The windows of the two datasets overlap unless they are split in time,
+        so windows whose prices or target overlap those of the test data are
+        left out of the training data.
+        """
+        split_point = int(len(self)*(1 - test_split))
+        test_starts = self.window_starts[split_point:]
+        train_starts = self.window_starts[:split_point]
+        if len(test_starts):
+            gap = self.window_length + self.mins_in_advance_to_predict
+            train_starts = train_starts[train_starts + gap < test_starts[0]]
+        return self.subset(train_starts), self.subset(test_starts)
+
+    def batch(self, idx: np.ndarray, dtype: type = np.float32
+                ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns (X, Y, means) for the windows at positions idx in the
+        dataset, where X has shape (len(idx), window_length, 1) and Y has
+        shape (len(idx), 1), both normalised by the means of the windows
+        """
+        starts = self.window_starts[idx]
+        windows = np.asarray(self._windows[starts], dtype=float)
+        targets = np.asarray(self.closes[starts + self.window_length
+                                            + self.mins_in_advance_to_predict],
+                                dtype=float)
+        means = windows.mean(axis=1)
+        X = (windows/means[:, None]).astype(dtype, copy=False)[:, :, None]
+        Y = (targets/means).astype(dtype, copy=False)[:, None]
+        return X, Y, means
+
+    def batches(self, batch_size: int = 32, shuffle: bool = True,
+                    seed: Optional[int] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yields (X, Y) for every window in the dataset once, in batches of
+        batch_size, in a random order if shuffle is set
+        """
+        order = np.arange(len(self))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+        for start in range(0, len(order), batch_size):
+            X, Y, _ = self.batch(order[start:start + batch_size])
+            yield X, Y
+
+    def to_tf_dataset(self, batch_size: int = 32, shuffle: bool = True,
+                        seed: Optional[int] = None):
+        """Returns a tf.data.Dataset of (X, Y) batches, which can be passed
+        straight to model.fit. The windows are reshuffled on every epoch.
+        """
+        import tensorflow as tf
+
+        epoch_seeds = np.random.default_rng(seed)
+        def generator():
+            epoch_seed = int(epoch_seeds.integers(2**31)) if shuffle else None
+            yield from self.batches(batch_size, shuffle, epoch_seed)
+
+        output_signature = (
+            tf.TensorSpec(shape=(None, self.window_length, 1), dtype=tf.float32),
+            tf.TensorSpec(shape=(None, 1), dtype=tf.float32),
+        )
+        dataset = tf.data.Dataset.from_generator(generator,
+                                                    output_signature=output_signature)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save the closing prices in a "
+                                        "CSV to a .npy file for memory-mapping")
+    parser.add_argument("csv_path")
+    parser.add_argument("npy_path")
+    parser.add_argument("--close-col", default="close")
+    args = parser.parse_args()
+
+    closes = save_closes(args.csv_path, args.npy_path, args.close_col)
+    num_windows = len(WindowDataset(closes))
+    print(f"Saved {len(closes)} closing prices, giving {num_windows} windows")
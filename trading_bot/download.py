@@ -0,0 +1,406 @@
+# Core Python modules
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+import glob
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Binance modules
+from binance.client import Client
+
+# Additional modules
+import numpy as np
+
+# Project modules
+from aggregation import parse_interval
+from candle_store import CANDLE_DTYPE, CandleStore
+from stream_parsing import format_minute, MS_PER_MINUTE
+from warm_start import klines_to_candles, MAX_KLINES_PER_REQUEST
+
+# Weight of each klines request, counted by Binance against the request weight
+# allowed per minute from each IP address
+KLINES_REQUEST_WEIGHT = 2
+
+# Request weight used per minute by default. This is kept well below
+# Binance's limit, so that the bot can keep making requests from the same IP
+# address while a download runs.
+DEFAULT_MAX_WEIGHT_PER_MIN = 1200
+
+DEFAULT_NUM_WORKERS = 8
+
+# Each failed request is retried this many times, backing off exponentially
+# between attempts up to MAX_RETRY_BACKOFF_SECS, unless the exchange says how
+# long to wait
+MAX_RETRIES = 5
+MAX_RETRY_BACKOFF_SECS = 30
+DEFAULT_RETRY_AFTER_SECS = 60
+
+# Chunks downloaded but not yet added to the candle store are kept as files of
+# CANDLE_DTYPE records in this directory within the store's directory
+CHUNK_DIR_NAME = ".chunks"
+CHUNK_FILE_EXTENSION = ".chunk"
+
+
+class RateLimiter():
+    """Limits the weight of the requests made from any number of threads to
+    max_weight_per_min, as a token bucket which refills continuously, so
+    that a burst of requests is spread out rather than rejected by the
+    exchange. pause holds every thread back for a time, e.g. when the exchange
+    answers with a Retry-After header.
+
+    Attributes
+    ----------
+    max_weight_per_min : float
+        The request weight allowed per minute
+    """
+    def __init__(self, max_weight_per_min: float) -> None:
+        self.max_weight_per_min = max_weight_per_min
+        self._tokens = float(max_weight_per_min)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, weight: float = 1) -> None:
+        """Blocks until a request of the weight given can be made
+        """
+        rate_per_sec = self.max_weight_per_min/60
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now > self._last_refill:
+                    self._tokens = min(self._tokens + (now - self._last_refill)*rate_per_sec,
+                                        self.max_weight_per_min)
+                    self._last_refill = now
+                wait_secs = self._paused_until - now
+                if wait_secs <= 0:
+                    if self._tokens >= weight:
+                        self._tokens -= weight
+                        return
+                    wait_secs = (weight - self._tokens)/rate_per_sec
+            time.sleep(wait_secs)
+
+    def pause(self, secs: float) -> None:
+        """Stops any requests being made for secs, after which the bucket
+        refills from empty
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + secs)
+            self._tokens = 0.0
+            self._last_refill = self._paused_until
+
+
+def create_client(api_url: Optional[str] = None) -> Client:
+    """Returns a client for Binance's public market data endpoints, which need
+    no API key. If api_url is given (e.g. that of a StubAPIServer), requests
+    are sent to it rather than to Binance.
+    """
+    if api_url is None:
+        return Client()
+    local_client_class = type("LocalClient", (Client,),
+                                {"API_URL": api_url.rstrip("/") + "/api"})
+    return local_client_class()
+
+
+def parse_time_ms(value: str) -> int:
+    """Parses a time given either as milliseconds since the epoch or as an ISO
+    date or datetime (taken as UTC unless it has a timezone)
+    """
+    if value.isdigit():
+        return int(value)
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp()*1000)
+
+
+def retry_after_secs(error: Exception) -> Optional[float]:
+    """Returns the wait requested by the exchange in the Retry-After header of
+    a 429 (too many requests) or 418 (IP address banned) response, if the
+    error is for one
+    """
+    if getattr(error, "status_code", None) not in (418, 429):
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After", DEFAULT_RETRY_AFTER_SECS))
+    except ValueError:
+        return DEFAULT_RETRY_AFTER_SECS
+
+
+class KlineDownloader():
+    """Downloads historical klines for many symbols concurrently into a
+    CandleStore, through a pool of worker threads sharing one client and one
+    RateLimiter.
+
+    The range downloaded for each symbol is split into chunks of at most
+    MAX_KLINES_PER_REQUEST candles, aligned to a fixed grid so that the same
+    chunks are planned each time a download is resumed. Each chunk is fetched
+    in a single request and written to its own file in chunk_dir, replacing
+    it in one step once complete. Chunks are then appended to the store in
+    order, and their files removed, as soon as every earlier chunk of the
+    symbol has been appended. If the download is interrupted, or a chunk
+    fails, the store therefore holds every candle up to the first missing
+    chunk, and chunk files already downloaded beyond it are reused when the
+    download is run again.
+
+    Only the ranges missing from the store are downloaded, so later runs
+    fetch only the new candles, and candles already stored are never fetched
+    again. By default, ranges before the last candle stored (earlier history,
+    or gaps such as while the bot was stopped) are reported rather than
+    downloaded. With backfill they are downloaded too, and merged into the
+    store in one rewrite once every chunk has been downloaded (see
+    CandleStore.merge). Ranges for which the exchange has no candles, such as
+    before a symbol was listed, are then requested again on each such run.
+
+    Attributes
+    ----------
+    client : Any
+        The binance.client.Client (or StubClient) klines are fetched with
+    candle_store : CandleStore
+        The store the candles are appended to
+    chunk_dir : str
+        Directory holding chunks not yet appended to the store
+    rate_limiter : RateLimiter
+        Limits the request weight used per minute
+    num_workers : int
+        The number of requests made concurrently
+    max_retries : int
+        The number of times each failed request is retried
+    """
+    def __init__(self, client: Any, candle_store: CandleStore,
+                    chunk_dir: Optional[str] = None,
+                    max_weight_per_min: float = DEFAULT_MAX_WEIGHT_PER_MIN,
+                    num_workers: int = DEFAULT_NUM_WORKERS,
+                    max_retries: int = MAX_RETRIES) -> None:
+        self.client = client
+        self.candle_store = candle_store
+        self.chunk_dir = chunk_dir or os.path.join(candle_store.store_dir, CHUNK_DIR_NAME)
+        self.rate_limiter = RateLimiter(max_weight_per_min)
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+        self.interval_ms = parse_interval(candle_store.interval)*1000
+        os.makedirs(self.chunk_dir, exist_ok=True)
+
+    def chunk_path(self, symbol: str, start_ms: int, end_ms: int) -> str:
+        return os.path.join(self.chunk_dir, f"{symbol}_{self.candle_store.interval}_"
+                                            f"{start_ms}_{end_ms}{CHUNK_FILE_EXTENSION}")
+
+    def missing_ranges(self, symbol: str, start_ms: int,
+                        end_ms: int) -> List[Tuple[int, int]]:
+        """Returns the (start_ms, end_ms) of each range of candles from
+        start_ms up to end_ms which is missing from the store, oldest first
+        """
+        start_ms += -start_ms % self.interval_ms
+        open_times = self.candle_store.read(symbol, start_ms, end_ms)["open_time"]
+        starts = np.concatenate([[start_ms], open_times + self.interval_ms])
+        ends = np.concatenate([open_times, [end_ms]])
+        is_missing = ends > starts
+        return list(zip(starts[is_missing].tolist(), ends[is_missing].tolist()))
+
+    def plan_chunks(self, ranges: Sequence[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Returns the (start_ms, end_ms) of each chunk of candles to be
+        downloaded for the ranges given, oldest first
+        """
+        chunk_span = MAX_KLINES_PER_REQUEST*self.interval_ms
+        chunks = []
+        for start_ms, end_ms in ranges:
+            while start_ms < end_ms:
+                chunk_end_ms = min((start_ms//chunk_span + 1)*chunk_span, end_ms)
+                chunks.append((start_ms, chunk_end_ms))
+                start_ms = chunk_end_ms
+        return chunks
+
+    def remove_stale_chunks(self, symbol: str, chunks: Sequence[Tuple[int, int]]) -> None:
+        """Removes the symbol's chunk files which are not among the chunks
+        planned, e.g. those already covered by the store
+        """
+        planned = {self.chunk_path(symbol, *chunk) for chunk in chunks}
+        pattern = os.path.join(self.chunk_dir, f"{symbol}_{self.candle_store.interval}_"
+                                                f"*{CHUNK_FILE_EXTENSION}")
+        for path in glob.glob(pattern):
+            if path not in planned:
+                os.remove(path)
+
+    def fetch_chunk(self, symbol: str, start_ms: int, end_ms: int) -> np.ndarray:
+        """Fetches the candles opening between start_ms and end_ms in a single
+        request, retrying if it fails
+        """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(KLINES_REQUEST_WEIGHT)
+            try:
+                klines = self.client.get_klines(symbol=symbol,
+                                                interval=self.candle_store.interval,
+                                                startTime=start_ms, endTime=end_ms - 1,
+                                                limit=MAX_KLINES_PER_REQUEST)
+                return klines_to_candles(klines)
+            except Exception as e:
+                # Other client errors, e.g. for an invalid symbol, would only
+                # fail again
+                status_code = getattr(e, "status_code", None)
+                if (attempt == self.max_retries
+                        or (status_code is not None and 400 <= status_code < 500
+                            and status_code not in (418, 429))):
+                    raise
+                wait_secs = retry_after_secs(e)
+                if wait_secs is not None:
+                    print(f"Rate limited fetching {symbol}, pausing for {wait_secs:.0f}s")
+                    self.rate_limiter.pause(wait_secs)
+                else:
+                    print(f"Error fetching {symbol} from {format_minute(start_ms//MS_PER_MINUTE)}, "
+                            "retrying:", e)
+                    time.sleep(min(2**attempt, MAX_RETRY_BACKOFF_SECS)*random.uniform(0.5, 1))
+
+    def download_chunk(self, symbol: str, start_ms: int, end_ms: int) -> str:
+        """Downloads a chunk to its file, unless it has already been
+        downloaded, returning the file's path
+        """
+        path = self.chunk_path(symbol, start_ms, end_ms)
+        if not os.path.exists(path):
+            candles = self.fetch_chunk(symbol, start_ms, end_ms)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(candles.tobytes())
+            os.replace(tmp_path, path)
+        return path
+
+    def download(self, symbols: Sequence[str], start_ms: int,
+                    end_ms: Optional[int] = None, backfill: bool = False) -> Dict[str, int]:
+        """Downloads the candles for every symbol opening between start_ms and
+        end_ms (by default, every candle closed so far), adding them to the
+        candle store. Candles missing from before the last one stored are
+        only downloaded if backfill is set, and are otherwise reported.
+        Returns the number of candles added for each symbol.
+        """
+        if end_ms is None:
+            now_ms = int(time.time()*1000)
+            end_ms = now_ms - now_ms % self.interval_ms
+
+        # The chunks of each symbol before its last candle stored come first in
+        # its plan, and are merged into the store, while those after it are
+        # appended
+        plans = {}
+        num_earlier = {}
+        for symbol in symbols:
+            ranges = self.missing_ranges(symbol, start_ms, end_ms)
+            last_open_ms = self.candle_store.last_open_time(symbol)
+            earlier = [(start, end) for start, end in ranges if start <= last_open_ms]
+            if earlier and not backfill:
+                num_missing = sum(end - start for start, end in earlier)//self.interval_ms
+                print(f"Warning: {symbol} is missing {num_missing} candles before the last "
+                        f"one stored, from {format_minute(earlier[0][0]//MS_PER_MINUTE)} "
+                        f"to {format_minute(earlier[-1][1]//MS_PER_MINUTE)}, which are not "
+                        "downloaded. Pass --backfill to download them.")
+                ranges = ranges[len(earlier):]
+                earlier = []
+            plans[symbol] = self.plan_chunks(ranges)
+            num_earlier[symbol] = len(self.plan_chunks(earlier))
+        for symbol, chunks in plans.items():
+            self.remove_stale_chunks(symbol, chunks)
+        num_appended = {symbol: 0 for symbol in symbols}
+        num_merged = dict(num_earlier)
+        num_chunks_added = {symbol: 0 for symbol in symbols}
+        downloaded = {symbol: {} for symbol in symbols}
+        failed = set()
+        total_chunks = sum(len(chunks) for chunks in plans.values())
+        print(f"Downloading {total_chunks} chunks for {len(symbols)} symbols")
+
+        executor = ThreadPoolExecutor(self.num_workers, thread_name_prefix="download")
+        futures = {executor.submit(self.download_chunk, symbol, *chunk): (symbol, i)
+                    for symbol, chunks in plans.items()
+                    for i, chunk in enumerate(chunks)}
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    symbol, i = futures[future]
+                    try:
+                        downloaded[symbol][i] = future.result()
+                    except Exception as e:
+                        print(f"Failed to download {symbol} chunk from "
+                                f"{format_minute(plans[symbol][i][0]//MS_PER_MINUTE)}:", e)
+                        failed.add(symbol)
+                        continue
+
+                    # Appending every later chunk which now follows on from
+                    # those already in the store
+                    while num_merged[symbol] in downloaded[symbol]:
+                        path = downloaded[symbol].pop(num_merged[symbol])
+                        candles = np.fromfile(path, dtype=CANDLE_DTYPE)
+                        num_appended[symbol] += self.candle_store.append(symbol, candles)
+                        os.remove(path)
+                        num_merged[symbol] += 1
+                        num_chunks_added[symbol] += 1
+                        if num_merged[symbol] == len(plans[symbol]):
+                            print(f"{symbol}: appended {num_appended[symbol]} candles")
+
+            # The earlier chunks downloaded are merged into the store together,
+            # as each merge rewrites the symbol's file
+            for symbol in symbols:
+                paths = [downloaded[symbol].pop(i) for i in range(num_earlier[symbol])
+                            if i in downloaded[symbol]]
+                if paths:
+                    candles = np.concatenate([np.fromfile(path, dtype=CANDLE_DTYPE)
+                                                for path in paths])
+                    num_filled = self.candle_store.merge(symbol, candles)
+                    num_appended[symbol] += num_filled
+                    for path in paths:
+                        os.remove(path)
+                    num_chunks_added[symbol] += len(paths)
+                    print(f"{symbol}: filled in {num_filled} earlier candles")
+        finally:
+            # If interrupted, chunks not yet started are dropped, and those
+            # downloaded are kept for the next run
+            executor.shutdown(cancel_futures=True)
+
+        for symbol in sorted(failed):
+            print(f"{symbol}: stopped after {num_appended[symbol]} candles, as "
+                    f"{len(plans[symbol]) - num_chunks_added[symbol]} chunks could not all be "
+                    "downloaded. Run the download again to resume it.")
+        return num_appended
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download historical klines for "
+                                        "one or more symbols into the candle store, "
+                                        "resuming from the last candle stored")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--start", required=True,
+                        help="Time from which to download, as an ISO date (UTC) or "
+                                "milliseconds since the epoch. Symbols with candles "
+                                "stored carry on from the last of them if later, "
+                                "unless --backfill is given.")
+    parser.add_argument("--end", default=None,
+                        help="Time up to which to download (by default, now)")
+    parser.add_argument("--candle-store", default="../Candle store")
+    parser.add_argument("--interval", default="1m")
+    parser.add_argument("--workers", type=int, default=DEFAULT_NUM_WORKERS)
+    parser.add_argument("--max-weight", type=float, default=DEFAULT_MAX_WEIGHT_PER_MIN,
+                        help="Request weight used per minute at most")
+    parser.add_argument("--backfill", action="store_true",
+                        help="Also download candles missing from before the last "
+                                "one stored, e.g. earlier history or gaps, and merge "
+                                "them into the store")
+    parser.add_argument("--api-url", default=None,
+                        help="Base URL of the REST API to use in place of Binance's, "
+                                "e.g. that of a stub server started with stub_exchange.py")
+    args = parser.parse_args()
+
+    candle_store = CandleStore(args.candle_store, args.interval)
+    downloader = KlineDownloader(create_client(args.api_url), candle_store,
+                                    max_weight_per_min=args.max_weight,
+                                    num_workers=args.workers)
+    start_time = time.perf_counter()
+    try:
+        num_appended = downloader.download([symbol.upper() for symbol in args.symbols],
+                                            parse_time_ms(args.start),
+                                            args.end and parse_time_ms(args.end),
+                                            args.backfill)
+    finally:
+        candle_store.close()
+    print(f"Added {sum(num_appended.values())} candles in "
+            f"{time.perf_counter() - start_time:.1f}s")
@@ -0,0 +1,295 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from strategies import BasicLSTM, StrategyInterface
+
+# Modes in which a strategy in an ensemble can run. Live strategies decide the
+# trades made, while shadow strategies are only paper traded.
+LIVE = "live"
+SHADOW = "shadow"
+
+# Ways in which the signals of the live strategies are combined
+VOTES = ("all", "any", "majority")
+
+
+class ShadowPosition():
+    """Paper trades the signals of a single strategy, applying the same
+    trailing stop loss and cool-down as consider_trade in trading_bot.py and
+    filling every trade at the closing price, so that strategies can be
+    compared on live data without placing orders. Profit or loss is measured
+    as in backtest.BacktestResult.
+
+    Attributes
+    ----------
+    quantity : float
+        Quantity bought and sold by each trade
+    stop_loss_threshold : float
+        Fall from the maximum price since buying at which the position is sold
+    cool_down_mins : int
+        Number of candles after a stop loss before another buy is allowed
+    fee_rate : float
+        Fraction of the value of each trade paid in fees
+    in_long_position : bool
+        Whether a position is currently held
+    entry_price : float
+        Price at which the position held was bought
+    max_price_since_buy : float
+        Maximum closing price since the position held was bought
+    num_trades : int
+        The number of round trips (buy followed by sell) completed
+    realised_pnl : float
+        Total profit or loss of the round trips completed, in units of the
+        asset sold
+    """
+    def __init__(self, quantity: float, stop_loss_threshold: float,
+                    cool_down_mins: int, fee_rate: float = 0) -> None:
+        self.quantity = quantity
+        self.stop_loss_threshold = stop_loss_threshold
+        self.cool_down_mins = cool_down_mins
+        self.fee_rate = fee_rate
+        self.in_long_position = False
+        self.entry_price = 0.0
+        self.max_price_since_buy = 0.0
+        self.num_trades = 0
+        self.realised_pnl = 0.0
+        self._num_candles = 0
+        self._last_position_stop_triggered = -1000
+
+    def on_candle(self, should_sell: bool, should_buy: bool, price: float) -> Optional[str]:
+        """Updates the position at the close of a candle, given the strategy's
+        signals, returning the trade made ("buy", "sell" or None)
+        """
+        price = float(price)
+        self._num_candles += 1
+        if self.in_long_position:
+            self.max_price_since_buy = max(self.max_price_since_buy, price)
+        should_trigger_stop_loss = price <= (1 - self.stop_loss_threshold)*self.max_price_since_buy
+
+        if self.in_long_position and (should_sell or should_trigger_stop_loss):
+            self.realised_pnl += (self.quantity*(price - self.entry_price)
+                                    - self.fee_rate*self.quantity*(self.entry_price + price))
+            self.num_trades += 1
+            self.in_long_position = False
+            self.max_price_since_buy = 0.0
+            if should_trigger_stop_loss:
+                self._last_position_stop_triggered = self._num_candles
+            return "sell"
+        if (not self.in_long_position and should_buy
+                and self._num_candles >= self._last_position_stop_triggered
+                                            + self.cool_down_mins):
+            self.in_long_position = True
+            self.entry_price = price
+            self.max_price_since_buy = price
+            return "buy"
+        return None
+
+
+class StrategyEnsemble(StrategyInterface):
+    """Runs several strategies side by side on each candle, e.g. RSI variants
+    and LSTMs with different thresholds, each either live or in shadow mode.
+    The signals of the live strategies are combined by a vote to decide the
+    trades made, while every strategy (live ones included, so that all are
+    compared on the same terms) is paper traded by a ShadowPosition.
+
+    The features of each candle are computed once for every group of
+    strategies of the same class with the same features_key, and shared with
+    the rest of the group, so e.g. LSTMs using the same model with different
+    thresholds share a single prediction, and RSI strategies with the same
+    period share the RSI. In backtests, the vectorised features are likewise
+    computed once per features_key. Strategies of the same class with the
+    same features_key must therefore compute the same features from the same
+    prices, as is already required for sharing features in optimise.py.
+
+    Attributes
+    ----------
+    strategies : Dict[str, StrategyInterface]
+        The strategies run, keyed by name
+    modes : Dict[str, str]
+        Whether each strategy is LIVE or SHADOW
+    vote : str
+        How the live strategies' signals are combined: "all" trades only if
+        every live strategy agrees, "any" if any does, and "majority" if more
+        than half do
+    positions : Dict[str, ShadowPosition]
+        The paper trading position of each strategy, trading quantity with the
+        stop_loss_threshold and cool_down_mins used when trading live
+    """
+    def __init__(self, strategies: Dict[str, StrategyInterface], quantity: float,
+                    stop_loss_threshold: float, cool_down_mins: int,
+                    shadow: Sequence[str] = (), vote: str = "majority",
+                    fee_rate: float = 0) -> None:
+        if vote not in VOTES:
+            raise ValueError(f"vote must be one of {VOTES}, not {vote}")
+        unknown = set(shadow) - set(strategies)
+        if unknown:
+            raise ValueError(f"Unknown shadow strategies {sorted(unknown)}")
+
+        self.strategies = dict(strategies)
+        self.modes = {name: SHADOW if name in shadow else LIVE for name in strategies}
+        self.vote = vote
+        self.positions = {name: ShadowPosition(quantity, stop_loss_threshold,
+                                                cool_down_mins, fee_rate)
+                            for name in strategies}
+        self.MAX_MINS_OF_PRICES_HELD_IN_MEMORY = max(
+            strategy.MAX_MINS_OF_PRICES_HELD_IN_MEMORY for strategy in strategies.values())
+
+        timeframes = []
+        for strategy in strategies.values():
+            timeframes.extend(interval for interval in strategy.TIMEFRAMES
+                                if interval not in timeframes)
+        self.TIMEFRAMES = tuple(timeframes)
+
+        # The first strategy of each group computes the group's features
+        self._group_of = {}
+        self._group_leaders = {}
+        for name, strategy in strategies.items():
+            group = (type(strategy).__name__, strategy.features_key())
+            self._group_of[name] = group
+            self._group_leaders.setdefault(group, strategy)
+
+    @property
+    def live_names(self) -> List[str]:
+        return [name for name, mode in self.modes.items() if mode == LIVE]
+
+    def update(self, close: float) -> Dict[tuple, Any]:
+        """Updates the incrementally computed features of each group,
+        returning those of the groups which compute them this way, keyed by
+        group, for calc_after_update to complete
+        """
+        updated = {}
+        for group, leader in self._group_leaders.items():
+            features = leader.update(close)
+            if features is not None:
+                updated[group] = features
+        return updated
+
+    def warm_up(self, closes_arr: np.ndarray) -> None:
+        for leader in self._group_leaders.values():
+            leader.warm_up(closes_arr)
+
+    def on_bar(self, interval: str, closes_arr: np.ndarray) -> None:
+        # Strategies may keep state for other intervals outside their
+        # features, so every strategy is passed the bar
+        for strategy in self.strategies.values():
+            strategy.on_bar(interval, closes_arr)
+
+    def calc(self, closes_arr: np.ndarray) -> Dict[tuple, Any]:
+        """Returns the features of each group, keyed by group
+        """
+        return self.calc_after_update(closes_arr, None)
+
+    def calc_after_update(self, closes_arr: np.ndarray,
+                            updated: Optional[Dict[tuple, Any]]) -> Dict[tuple, Any]:
+        """Returns the features of each group, keyed by group, computing only
+        those not in updated, as returned by update for this candle
+        """
+        features = {}
+        for group, leader in self._group_leaders.items():
+            if updated is not None and group in updated:
+                features[group] = updated[group]
+            else:
+                features[group] = leader.calc(closes_arr)
+        return features
+
+    def lstm_groups(self, closes_arr: np.ndarray,
+                        in_long_position: bool) -> Dict[tuple, Optional[BasicLSTM]]:
+        """Returns each group of BasicLSTMs, mapped to the group's leader if a
+        prediction is needed for this candle, or to None if not, so that the
+        predictions of several ensembles (and sessions) can be made in a
+        single batch and passed to calc_after_update. A prediction is needed
+        if any strategy in the group needs one, given the position it holds,
+        i.e. in_long_position for live strategies, or its paper trading
+        position.
+        """
+        needed = {}
+        for name, strategy in self.strategies.items():
+            group = self._group_of[name]
+            if not isinstance(strategy, BasicLSTM) or needed.get(group) is not None:
+                continue
+            positions = [self.positions[name].in_long_position]
+            if self.modes[name] == LIVE:
+                positions.append(in_long_position)
+            if any(strategy.needs_prediction(closes_arr, position) for position in positions):
+                needed[group] = self._group_leaders[group]
+            else:
+                needed[group] = None
+        return needed
+
+    def signals(self, features: Dict[tuple, Any], closes_arr: np.ndarray,
+                    names: Sequence[str], positions: Sequence[bool]
+                    ) -> Dict[str, Tuple[bool, bool]]:
+        """Returns (should_sell, should_buy) for each of the strategies named,
+        given the features returned by calc and whether each strategy holds a
+        position
+        """
+        return {name: self.strategies[name].should_sell_and_buy(
+                        features[self._group_of[name]], closes_arr, in_long_position)
+                for name, in_long_position in zip(names, positions)}
+
+    def combine(self, votes: Sequence[bool]) -> bool:
+        if len(votes) == 0:
+            return False
+        if self.vote == "all":
+            return all(votes)
+        if self.vote == "any":
+            return any(votes)
+        return sum(votes) > len(votes)/2
+
+    def should_sell_and_buy(self, features: Dict[tuple, Any], closes_arr: np.ndarray,
+                                in_long_position: bool) -> Tuple[bool, bool]:
+        """Returns (should_sell, should_buy) for the position actually held,
+        combining the signals of the live strategies by vote
+        """
+        live_names = self.live_names
+        signals = self.signals(features, closes_arr, live_names,
+                                [in_long_position]*len(live_names))
+        return (self.combine([should_sell for should_sell, _ in signals.values()]),
+                self.combine([should_buy for _, should_buy in signals.values()]))
+
+    def paper_trade(self, features: Dict[tuple, Any],
+                        closes_arr: np.ndarray) -> Dict[str, Optional[str]]:
+        """Paper trades every strategy at the close of a candle, returning the
+        trade made by each ("buy", "sell" or None)
+        """
+        names = list(self.strategies)
+        signals = self.signals(features, closes_arr, names,
+                                [self.positions[name].in_long_position for name in names])
+        return {name: self.positions[name].on_candle(*signals[name], closes_arr[-1])
+                for name in names}
+
+    def vectorised_features(self, closes_arr: np.ndarray) -> Dict[tuple, Any]:
+        """Returns the vectorised features of every strategy, keyed by
+        features_key, computing them once for each key
+        """
+        features = {}
+        for strategy in self.strategies.values():
+            key = strategy.features_key()
+            if key not in features:
+                features[key] = strategy.vectorised_features(closes_arr)
+        return features
+
+    def features_key(self) -> tuple:
+        return ("StrategyEnsemble",) + tuple(strategy.features_key()
+                                                for strategy in self.strategies.values())
+
+    def signals_from_features(self, features: Dict[tuple, Any],
+                                closes_arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns boolean arrays (should_sell, should_buy) for every candle,
+        combining the signals of the live strategies by vote
+        """
+        live_signals = [self.strategies[name].signals_from_features(
+                            features[self.strategies[name].features_key()], closes_arr)
+                        for name in self.live_names]
+        if not live_signals:
+            no_signal = np.zeros(len(closes_arr), dtype=bool)
+            return no_signal, no_signal.copy()
+        sell_votes = np.stack([should_sell for should_sell, _ in live_signals])
+        buy_votes = np.stack([should_buy for _, should_buy in live_signals])
+        if self.vote == "all":
+            return sell_votes.all(axis=0), buy_votes.all(axis=0)
+        if self.vote == "any":
+            return sell_votes.any(axis=0), buy_votes.any(axis=0)
+        num_live = len(live_signals)
+        return (sell_votes.sum(axis=0) > num_live/2,
+                buy_votes.sum(axis=0) > num_live/2)
@@ -0,0 +1,232 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from account_cache import AccountSnapshot
+from latency import LatencyTracker
+from utilities import append_data, CSVLogWriter
+
+
+class OrderExecutor():
+    """Sends orders to the exchange from a pool of worker threads, so that the
+    websocket thread is never blocked waiting on the REST API. Each order is
+    sent as soon as it is submitted. Once it has been filled, the balances and
+    prices needed for the trades log are fetched concurrently on a separate
+    pool, and the row is written by a single logging thread, so none of this
+    delays the next order. If an AccountSnapshot is given, balances and
+    prices are instead read from it, and no lookups are made at all.
+
+    Attributes
+    ----------
+    client : Any
+        The Binance client (or a stub with the same methods) used for orders
+        and lookups
+    trades_log_dir : str
+        Directory in which the trades log CSV for each symbol is written
+    start_datetime : str
+        Time at which trading began, recorded against each trade
+    account_snapshot : AccountSnapshot, optional
+        Cache of balances and prices, updated with each fill and read when
+        logging trades
+    log_writer : CSVLogWriter, optional
+        Buffered writer used for the trades log, which otherwise is written
+        with append_data
+    latency_tracker : LatencyTracker, optional
+        Records the time orders spend queued (order_queue), being sent
+        (order_request) and being logged once filled (trade_log)
+    """
+    def __init__(self, client: Any, trades_log_dir: str, start_datetime: str,
+                    max_order_workers: int = 4, max_lookup_workers: int = 4,
+                    account_snapshot: Optional[AccountSnapshot] = None,
+                    log_writer: Optional[CSVLogWriter] = None,
+                    latency_tracker: Optional[LatencyTracker] = None) -> None:
+        self.client = client
+        self.trades_log_dir = trades_log_dir
+        self.start_datetime = start_datetime
+        self.account_snapshot = account_snapshot
+        self.log_writer = log_writer
+        self.latency_tracker = latency_tracker
+        self._order_pool = ThreadPoolExecutor(max_order_workers,
+                                                thread_name_prefix="orders")
+        self._lookup_pool = ThreadPoolExecutor(max_lookup_workers,
+                                                thread_name_prefix="lookups")
+        self._logging_pool = ThreadPoolExecutor(1, thread_name_prefix="trades-log")
+
+        # Keeping enough pooled HTTP connections open for every worker, so that
+        # concurrent requests reuse connections rather than opening new ones
+        session = getattr(client, "session", None)
+        if session is not None:
+            from requests.adapters import HTTPAdapter
+            pool_size = max_order_workers + max_lookup_workers
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+
+    def submit_order(self, symbol: str, base_asset: str, quote_asset: str,
+                        side: str, order_type: str, quantity: float,
+                        expected_price: float,
+                        on_complete: Callable[[bool], None]) -> Future:
+        """Sends the order on a worker thread and returns immediately.
+        on_complete is called from the worker thread with True if the order
+        succeeded and False otherwise, before the trade is logged.
+        """
+        return self._order_pool.submit(self._place_order, symbol, base_asset,
+                                        quote_asset, side, order_type, quantity,
+                                        expected_price, on_complete,
+                                        time.perf_counter())
+
+    def _place_order(self, symbol: str, base_asset: str, quote_asset: str,
+                        side: str, order_type: str, quantity: float,
+                        expected_price: float,
+                        on_complete: Callable[[bool], None],
+                        submitted_at: Optional[float] = None) -> bool:
+        order_placed_datetime = datetime.now()
+        request_started_at = time.perf_counter()
+        if self.latency_tracker is not None and submitted_at is not None:
+            self.latency_tracker.record("order_queue", request_started_at - submitted_at)
+        try:
+            print("Sending order")
+            order = self.client.create_order(symbol=symbol,
+                                                side=side,
+                                                type=order_type,
+                                                quantity=quantity)
+            print("Order successful:", order, "\n\n")
+        except Exception as e:
+            print("Order failed:", e, "\n")
+            self._call_on_complete(on_complete, False)
+            return False
+        finally:
+            if self.latency_tracker is not None:
+                self.latency_tracker.record_since("order_request", request_started_at)
+
+        if self.account_snapshot is not None:
+            self.account_snapshot.apply_fill(order, base_asset, quote_asset)
+        self._call_on_complete(on_complete, True)
+
+        if self.account_snapshot is not None:
+            if self.account_snapshot.is_stale():
+                self.account_snapshot.refresh_in_background()
+            snapshot = self.account_snapshot
+            get_balances = lambda: (snapshot.get_balance(base_asset),
+                                    snapshot.get_balance(quote_asset),
+                                    snapshot.get_balance_usd((base_asset, quote_asset)))
+        else:
+            account_values = self.fetch_account_values(base_asset, quote_asset)
+            get_balances = lambda: self._balances_from_lookups(account_values,
+                                                                base_asset, quote_asset)
+        self._logging_pool.submit(self._log_trade, order, get_balances,
+                                    order_placed_datetime, symbol, base_asset,
+                                    quote_asset, side, order_type, quantity,
+                                    expected_price, time.perf_counter())
+        return True
+
+    @staticmethod
+    def _call_on_complete(on_complete: Callable[[bool], None],
+                            order_succeeded: bool) -> None:
+        try:
+            on_complete(order_succeeded)
+        except Exception as e:
+            print("Error updating trading session after order:", e)
+
+    def fetch_account_values(self, base_asset: str, quote_asset: str
+                                ) -> Dict[str, Future]:
+        """Starts fetching the free balance of both assets and the USD price of
+        each asset not priced in USDT, concurrently, returning the futures
+        keyed by "balance_<asset>" and "price_<asset>"
+        """
+        futures = {}
+        for asset in (base_asset, quote_asset):
+            futures[f"balance_{asset}"] = self._lookup_pool.submit(
+                self.client.get_asset_balance, asset=asset)
+            if asset != "USDT":
+                futures[f"price_{asset}"] = self._lookup_pool.submit(
+                    self.client.get_avg_price, symbol=f"{asset}USDT")
+        return futures
+
+    def _log_trade(self, order: dict,
+                    get_balances: Callable[[], Tuple[float, float, float]],
+                    order_placed_datetime: datetime, symbol: str,
+                    base_asset: str, quote_asset: str, side: str,
+                    order_type: str, quantity: float,
+                    expected_price: float, filled_at: Optional[float] = None) -> None:
+        """Saves details of the trade to the trades log CSV, as well as account
+        balances and other useful information, returned by get_balances
+        """
+        # Fetching executed price and quantity, for logs
+        try:
+            actual_price = order['fills'][0]['price']
+            actual_quantity = order['fills'][0]['qty']
+            commission = order['fills'][0]['commission']
+        except Exception as e:
+            actual_price = ""
+            actual_quantity = ""
+            commission = ""
+            print("Error getting order details:", e)
+
+        # Balances of both assets traded, for logs
+        try:
+            balance_1, balance_2, balance_usd = get_balances()
+        except Exception as e:
+            balance_1 = ""
+            balance_2 = ""
+            balance_usd = ""
+            print("Error getting balances:", e)
+
+        col_names = ["collection_started_datetime",
+                        "order_placed_datetime",
+                        "ticker",
+                        "side",
+                        "order_type",
+                        "quantity_attempted",
+                        "expected_price",
+                        "actual_price",
+                        "actual_quantity",
+                        "commission",
+                        f"{base_asset}_balance",
+                        f"{quote_asset}_balance",
+                        "total_balance_usd"
+                        ]
+        row = [self.start_datetime,
+                order_placed_datetime,
+                symbol,
+                side,
+                order_type,
+                quantity,
+                expected_price,
+                actual_price,
+                actual_quantity,
+                commission,
+                balance_1,
+                balance_2,
+                balance_usd
+            ]
+        csv_path = f"{self.trades_log_dir}/{symbol}_trades_log.csv"
+        if self.log_writer is not None:
+            self.log_writer.append(csv_path, col_names, row)
+        else:
+            append_data(csv_path, col_names, row)
+        if self.latency_tracker is not None and filled_at is not None:
+            self.latency_tracker.record_since("trade_log", filled_at)
+
+    @staticmethod
+    def _balances_from_lookups(account_values: Dict[str, Future], base_asset: str,
+                                quote_asset: str) -> Tuple[float, float, float]:
+        balances = []
+        balance_usd = 0.0
+        for asset in (base_asset, quote_asset):
+            balance = float(account_values[f"balance_{asset}"].result()['free'])
+            if asset == "USDT":
+                usd_price = 1.0
+            else:
+                usd_price = float(account_values[f"price_{asset}"].result()['price'])
+            balances.append(balance)
+            balance_usd += balance*usd_price
+        return balances[0], balances[1], balance_usd
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Waits for any orders in flight, and then for their trades to be
+        logged
+        """
+        self._order_pool.shutdown(wait=wait)
+        self._lookup_pool.shutdown(wait=wait)
+        self._logging_pool.shutdown(wait=wait)
@@ -0,0 +1,119 @@
+import math
+
+import numpy as np
+
+
+class StreamingRSI():
+    """RSI (Relative Strength Index) which is updated one closing price at a
+    time, in constant time, rather than being recomputed over a window of
+    prices. Wilder's average gain and average loss are kept as state, and are
+    seeded and smoothed in the same way as talib.RSI, so that after feeding in
+    a series of prices the value held matches the last value of
+    talib.RSI(closes_arr, period) (see check_talib_equivalence).
+
+    Attributes
+    ----------
+    period : int
+        The period over which the RSI is calculated
+    value : float
+        The RSI after the most recent update, or NaN until period + 1 prices
+        have been seen
+    prev_value : float
+        The RSI before the most recent update
+    last_close : float
+        The most recent closing price
+    prev_close : float
+        The closing price before the most recent one
+    num_closes : int
+        The number of closing prices seen so far
+    """
+    def __init__(self, period: int) -> None:
+        self.period = period
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.value = math.nan
+        self.prev_value = math.nan
+        self.last_close = math.nan
+        self.prev_close = math.nan
+        self.num_closes = 0
+
+    @property
+    def is_ready(self) -> bool:
+        return self.num_closes > self.period
+
+    def update(self, close: float) -> float:
+        """Adds a new closing price, and returns the updated RSI
+        """
+        self.prev_value = self.value
+        self.prev_close = self.last_close
+        self.last_close = close
+        self.num_closes += 1
+        if self.num_closes == 1:
+            return self.value
+
+        change = close - self.prev_close
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+
+        # For the first period price changes the gains and losses are summed,
+        # and are then averaged to seed Wilder's smoothing, as talib does
+        if self.num_closes <= self.period + 1:
+            self.avg_gain += gain
+            self.avg_loss += loss
+            if self.num_closes < self.period + 1:
+                return self.value
+            self.avg_gain /= self.period
+            self.avg_loss /= self.period
+        else:
+            self.avg_gain = (self.avg_gain*(self.period - 1) + gain)/self.period
+            self.avg_loss = (self.avg_loss*(self.period - 1) + loss)/self.period
+
+        total = self.avg_gain + self.avg_loss
+        self.value = 100*(self.avg_gain/total) if abs(total) >= 1e-8 else 0.0
+        return self.value
+
+    def warm_up(self, closes_arr: np.ndarray) -> float:
+        """Feeds a series of closing prices in order, returning the final RSI
+        """
+        for close in np.asarray(closes_arr, dtype=float).tolist():
+            self.update(close)
+        return self.value
+
+
+def check_talib_equivalence(closes_arr: np.ndarray, period: int,
+                                rtol: float = 1e-9) -> bool:
+    """Checks that StreamingRSI, updated one price at a time, gives the same
+    values as talib.RSI computed over the full series, for every price in
+    closes_arr.
+
+    Parameters
+    ----------
+    closes_arr : np.ndarray
+        Numpy array of closing prices
+    period : int
+        The period over which the RSI is calculated
+    rtol : float
+        Relative tolerance allowed between the two sets of values
+
+    Returns
+    -------
+    is_equivalent : bool
+        True if the values match everywhere, including the positions at which
+        the RSI is undefined (NaN)
+    """
+    import talib
+
+    closes_arr = np.asarray(closes_arr, dtype=float)
+    expected = talib.RSI(closes_arr, period)
+    streaming_rsi = StreamingRSI(period)
+    streamed = np.array([streaming_rsi.update(close) for close in closes_arr.tolist()])
+    return bool(np.allclose(streamed, expected, rtol=rtol, atol=1e-9,
+                            equal_nan=True))
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    random_walk = 20000*np.exp(np.cumsum(rng.normal(0, 1e-3, 100000)))
+    for period in (2, 6, 14, 30):
+        print(f"RSI period {period} matches talib:",
+                check_talib_equivalence(random_walk, period))
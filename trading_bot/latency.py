@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+from utilities import RingBuffer
+
+
+class LatencyTracker():
+    """Records how long each stage of the tick-to-order path takes, keeping
+    the most recent window_size durations of each stage in a ring buffer so
+    that rolling percentiles (e.g. p50 and p99) can be reported. Recording a
+    duration only appends it to the stage's buffer, and percentiles are only
+    computed when a summary is requested, so timing adds little overhead to
+    the stages being timed.
+
+    A summary of every stage can be written to a JSON file, either on demand
+    with export or periodically from a background thread with
+    start_exporting.
+
+    Attributes
+    ----------
+    window_size : int
+        The number of recent durations held for each stage
+    counts : Dict[str, int]
+        The total number of durations recorded for each stage
+    """
+    def __init__(self, window_size: int = 1000) -> None:
+        self.window_size = window_size
+        self.counts = {}
+        self._durations = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def record(self, stage: str, duration_secs: float) -> None:
+        """Records a duration for the stage
+        """
+        with self._lock:
+            durations = self._durations.get(stage)
+            if durations is None:
+                durations = RingBuffer(self.window_size)
+                self._durations[stage] = durations
+                self.counts[stage] = 0
+            durations.append(duration_secs)
+            self.counts[stage] += 1
+
+    def record_since(self, stage: str, start_time: float) -> None:
+        """Records the time since start_time, a value of time.perf_counter()
+        """
+        self.record(stage, time.perf_counter() - start_time)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Records how long the body of the with statement takes
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_since(stage, start_time)
+
+    def percentile(self, stage: str, q: float) -> float:
+        """Returns the qth percentile of the recent durations of the stage, in
+        seconds, or NaN if none have been recorded
+        """
+        with self._lock:
+            durations = self._durations.get(stage)
+            if durations is None or len(durations) == 0:
+                return float("nan")
+            return float(np.percentile(durations.view(), q))
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Returns the count, and the mean, p50, p99 and maximum of the recent
+        durations in milliseconds, for each stage
+        """
+        with self._lock:
+            durations = {stage: durations.view().copy()
+                            for stage, durations in self._durations.items()}
+            counts = dict(self.counts)
+
+        summary = {}
+        for stage, stage_durations in durations.items():
+            stage_durations_ms = stage_durations*1000
+            p50, p99 = np.percentile(stage_durations_ms, (50, 99))
+            summary[stage] = {
+                "count": counts[stage],
+                "mean_ms": float(stage_durations_ms.mean()),
+                "p50_ms": float(p50),
+                "p99_ms": float(p99),
+                "max_ms": float(stage_durations_ms.max()),
+            }
+        return summary
+
+    def export(self, path: str) -> None:
+        """Writes the summary, and the time at which it was made, to a JSON
+        file. The file is replaced in one step, so readers never see it
+        partially written.
+        """
+        metrics = {"updated_at": time.time(), "stages": self.summary()}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(metrics, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def start_exporting(self, path: str, interval_secs: float = 60) -> None:
+        """Exports the summary to path every interval_secs, from a background
+        thread
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._export_loop,
+                                        args=(path, interval_secs),
+                                        name="latency-export", daemon=True)
+        self._thread.start()
+
+    def _export_loop(self, path: str, interval_secs: float) -> None:
+        while not self._stop_event.wait(interval_secs):
+            try:
+                self.export(path)
+            except Exception as e:
+                print("Error exporting latency metrics:", e)
+
+    def stop_exporting(self, path: Optional[str] = None) -> None:
+        """Stops the background thread, exporting a final summary to path if
+        given
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if path is not None:
+            self.export(path)
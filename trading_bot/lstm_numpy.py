@@ -0,0 +1,178 @@
+import argparse
+
+import numpy as np
+
+# Layer configuration values that the NumPy forward pass supports. Other values
+# (e.g. a different activation) are rejected when exporting, rather than
+# silently giving different predictions.
+SUPPORTED_LSTM_CONFIG = {
+    "activation": "tanh",
+    "recurrent_activation": "sigmoid",
+    "use_bias": True,
+    "go_backwards": False,
+    "stateful": False,
+    "time_major": False,
+}
+SUPPORTED_DENSE_CONFIG = {
+    "activation": "linear",
+    "use_bias": True,
+}
+
+
+def export_keras_weights(model_path: str, weights_path: str) -> None:
+    """Extracts the weights of a trained Keras model made up of LSTM layers
+    followed by Dense layers (such as the one built in the training notebook)
+    into a compressed .npz file, which can be loaded by NumpyLSTMModel without
+    TensorFlow being installed.
+
+    Parameters
+    ----------
+    model_path : str
+        The location of the saved Keras model
+    weights_path : str
+        The location of the .npz file to be written
+
+    Returns
+    -------
+    None
+    """
+    from tensorflow import keras
+
+    model = keras.models.load_model(model_path)
+    arrays = {}
+    layer_types = []
+    for i, layer in enumerate(model.layers):
+        layer_type = type(layer).__name__
+        config = layer.get_config()
+        if layer_type == "LSTM":
+            supported_config = SUPPORTED_LSTM_CONFIG
+        elif layer_type == "Dense":
+            supported_config = SUPPORTED_DENSE_CONFIG
+        else:
+            raise ValueError(f"Layer {layer.name} of type {layer_type} is not supported")
+
+        for key, value in supported_config.items():
+            if key in config and config[key] != value:
+                raise ValueError(f"Layer {layer.name} has {key}={config[key]}, "
+                                    f"but only {key}={value} is supported")
+
+        if layer_type == "LSTM":
+            kernel, recurrent_kernel, bias = layer.get_weights()
+            arrays[f"layer_{i}_recurrent_kernel"] = recurrent_kernel
+            arrays[f"layer_{i}_return_sequences"] = np.array(config["return_sequences"])
+        else:
+            kernel, bias = layer.get_weights()
+        arrays[f"layer_{i}_kernel"] = kernel
+        arrays[f"layer_{i}_bias"] = bias
+        layer_types.append(layer_type)
+
+    np.savez_compressed(weights_path, layer_types=np.array(layer_types), **arrays)
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 0.5*(np.tanh(0.5*x) + 1)
+
+
+class NumpyLSTMModel():
+    """Forward pass of a stack of LSTM and Dense layers, written in NumPy so
+    that predictions can be made without loading TensorFlow. The weights are
+    those written by export_keras_weights, and predictions match those of the
+    original Keras model (see check_keras_parity).
+
+    Attributes
+    ----------
+    layers : list
+        Tuples of (layer type, weights) for each layer, in order
+    """
+    def __init__(self, weights_path: str) -> None:
+        self.layers = []
+        with np.load(weights_path) as weights:
+            for i, layer_type in enumerate(weights["layer_types"]):
+                kernel = weights[f"layer_{i}_kernel"].astype(np.float32)
+                bias = weights[f"layer_{i}_bias"].astype(np.float32)
+                if layer_type == "LSTM":
+                    recurrent_kernel = weights[f"layer_{i}_recurrent_kernel"].astype(np.float32)
+                    return_sequences = bool(weights[f"layer_{i}_return_sequences"])
+                    self.layers.append(("LSTM", (kernel, recurrent_kernel, bias,
+                                                    return_sequences)))
+                else:
+                    self.layers.append(("Dense", (kernel, bias)))
+
+    @staticmethod
+    def lstm_forward(x: np.ndarray, kernel: np.ndarray, recurrent_kernel: np.ndarray,
+                        bias: np.ndarray, return_sequences: bool) -> np.ndarray:
+        """Runs a single LSTM layer over x, of shape (batch, timesteps,
+        features). Gates are ordered input, forget, cell, output, as in Keras.
+        """
+        batch_size, num_timesteps, _ = x.shape
+        units = recurrent_kernel.shape[0]
+
+        # The input contribution to the gates is computed for every timestep
+        # at once, leaving only the recurrent part inside the loop
+        x_gates = x @ kernel + bias
+        h = np.zeros((batch_size, units), dtype=np.float32)
+        c = np.zeros((batch_size, units), dtype=np.float32)
+        if return_sequences:
+            outputs = np.empty((batch_size, num_timesteps, units), dtype=np.float32)
+
+        for t in range(num_timesteps):
+            gates = x_gates[:, t] + h @ recurrent_kernel
+            i = sigmoid(gates[:, :units])
+            f = sigmoid(gates[:, units:2*units])
+            c_candidate = np.tanh(gates[:, 2*units:3*units])
+            o = sigmoid(gates[:, 3*units:])
+            c = f*c + i*c_candidate
+            h = o*np.tanh(c)
+            if return_sequences:
+                outputs[:, t] = h
+
+        return outputs if return_sequences else h
+
+    def predict(self, x: np.ndarray, batch_size: int = None, verbose: int = 0) -> np.ndarray:
+        """Returns predictions for x, of shape (batch, timesteps, features),
+        with the same signature as keras.Model.predict so that it can be used
+        in its place
+        """
+        out = np.asarray(x, dtype=np.float32)
+        for layer_type, weights in self.layers:
+            if layer_type == "LSTM":
+                out = self.lstm_forward(out, *weights)
+            else:
+                kernel, bias = weights
+                out = out @ kernel + bias
+        return out
+
+
+def check_keras_parity(model_path: str, weights_path: str, num_windows: int = 64,
+                        atol: float = 1e-4) -> bool:
+    """Checks that NumpyLSTMModel, loaded from weights_path, gives the same
+    predictions as the Keras model saved at model_path, on random-walk windows
+    of 120 normalised prices like those used by BasicLSTM.
+    """
+    from tensorflow import keras
+
+    keras_model = keras.models.load_model(model_path)
+    numpy_model = NumpyLSTMModel(weights_path)
+
+    rng = np.random.default_rng(0)
+    windows = np.exp(np.cumsum(rng.normal(0, 1e-3, (num_windows, 120)), axis=1))
+    windows = (windows/windows.mean(axis=1, keepdims=True))[:, :, None]
+
+    expected = keras_model.predict(windows)
+    predicted = numpy_model.predict(windows)
+    max_diff = np.abs(expected - predicted).max()
+    print(f"Maximum difference between Keras and NumPy predictions: {max_diff:.2e}")
+    return bool(max_diff <= atol)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the weights of a Keras "
+                                        "LSTM model for use without TensorFlow, "
+                                        "and check the exported model's "
+                                        "predictions match")
+    parser.add_argument("model_path")
+    parser.add_argument("weights_path")
+    args = parser.parse_args()
+
+    export_keras_weights(args.model_path, args.weights_path)
+    print("Predictions match:", check_keras_parity(args.model_path, args.weights_path))
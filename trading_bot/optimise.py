@@ -0,0 +1,314 @@
+# Core Python modules
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+from multiprocessing import shared_memory
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Project modules
+from backtest import (load_historical_closes, run_backtest_on_signals,
+                        STOP_LOSS_THRESHOLD, STOP_LOSS_COOL_DOWN_MINS, TRADE_QUANTITY)
+from strategies import (StrategyInterface, BasicRSI, RSIWithBreakoutConfirmation,
+                        MultiTimeframeRSI, BasicLSTM)
+
+# Additional modules
+import numpy as np
+import pandas as pd
+
+# Parameters which may be swept for each strategy, in addition to the stop
+# loss parameters, which apply to every strategy
+STRATEGY_PARAMS = {
+    "rsi": ("rsi_period", "rsi_overbought", "rsi_oversold"),
+    "rsi_breakout": ("rsi_period", "rsi_overbought", "rsi_oversold"),
+    "mtf_rsi": ("rsi_period", "rsi_overbought", "rsi_oversold",
+                "confirmation_interval", "confirmation_rsi_threshold"),
+    "lstm": ("percent_buy_threshold", "percent_sell_threshold"),
+}
+STOP_LOSS_PARAMS = ("stop_loss_threshold", "cool_down_mins")
+
+# Values used for any parameter not swept
+DEFAULT_PARAMS = {
+    "rsi_period": 14,
+    "rsi_overbought": 70,
+    "rsi_oversold": 30,
+    "confirmation_interval": "15m",
+    "confirmation_rsi_threshold": 50,
+    "percent_buy_threshold": 0.1,
+    "percent_sell_threshold": 1,
+    "stop_loss_threshold": STOP_LOSS_THRESHOLD,
+    "cool_down_mins": STOP_LOSS_COOL_DOWN_MINS,
+}
+
+# Columns results can be ranked by, and whether they are sorted in ascending
+# order (i.e. whether lower values are better)
+RANKINGS = {
+    "pnl": ("total_pnl", False),
+    "drawdown": ("max_drawdown", True),
+    "pnl_to_drawdown": ("pnl_to_drawdown", False),
+}
+
+# Arrays shared with the worker processes, keyed by name, which are attached
+# once per worker by _attach_shared_arrays
+_shared_arrays = {}
+_shared_memory_blocks = []
+
+
+def create_strategy(strategy_name: str, params: Dict[str, Any],
+                        model_path: Optional[str] = None) -> StrategyInterface:
+    """Creates the strategy named (as in backtest.py) with the parameters
+    given, using DEFAULT_PARAMS for any missing
+    """
+    params = {**DEFAULT_PARAMS, **params}
+    if strategy_name == "rsi":
+        return BasicRSI(int(params["rsi_period"]), params["rsi_overbought"],
+                        params["rsi_oversold"])
+    if strategy_name == "rsi_breakout":
+        return RSIWithBreakoutConfirmation(int(params["rsi_period"]),
+                                            params["rsi_overbought"],
+                                            params["rsi_oversold"])
+    if strategy_name == "mtf_rsi":
+        return MultiTimeframeRSI(int(params["rsi_period"]), params["rsi_overbought"],
+                                    params["rsi_oversold"],
+                                    params["confirmation_interval"],
+                                    params["confirmation_rsi_threshold"])
+    if strategy_name == "lstm":
+        return BasicLSTM(model_path, params["percent_buy_threshold"],
+                            params["percent_sell_threshold"])
+    raise ValueError(f"Unknown strategy {strategy_name}")
+
+
+def parse_values(spec: str) -> List[Any]:
+    """Parses the values to sweep for a parameter, given either as a comma
+    separated list (e.g. "7,14,21" or "5m,15m") or as an inclusive range with
+    a step (e.g. "60:80:5")
+    """
+    if spec.count(":") == 2:
+        start, stop, step = (float(value) for value in spec.split(":"))
+        values = np.arange(start, stop + step/2, step)
+        if all(float(value).is_integer() for value in (start, stop, step)):
+            return [int(value) for value in values]
+        return [round(float(value), 10) for value in values]
+
+    values = []
+    for value in spec.split(","):
+        try:
+            number = float(value)
+            values.append(int(number) if number.is_integer() and "." not in value else number)
+        except ValueError:
+            values.append(value)
+    return values
+
+
+def grid_search(param_values: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    """Returns every combination of the values given for each parameter
+    """
+    names = list(param_values)
+    return [dict(zip(names, combination))
+            for combination in itertools.product(*param_values.values())]
+
+
+def random_search(param_values: Dict[str, Sequence[Any]], num_samples: int,
+                    seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Returns num_samples distinct combinations of the values given for each
+    parameter, chosen at random from the full grid without building it
+    """
+    names = list(param_values)
+    sizes = [len(values) for values in param_values.values()]
+    num_combinations = 1
+    for size in sizes:
+        num_combinations *= size
+    if num_combinations <= num_samples:
+        return grid_search(param_values)
+    sample_idx = random.Random(seed).sample(range(num_combinations), num_samples)
+
+    # Each index is decoded into one value of each parameter, treating the
+    # grid as a mixed radix number
+    param_sets = []
+    for idx in sample_idx:
+        params = {}
+        for name, size in zip(reversed(names), reversed(sizes)):
+            idx, value_idx = divmod(idx, size)
+            params[name] = param_values[name][value_idx]
+        param_sets.append({name: params[name] for name in names})
+    return param_sets
+
+
+def _share_array(arr: np.ndarray) -> Tuple[str, tuple, str]:
+    """Copies an array into a new shared memory block, returning the details
+    needed to attach to it
+    """
+    arr = np.ascontiguousarray(arr)
+    block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+    _shared_memory_blocks.append(block)
+    return block.name, arr.shape, arr.dtype.str
+
+
+def _attach_shared_arrays(array_specs: Dict[Any, Tuple[str, tuple, str]]) -> None:
+    """Worker initialiser, attaching to the arrays shared by the parent
+    process without copying them
+    """
+    for key, (name, shape, dtype) in array_specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        _shared_memory_blocks.append(block)
+        arr = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        arr.flags.writeable = False
+        _shared_arrays[key] = arr
+
+
+def _release_shared_arrays(unlink: bool) -> None:
+    _shared_arrays.clear()
+    while _shared_memory_blocks:
+        block = _shared_memory_blocks.pop()
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+def _evaluate_param_sets(strategy_name: str, param_sets: List[Dict[str, Any]],
+                            quantity: float, fee_rate: float) -> List[Dict[str, Any]]:
+    """Backtests each parameter set, using the closing prices and features
+    shared by the parent process
+    """
+    closes_arr = _shared_arrays["closes"]
+    param_names = STRATEGY_PARAMS[strategy_name] + STOP_LOSS_PARAMS
+    results = []
+    for params in param_sets:
+        params = {name: params.get(name, DEFAULT_PARAMS[name]) for name in param_names}
+        strategy = create_strategy(strategy_name, params)
+        features = _shared_arrays[strategy.features_key()]
+        should_sell, should_buy = strategy.signals_from_features(features, closes_arr)
+        result = run_backtest_on_signals(closes_arr, should_sell, should_buy,
+                                            params["stop_loss_threshold"],
+                                            int(params["cool_down_mins"]),
+                                            quantity, fee_rate)
+        results.append({
+            **params,
+            "num_trades": result.num_trades,
+            "total_pnl": result.total_pnl,
+            "max_drawdown": result.max_drawdown,
+            "win_rate": result.win_rate,
+        })
+    return results
+
+
+def optimise(strategy_name: str, closes_arr: np.ndarray,
+                param_sets: List[Dict[str, Any]], model_path: Optional[str] = None,
+                quantity: float = TRADE_QUANTITY, fee_rate: float = 0,
+                rank_by: str = "pnl", max_workers: Optional[int] = None,
+                chunk_size: int = 16) -> pd.DataFrame:
+    """Backtests every parameter set on the closing prices across a pool of
+    processes, returning the results ranked by rank_by (one of RANKINGS),
+    with ties broken by PnL and then drawdown.
+
+    The features of each strategy (e.g. the RSI for each period, or the
+    LSTM's predictions) are computed once in this process for each distinct
+    features_key, rather than once per parameter set. The closing prices and
+    features are then placed in shared memory, which every worker attaches to
+    once, so they are never pickled or copied per task.
+
+    Parameters
+    ----------
+    strategy_name : str
+        One of the keys of STRATEGY_PARAMS
+    closes_arr : np.ndarray
+        Numpy array of closing prices
+    param_sets : List[Dict[str, Any]]
+        The parameter sets to backtest, e.g. from grid_search or
+        random_search, with DEFAULT_PARAMS used for any parameter missing
+    model_path : str, optional
+        Path to the LSTM model, required for the lstm strategy
+    rank_by : str
+        The key of RANKINGS to rank results by
+    max_workers : int, optional
+        The number of worker processes, by default the number of CPUs
+    chunk_size : int
+        The number of parameter sets backtested by each task
+
+    Returns
+    -------
+    results : pd.DataFrame
+        The parameters and backtest results for each parameter set, best
+        first
+    """
+    closes_arr = np.asarray(closes_arr, dtype=float)
+    array_specs = {}
+    try:
+        array_specs["closes"] = _share_array(closes_arr)
+        for params in param_sets:
+            strategy = create_strategy(strategy_name, params)
+            key = strategy.features_key()
+            if key not in array_specs:
+                if strategy_name == "lstm":
+                    strategy = create_strategy(strategy_name, params, model_path)
+                features = strategy.vectorised_features(closes_arr)
+                array_specs[key] = _share_array(features)
+
+        chunks = [param_sets[start:start + chunk_size]
+                    for start in range(0, len(param_sets), chunk_size)]
+        with ProcessPoolExecutor(max_workers or os.cpu_count(),
+                                    initializer=_attach_shared_arrays,
+                                    initargs=(array_specs,)) as executor:
+            futures = [executor.submit(_evaluate_param_sets, strategy_name, chunk,
+                                        quantity, fee_rate)
+                        for chunk in chunks]
+            results = [result for future in futures for result in future.result()]
+    finally:
+        _release_shared_arrays(unlink=True)
+
+    results = pd.DataFrame(results)
+    if results.empty:
+        return results
+    results["pnl_to_drawdown"] = results["total_pnl"]/results["max_drawdown"].replace(0, np.nan)
+    rank_cols = [RANKINGS[rank_by]] + [RANKINGS[name] for name in ("pnl", "drawdown")
+                                        if name != rank_by]
+    return results.sort_values([col for col, _ in rank_cols],
+                                ascending=[ascending for _, ascending in rank_cols],
+                                na_position="last", kind="stable").reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest a grid or random "
+                                        "sample of strategy parameters in parallel")
+    parser.add_argument("csv_path", help="CSV of historical candles, or a candle "
+                        "store file")
+    parser.add_argument("--strategy", choices=list(STRATEGY_PARAMS), default="rsi")
+    parser.add_argument("--param", action="append", default=[],
+                        metavar="NAME=VALUES",
+                        help="Values to sweep for a parameter, e.g. rsi_period=7,14,21 "
+                        "or rsi_overbought=60:80:5")
+    parser.add_argument("--random", type=int, default=None, metavar="NUM_SAMPLES",
+                        help="Backtest a random sample of the grid rather than all of it")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--model-path", default="../../models/LSTM/model_save")
+    parser.add_argument("--fee-rate", type=float, default=0)
+    parser.add_argument("--rank-by", choices=list(RANKINGS), default="pnl")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--output", default=None, help="CSV to save all results to")
+    args = parser.parse_args()
+
+    param_values = {}
+    for param in args.param:
+        name, spec = param.split("=", 1)
+        if name not in STRATEGY_PARAMS[args.strategy] + STOP_LOSS_PARAMS:
+            parser.error(f"{name} is not a parameter of the {args.strategy} strategy")
+        param_values[name] = parse_values(spec)
+    if args.random is not None:
+        param_sets = random_search(param_values, args.random, args.seed)
+    else:
+        param_sets = grid_search(param_values)
+
+    closes = load_historical_closes(args.csv_path)
+    start_time = time.perf_counter()
+    results = optimise(args.strategy, closes, param_sets, args.model_path,
+                        fee_rate=args.fee_rate, rank_by=args.rank_by,
+                        max_workers=args.workers)
+    print(f"Backtested {len(param_sets)} parameter sets on {len(closes)} candles "
+          f"in {time.perf_counter() - start_time:.2f}s")
+    print(results.head(args.top).to_string())
+    if args.output:
+        results.to_csv(args.output, index=False)
@@ -0,0 +1,226 @@
+# Core Python modules
+import argparse
+import gzip
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+# Project modules
+from stream_parsing import KlineUpdate, parse_stream_message
+
+# Recordings are gzipped text files, with a line for each message holding the
+# milliseconds since the previous message was received, a tab and the raw
+# message as received from the websocket. The first message recorded in each
+# session instead holds its full receive time, marked with an =.
+
+
+class StreamRecorder():
+    """Records the raw messages received from the websocket, and when they
+    were received, to a compact gzipped file which can be replayed with
+    replay_recording. Messages are compressed in memory and written at least
+    every flush_interval_secs, so recording adds little to the handling of
+    each message. Recording to an existing file appends to it.
+
+    Attributes
+    ----------
+    path : str
+        The file messages are recorded to
+    flush_interval_secs : float
+        Maximum time a message is held in memory before being written
+    num_recorded : int
+        The number of messages recorded so far
+    """
+    def __init__(self, path: str, flush_interval_secs: float = 5.0) -> None:
+        self.path = path
+        self.flush_interval_secs = flush_interval_secs
+        self.num_recorded = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._prev_received_ms = None
+        self._last_flush_time = time.monotonic()
+
+    def record(self, message: str, received_ms: Optional[int] = None) -> None:
+        """Records a message, received at received_ms (by default, now)
+        """
+        if received_ms is None:
+            received_ms = int(time.time()*1000)
+        with self._lock:
+            if self._file is None:
+                return
+            if self._prev_received_ms is None:
+                received = f"={received_ms}"
+            else:
+                received = max(received_ms - self._prev_received_ms, 0)
+            self._prev_received_ms = received_ms
+            self._file.write(f"{received}\t{message}\n")
+            self.num_recorded += 1
+            if time.monotonic() - self._last_flush_time >= self.flush_interval_secs:
+                self._file.flush()
+                self._last_flush_time = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_recording(path: str) -> Iterator[Tuple[int, str]]:
+    """Yields (received_ms, message) for each message in a recording, where
+    received_ms is the time at which it was received in milliseconds since
+    the epoch
+    """
+    received_ms = 0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            received, message = line.rstrip("\n").split("\t", 1)
+            if received.startswith("="):
+                received_ms = int(received[1:])
+            else:
+                received_ms += int(received)
+            yield received_ms, message
+
+
+def replay_recording(path: str, on_message: Callable[[Any, str], None],
+                        speed: float = 1.0) -> Dict[str, float]:
+    """Passes each message in a recording to on_message (called as by the
+    websocket, with None in place of the websocket), at speed times the rate
+    at which they were received. A speed of float("inf") replays the
+    messages as fast as possible. Messages are never skipped, so if they
+    cannot be handled as fast as requested, playback falls behind.
+
+    Returns
+    -------
+    Dict[str, float]
+        The number of messages replayed, the time they spanned when recorded,
+        the time taken to replay them, the speed-up achieved over real time
+        and the furthest playback fell behind, in seconds
+    """
+    num_messages = 0
+    first_received_ms = None
+    recorded_secs = 0.0
+    max_lag_secs = 0.0
+    start_time = time.perf_counter()
+    for received_ms, message in read_recording(path):
+        if first_received_ms is None:
+            first_received_ms = received_ms
+        recorded_secs = (received_ms - first_received_ms)/1000
+
+        if speed != float("inf"):
+            lag_secs = time.perf_counter() - start_time - recorded_secs/speed
+            if lag_secs < 0:
+                time.sleep(-lag_secs)
+            else:
+                max_lag_secs = max(max_lag_secs, lag_secs)
+        on_message(None, message)
+        num_messages += 1
+
+    replay_secs = time.perf_counter() - start_time
+    return {
+        "messages": num_messages,
+        "recorded_secs": recorded_secs,
+        "replay_secs": replay_secs,
+        "speed_up": recorded_secs/replay_secs if replay_secs else float("inf"),
+        "max_lag_secs": max_lag_secs,
+    }
+
+
+def first_event_ms(path: str) -> Optional[int]:
+    """Returns the event time of the first kline message in a recording
+    """
+    for _, message in read_recording(path):
+        update = parse_stream_message(message)
+        if isinstance(update, KlineUpdate):
+            return update.event_time_ms
+    return None
+
+
+def import_stub_bot(work_dir: str, model_path: Optional[str] = None) -> Any:
+    """Imports trading_bot.py set up to run against the stub exchange (see
+    stub_exchange.py), so that orders are filled locally, with the CSVs and
+    candle store it writes kept under work_dir. The working directory is
+    changed to a directory within work_dir, as the bot's paths are relative
+    to it, and should be restored by the caller once done with the bot.
+    """
+    bot_dir = os.path.join(work_dir, "bot")
+    os.makedirs(bot_dir, exist_ok=True)
+    os.makedirs(os.path.join(work_dir, "Trading CSVs"), exist_ok=True)
+    os.environ["TRADING_BOT_STUB_EXCHANGE"] = "1"
+    if model_path is not None:
+        os.environ["TRADING_BOT_MODEL_PATH"] = os.path.abspath(model_path)
+    os.chdir(bot_dir)
+
+    import trading_bot
+    return trading_bot
+
+
+def shutdown_bot(trading_bot: Any) -> None:
+    """Waits for any orders in flight, and writes out the bot's logs
+    """
+    trading_bot.order_executor.shutdown()
+    trading_bot.log_writer.close()
+    trading_bot.candle_store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recording of the "
+                                        "websocket stream through the bot, filling "
+                                        "orders with the stub exchange")
+    parser.add_argument("recording_path")
+    parser.add_argument("--speed", default="1",
+                        help="Multiple of real time to replay at, or max to replay "
+                                "as fast as possible")
+    parser.add_argument("--work-dir", default=None,
+                        help="Directory in which the bot's CSVs are written (by "
+                                "default a new temporary directory)")
+    parser.add_argument("--model-path", default=None,
+                        help="LSTM model to use in place of the bot's default")
+    parser.add_argument("--candle-store", default=None,
+                        help="Candle store to warm start the sessions from, as at "
+                                "the start of the recording")
+    args = parser.parse_args()
+
+    speed = float("inf") if args.speed == "max" else float(args.speed)
+    recording_path = os.path.abspath(args.recording_path)
+    candle_store_dir = args.candle_store and os.path.abspath(args.candle_store)
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="replay_"))
+
+    prev_dir = os.getcwd()
+    trading_bot = import_stub_bot(work_dir, args.model_path)
+    try:
+        if candle_store_dir is not None:
+            from candle_store import CandleStore
+            from warm_start import load_recent_candles, warm_start_session
+
+            # Only candles which had closed when the recording began are used
+            replay_store = CandleStore(candle_store_dir)
+            start_ms = first_event_ms(recording_path)
+            for symbol, sess in trading_bot.trading_sessions.items():
+                candles = load_recent_candles(symbol, trading_bot.WARM_START_CANDLES,
+                                                candle_store=replay_store,
+                                                now_ms=start_ms)
+                num_used = warm_start_session(sess, candles)
+                print(f"Warm started {symbol} with {num_used} candles")
+
+        stats = replay_recording(recording_path, trading_bot.on_message, speed)
+        shutdown_bot(trading_bot)
+    finally:
+        os.chdir(prev_dir)
+
+    print(f"\nReplayed {stats['messages']} messages spanning "
+            f"{stats['recorded_secs']:.0f}s in {stats['replay_secs']:.1f}s "
+            f"({stats['speed_up']:.0f}x real time, at most "
+            f"{stats['max_lag_secs']:.2f}s behind)")
+    print(f"Orders filled: {len(trading_bot.client.orders)}")
+    print(f"Balances: {trading_bot.client.balances}")
+    # The time from each message being sent to it being received is left out,
+    # as the messages were sent when recorded
+    for stage, stage_summary in trading_bot.latency_tracker.summary().items():
+        if stage == "exchange_to_receive":
+            continue
+        print(f"{stage:20} p50 {stage_summary['p50_ms']:8.3f}ms  "
+                f"p99 {stage_summary['p99_ms']:8.3f}ms")
+    print(f"Trading CSVs written to {os.path.join(work_dir, 'Trading CSVs')}")
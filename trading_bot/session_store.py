@@ -0,0 +1,78 @@
+# Core Python modules
+import os
+import threading
+from typing import Dict, Optional
+
+# Project modules
+from utilities import CurrentTradingSession
+
+SESSION_STATE_FILE_EXTENSION = ".state"
+
+
+class SessionStateStore():
+    """Saves the position and trailing stop loss state of each trading
+    session to disk, as the binary record returned by
+    CurrentTradingSession.snapshot, with one small file per symbol. Each save
+    writes the record to a temporary file which then replaces the symbol's
+    file in one step, so a crash never leaves a partially written state
+    behind, and restore sets a session's state back from its file after a
+    restart.
+
+    Attributes
+    ----------
+    directory : str
+        The directory holding the state files
+    """
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path(self, symbol: str) -> str:
+        return os.path.join(self.directory, symbol + SESSION_STATE_FILE_EXTENSION)
+
+    def save(self, sess: CurrentTradingSession) -> None:
+        """Saves the session's state. The state is read under the store's
+        lock, so that when a session is saved from several threads, the last
+        file written holds its latest state.
+        """
+        path = self.path(sess.symbol)
+        tmp_path = f"{path}.tmp"
+        with self._lock:
+            snapshot = sess.snapshot()
+            with open(tmp_path, "wb") as f:
+                f.write(snapshot)
+            os.replace(tmp_path, path)
+
+    def load(self, symbol: str) -> Optional[bytes]:
+        """Returns the last state saved for the symbol, or None if there is
+        none
+        """
+        try:
+            with open(self.path(symbol), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def restore(self, sess: CurrentTradingSession) -> bool:
+        """Sets the session's state to the last state saved for its symbol,
+        returning whether one was found
+        """
+        snapshot = self.load(sess.symbol)
+        if snapshot is None:
+            return False
+        sess.restore(snapshot)
+        return True
+
+    def restore_all(self, sessions: Dict[str, CurrentTradingSession]) -> None:
+        """Restores every session whose state has been saved, printing any
+        error rather than raising it
+        """
+        for symbol, sess in sessions.items():
+            try:
+                if self.restore(sess):
+                    print(f"Restored {symbol} state: in_long_position: "
+                            f"{sess.in_long_position}, max_price_since_buy: "
+                            f"{sess.max_price_since_buy}")
+            except Exception as e:
+                print(f"Error restoring {symbol} state:", e)
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+import threading
+from typing import Any, Callable, Hashable
+
+
+class SignalCache():
+    """Bounded cache of the features computed by a strategy for each candle
+    (e.g. the RSI, or the LSTM's prediction), keyed by symbol and candle
+    timestamp. Features are computed at most once per candle, however many
+    times they are read, and once max_entries is reached the least recently
+    used entry is evicted.
+
+    Attributes
+    ----------
+    max_entries : int
+        The maximum number of candles held
+    hits : int
+        The number of lookups served from the cache
+    misses : int
+        The number of lookups for which the features had to be computed
+    """
+    def __init__(self, max_entries: int = 1000) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._entries
+
+    def put(self, symbol: str, candle_ts: Hashable, features: Any) -> None:
+        """Stores features which have already been computed, e.g. by a
+        batched prediction
+        """
+        with self._lock:
+            self._entries[(symbol, candle_ts)] = features
+            self._entries.move_to_end((symbol, candle_ts))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, symbol: str, candle_ts: Hashable,
+                        compute: Callable[[], Any]) -> Any:
+        """Returns the features for the candle, calling compute to calculate
+        them if they are not already held
+        """
+        key = (symbol, candle_ts)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        features = compute()
+        self.put(symbol, candle_ts, features)
+        return features
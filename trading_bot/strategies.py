@@ -1,19 +1,103 @@
-from typing import Tuple
+from typing import Any, Tuple, List, Optional, Union, TYPE_CHECKING
 import json
 import talib
 import numpy as np
-from tensorflow import keras
-from tensorflow.python.keras.engine.sequential import Sequential
+from aggregation import parse_interval
+from indicators import StreamingRSI
+from lstm_numpy import NumpyLSTMModel
+
+# TensorFlow is only imported when a Keras model is loaded, so that bots using
+# exported weights (see lstm_numpy.py) do not need it
+if TYPE_CHECKING:
+    from tensorflow.python.keras.engine.sequential import Sequential
+
+# Models loaded so far, keyed by path, so that strategy instances for
+# different symbols share a single copy of each model
+_loaded_models = {}
 
 
 class StrategyInterface():
     """Strategies should take this format to ensure no modification to
     algo_main is required.
+
+    Trades are decided on the close of each 1 minute candle. Strategies which
+    also use bars of other intervals list them in TIMEFRAMES (e.g. ("15s",
+    "1m", "1h")), and the bars for every interval are then built from the same
+    stream and passed to on_bar as each one completes.
     """
+    TIMEFRAMES = ("1m",)
+
     def should_sell(self) -> bool:
         return False
     def should_buy(self) -> bool:
         return False
+    def update(self, close: float) -> None:
+        """Called once with each new closing price, so that strategies can
+        keep indicators up to date incrementally. Strategies which do so
+        return the same features as calc.
+        """
+        return None
+    def warm_up(self, closes_arr: np.ndarray) -> None:
+        """Called on start-up with the closing prices of recent candles, oldest
+        first, so that strategies with incrementally updated indicators start
+        with them up to date. By default each price is passed to update.
+        """
+        for close in np.asarray(closes_arr, dtype=float).tolist():
+            self.update(close)
+    def on_bar(self, interval: str, closes_arr: np.ndarray) -> None:
+        """Called when a bar of one of the intervals in TIMEFRAMES (other than
+        1m) completes, with the closing prices of the bars held for that
+        interval, so that strategies can keep indicators for it up to date.
+        """
+        return None
+    def calc(self, closes_arr: np.ndarray) -> None:
+        """Returns the features (e.g. indicators or predictions) the strategy
+        uses to decide whether to trade, so that they can be computed once per
+        candle and cached.
+        """
+        return None
+    def calc_after_update(self, closes_arr: np.ndarray, updated: Any) -> Any:
+        """Returns the features for the candle, given what update returned
+        for it, so that features already computed incrementally are not
+        computed again. By default these are the features returned by update,
+        or those returned by calc if update returned None.
+        """
+        return updated if updated is not None else self.calc(closes_arr)
+    def should_sell_and_buy(self, features, closes_arr: np.ndarray,
+                                in_long_position: bool) -> Tuple[bool, bool]:
+        """Returns (should_sell, should_buy), given the features returned by
+        calc, so that both can be decided without recomputing them.
+        """
+        return self.should_sell(), self.should_buy()
+    def vectorised_signals(self, closes_arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns boolean arrays (should_sell, should_buy) for every candle in
+        closes_arr, ignoring whether a position is held. Used by the backtest
+        engine, which applies the position, stop loss and cool-down logic
+        itself.
+        """
+        closes_arr = np.asarray(closes_arr, dtype=float)
+        return self.signals_from_features(self.vectorised_features(closes_arr),
+                                            closes_arr)
+    def vectorised_features(self, closes_arr: np.ndarray) -> Optional[np.ndarray]:
+        """Returns the features (e.g. the RSI) the strategy's signals are
+        computed from, for every candle in closes_arr. Strategies with the
+        same features_key share the same features, so that when several
+        parameter sets are backtested the features are only computed once.
+        """
+        return None
+    def features_key(self) -> tuple:
+        """Identifies the features returned by vectorised_features, which are
+        the same for every strategy with the same key
+        """
+        return (type(self).__name__,)
+    def signals_from_features(self, features: Optional[np.ndarray],
+                                closes_arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns boolean arrays (should_sell, should_buy), as in
+        vectorised_signals, given the features returned by
+        vectorised_features
+        """
+        no_signal = np.zeros(len(closes_arr), dtype=bool)
+        return no_signal, no_signal.copy()
 
 
 class BasicRSI(StrategyInterface):
@@ -35,13 +119,22 @@ class BasicRSI(StrategyInterface):
         self.RSI_OVERBOUGHT = RSI_OVERBOUGHT
         self.RSI_OVERSOLD = RSI_OVERSOLD
         self.MAX_MINS_OF_PRICES_HELD_IN_MEMORY = RSI_PERIOD + 2
+        self.streaming_rsi = StreamingRSI(RSI_PERIOD)
     
     def calc(self, closes_arr: np.ndarray) -> bool:
-        """Calculate and returns the current RSI
+        """Calculate and returns the current RSI, recomputing it over the whole
+        of closes_arr
         """
         rsi = talib.RSI(closes_arr, self.RSI_PERIOD)
         cur_rsi = rsi[-1]
         return cur_rsi
+
+    def update(self, close: float) -> float:
+        """Adds a new closing price to the streaming RSI and returns the
+        current RSI. This is the constant-time equivalent of calc, and gives
+        the same value as talib.RSI over every price passed to update.
+        """
+        return self.streaming_rsi.update(close)
     
     def should_sell(self, cur_rsi: float, in_long_position: bool) -> bool:
         """Returns True if there is a long position currently open and the RSI
@@ -55,6 +148,30 @@ class BasicRSI(StrategyInterface):
         """
         return (not in_long_position) and cur_rsi <= self.RSI_OVERSOLD
 
+    def should_sell_and_buy(self, cur_rsi: float, closes_arr: np.ndarray,
+                                in_long_position: bool) -> Tuple[bool, bool]:
+        """Returns (should_sell, should_buy) given the RSI returned by calc or
+        update
+        """
+        return (self.should_sell(cur_rsi, in_long_position),
+                self.should_buy(cur_rsi, in_long_position))
+
+    def vectorised_features(self, closes_arr: np.ndarray) -> np.ndarray:
+        """Returns the RSI at every candle, computed once over the whole
+        series
+        """
+        return talib.RSI(np.asarray(closes_arr, dtype=float), self.RSI_PERIOD)
+
+    def features_key(self) -> tuple:
+        return ("RSI", self.RSI_PERIOD)
+
+    def signals_from_features(self, rsi: np.ndarray,
+                                closes_arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns boolean arrays (should_sell, should_buy) for every candle,
+        given the RSI at every candle
+        """
+        return rsi >= self.RSI_OVERBOUGHT, rsi <= self.RSI_OVERSOLD
+
 class RSIWithBreakoutConfirmation(BasicRSI):
     """Strategy that is similar to BasicRSI, but waits for a reversal to begin
     before making a trade.
@@ -79,6 +196,14 @@ class RSIWithBreakoutConfirmation(BasicRSI):
         prev_rsi = super().calc(closes_arr[:-1])
         return cur_price, prev_price, prev_rsi
 
+    def update(self, close: float) -> Tuple[float, float, float]:
+        """Adds a new closing price to the streaming RSI and returns the
+        previous RSI, alongside the current and previous prices, as in calc
+        """
+        super().update(close)
+        return (self.streaming_rsi.last_close, self.streaming_rsi.prev_close,
+                self.streaming_rsi.prev_value)
+
     def should_sell(self, prev_rsi: float, in_long_position: bool,
                         cur_price: float, prev_price: float) -> bool:
         """Returns True if there is a long position currently open, the RSI is
@@ -95,6 +220,105 @@ class RSIWithBreakoutConfirmation(BasicRSI):
         """
         return super().should_buy(prev_rsi, in_long_position) and cur_price > prev_price
 
+    def should_sell_and_buy(self, features: Tuple[float, float, float],
+                                closes_arr: np.ndarray,
+                                in_long_position: bool) -> Tuple[bool, bool]:
+        """Returns (should_sell, should_buy) given the prices and previous RSI
+        returned by calc or update
+        """
+        cur_price, prev_price, prev_rsi = features
+        return (self.should_sell(prev_rsi, in_long_position, cur_price, prev_price),
+                self.should_buy(prev_rsi, in_long_position, cur_price, prev_price))
+
+    def signals_from_features(self, rsi: np.ndarray,
+                                closes_arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns boolean arrays (should_sell, should_buy) for every candle,
+        given the RSI at every candle, where the RSI at each candle is taken
+        from the previous candle as in calc.
+        """
+        closes_arr = np.asarray(closes_arr, dtype=float)
+        prev_rsi = np.full_like(rsi, np.nan)
+        prev_rsi[1:] = rsi[:-1]
+        price_change = np.zeros_like(closes_arr)
+        price_change[1:] = np.diff(closes_arr)
+        should_sell = (prev_rsi >= self.RSI_OVERBOUGHT) & (price_change < 0)
+        should_buy = (prev_rsi <= self.RSI_OVERSOLD) & (price_change > 0)
+        return should_sell, should_buy
+
+class MultiTimeframeRSI(BasicRSI):
+    """Strategy that is similar to BasicRSI, but only buys when the RSI of a
+    longer interval confirms that the price is trending upwards, i.e. buys
+    short-term dips in a longer-term uptrend.
+
+    Attributes
+    ----------
+    RSI_PERIOD : int
+        The period over which the RSI is calculated, for both intervals
+    RSI_OVERBOUGHT : int
+        Threshold over which a sell will be executed
+    RSI_OVERSOLD : int
+        Threshold below which a buy will be executed
+    CONFIRMATION_INTERVAL : str
+        The longer interval whose RSI confirms the trend, e.g. "15m"
+    CONFIRMATION_RSI_THRESHOLD : float
+        Threshold above which the longer interval's RSI must be to buy
+    """
+    def __init__(self, RSI_PERIOD: float, RSI_OVERBOUGHT: float, RSI_OVERSOLD: float,
+                    CONFIRMATION_INTERVAL: str = "15m",
+                    CONFIRMATION_RSI_THRESHOLD: float = 50):
+        super().__init__(RSI_PERIOD, RSI_OVERBOUGHT, RSI_OVERSOLD)
+        self.CONFIRMATION_INTERVAL = CONFIRMATION_INTERVAL
+        self.CONFIRMATION_RSI_THRESHOLD = CONFIRMATION_RSI_THRESHOLD
+        self.TIMEFRAMES = ("1m", CONFIRMATION_INTERVAL)
+        self.confirmation_rsi = np.nan
+
+    def on_bar(self, interval: str, closes_arr: np.ndarray) -> None:
+        """Updates the RSI of the confirmation interval
+        """
+        if interval == self.CONFIRMATION_INTERVAL and len(closes_arr) > self.RSI_PERIOD:
+            self.confirmation_rsi = talib.RSI(np.asarray(closes_arr, dtype=float),
+                                                self.RSI_PERIOD)[-1]
+
+    def should_buy(self, cur_rsi: float, in_long_position: bool) -> bool:
+        """Returns True if there is no long position currently open, the RSI
+        is at or below the oversold threshold and the confirmation interval's
+        RSI is above its threshold, otherwise False.
+        """
+        return (super().should_buy(cur_rsi, in_long_position)
+                and self.confirmation_rsi > self.CONFIRMATION_RSI_THRESHOLD)
+
+    def vectorised_features(self, closes_arr: np.ndarray) -> np.ndarray:
+        """Returns an array of shape (2, len(closes_arr)) holding the RSI and
+        the confirmation interval's RSI at every candle, taking the bars of
+        the confirmation interval to be consecutive groups of candles starting
+        from the first
+        """
+        closes_arr = np.asarray(closes_arr, dtype=float)
+        rsi = super().vectorised_features(closes_arr)
+
+        # Each candle only sees the confirmation bars completed by its close
+        candles_per_bar = parse_interval(self.CONFIRMATION_INTERVAL)//60
+        bar_closes = closes_arr[candles_per_bar - 1::candles_per_bar]
+        confirmation_rsi = np.full(len(closes_arr), np.nan)
+        if len(bar_closes):
+            bar_rsi = talib.RSI(bar_closes, self.RSI_PERIOD)
+            last_bar = (np.arange(len(closes_arr)) + 1)//candles_per_bar - 1
+            confirmation_rsi = np.where(last_bar >= 0, bar_rsi[np.maximum(last_bar, 0)],
+                                        np.nan)
+        return np.stack([rsi, confirmation_rsi])
+
+    def features_key(self) -> tuple:
+        return ("MultiTimeframeRSI", self.RSI_PERIOD, self.CONFIRMATION_INTERVAL)
+
+    def signals_from_features(self, features: np.ndarray,
+                                closes_arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns boolean arrays (should_sell, should_buy) for every candle,
+        given the RSI and confirmation interval's RSI at every candle
+        """
+        rsi, confirmation_rsi = features
+        should_sell, should_buy = super().signals_from_features(rsi, closes_arr)
+        return should_sell, should_buy & (confirmation_rsi > self.CONFIRMATION_RSI_THRESHOLD)
+
 class BasicLSTM(StrategyInterface):
     """Strategy using a pre-trained LSTM (Long short-term memory) neural
     network to predict movements in price. In particular, this stratgey buying
@@ -105,8 +329,10 @@ class BasicLSTM(StrategyInterface):
 
     Attributes
     ----------
-    model : Sequential
-        The pre-trained Keras model used to predict prices
+    model : Union[Sequential, NumpyLSTMModel]
+        The pre-trained model used to predict prices. If model_path points to
+        a .npz file of weights exported by lstm_numpy.py, the model is run in
+        NumPy rather than with TensorFlow
     buy_threshold : float
         The minimum predicted percent change required to buy. For instance,
         if this is set to be 1 then a trade will only be made if the predicted
@@ -116,61 +342,190 @@ class BasicLSTM(StrategyInterface):
         when set to 1 this will mean a trade can only be made when the
         predicted price is at least 1% below the current price. Note that this
         should be positive., as with the buy_threshold
+
+    model_path may be None when only signals_from_features is used, with
+    predictions made elsewhere, in which case no model is loaded.
     """
-    def __init__(self, model_path: str, percent_buy_threshold: float = 1,
+    def __init__(self, model_path: Optional[str], percent_buy_threshold: float = 1,
                     percent_sell_threshold: float = 1) -> None:
-        self.model = self.load_keras_model(model_path)
+        self.model_path = model_path
+        self.model = self.load_model(model_path) if model_path is not None else None
         self.buy_threshold = percent_buy_threshold/100
         self.sell_threshold = percent_sell_threshold/100
         self.MAX_MINS_OF_PRICES_HELD_IN_MEMORY = 120
 
-    def load_keras_model(self, model_path: str) -> Sequential:
+    def load_model(self, model_path: str) -> Union["Sequential", NumpyLSTMModel]:
+        """Loads the pre-trained model, reusing it if it has already been
+        loaded by another instance
+        """
+        if model_path not in _loaded_models:
+            if model_path.endswith(".npz"):
+                _loaded_models[model_path] = NumpyLSTMModel(model_path)
+            else:
+                _loaded_models[model_path] = self.load_keras_model(model_path)
+        return _loaded_models[model_path]
+
+    def load_keras_model(self, model_path: str) -> "Sequential":
         """Loads pre-trained keras model
         """
+        from tensorflow import keras
         model = keras.models.load_model(model_path)
         return model
 
     def predict_30_min_price(self, closes_arr: np.ndarray) -> float:
         """Predicts the price 30 mins in the future, using the pre-loaded
-        Keras LSTM
+        LSTM
+        """
+        closing_prices = np.array(closes_arr)[-120:].reshape(1, -1)
+        return self.predict_30_min_prices(closing_prices)[0]
+
+    def predict_30_min_prices(self, windows: np.ndarray,
+                                batch_size: int = 4096) -> np.ndarray:
+        """Predicts the price 30 mins after the end of each row of windows, an
+        array of shape (num_windows, 120), passing the windows through the
+        model in batches rather than one at a time
         """
-        # Normalising array of closing prices in order to make prediction
-        closing_prices = np.array(closes_arr)[-120:].copy()
-        closing_prices_mean = closing_prices.mean()
-        closing_prices_norm = closing_prices/closing_prices_mean
+        predictions = np.empty(len(windows))
+        for start in range(0, len(windows), batch_size):
+            batch = np.asarray(windows[start:start + batch_size], dtype=float)
 
-        # Using model to predict normalised pri e
-        pred_arr = self.model.predict(closing_prices_norm.reshape(1, -1, 1))
-        prediction_norm = pred_arr[0, 0]
+            # Normalising each window of closing prices by its mean in order
+            # to make predictions
+            batch_means = batch.mean(axis=1)
+            batch_norm = batch/batch_means[:, None]
 
-        # Denormalising and returning prediction
-        prediction = prediction_norm*closing_prices_mean
-        return prediction
+            # Using model to predict normalised prices
+            pred_arr = self.model.predict(batch_norm[:, :, None],
+                                            batch_size=len(batch))
 
-    def should_sell(self, closes_arr: np.ndarray, in_long_position: bool) -> bool:
+            # Denormalising predictions
+            predictions[start:start + len(batch)] = pred_arr[:, 0]*batch_means
+        return predictions
+
+    def calc(self, closes_arr: np.ndarray) -> Optional[float]:
+        """Returns the predicted price 30 mins in the future, or None if no
+        trade could be made on this candle whatever the prediction (because
+        there are too few prices, or the price has not changed)
+        """
+        if len(closes_arr) < 120 or closes_arr[-1] == closes_arr[-2]:
+            return None
+        return self.predict_30_min_price(closes_arr)
+
+    def needs_prediction(self, closes_arr: np.ndarray, in_long_position: bool) -> bool:
+        """Returns True if should_sell or should_buy would need a prediction
+        to be made in order to decide, i.e. if the price has moved in the
+        direction required to trade
+        """
+        if len(closes_arr) < 120:
+            return False
+        if in_long_position:
+            return closes_arr[-1] < closes_arr[-2]
+        return closes_arr[-1] > closes_arr[-2]
+
+    def should_sell(self, closes_arr: np.ndarray, in_long_position: bool,
+                        prediction: Optional[float] = None) -> bool:
         """Returns True if there is a long position currently open, the
         predicted price is at least percent_change_trade_threshold lower than
         the current price, and the price is decreasing. Otherwise returns
-        False.
+        False. If prediction is given (e.g. from batch_predict_30_min_prices)
+        it is used in place of calling the model.
         """
         if in_long_position and len(closes_arr) >= 120:
-            prediction = self.predict_30_min_price(closes_arr)
+            if prediction is None:
+                prediction = self.predict_30_min_price(closes_arr)
             cur_price = closes_arr[-1]
             if ((prediction <= cur_price*(1-self.sell_threshold))\
                 and (closes_arr[-1] < closes_arr[-2])):
                 return True
         return False
 
-    def should_buy(self, closes_arr: np.ndarray, in_long_position: bool) -> bool:
+    def should_buy(self, closes_arr: np.ndarray, in_long_position: bool,
+                        prediction: Optional[float] = None) -> bool:
         """Returns True if there is no long position currently open, the
         predicted price is at least percent_change_trade_threshold higher than
         the current price, and the price is increasing. Otherwise returns
-        False.
+        False. If prediction is given (e.g. from batch_predict_30_min_prices)
+        it is used in place of calling the model.
         """
         if (not in_long_position) and len(closes_arr) >= 120:
-            prediction = self.predict_30_min_price(closes_arr)
+            if prediction is None:
+                prediction = self.predict_30_min_price(closes_arr)
             cur_price = closes_arr[-1]
             if ((prediction >= cur_price*(1+self.buy_threshold))\
                 and (closes_arr[-1] > closes_arr[-2])):
                 return True
         return False
+
+    def should_sell_and_buy(self, prediction: Optional[float], closes_arr: np.ndarray,
+                                in_long_position: bool) -> Tuple[bool, bool]:
+        """Returns (should_sell, should_buy) given the prediction returned by
+        calc. A prediction of None means that none was needed, so no trade is
+        made.
+        """
+        if prediction is None and not self.needs_prediction(closes_arr, in_long_position):
+            return False, False
+        return (self.should_sell(closes_arr, in_long_position, prediction),
+                self.should_buy(closes_arr, in_long_position, prediction))
+
+    def vectorised_features(self, closes_arr: np.ndarray) -> np.ndarray:
+        """Returns the predicted price 30 mins after every candle in
+        closes_arr, or NaN where no trade could be made whatever the
+        prediction. Predictions are only made for windows ending in a price
+        change, as no trade can be made otherwise, and are made in batches.
+        """
+        closes_arr = np.asarray(closes_arr, dtype=float)
+        predictions = np.full(len(closes_arr), np.nan)
+        if len(closes_arr) < 120:
+            return predictions
+
+        # Row k of windows ends at candle k + 119
+        windows = np.lib.stride_tricks.sliding_window_view(closes_arr, 120)
+        window_ends = np.arange(119, len(closes_arr))
+        price_change = closes_arr[window_ends] - closes_arr[window_ends - 1]
+        to_predict = np.flatnonzero(price_change != 0)
+
+        # Gathering windows in chunks, so that the full (num_windows, 120)
+        # array never has to be held in memory at once
+        chunk_size = 65536
+        for start in range(0, len(to_predict), chunk_size):
+            chunk = to_predict[start:start + chunk_size]
+            predictions[window_ends[chunk]] = self.predict_30_min_prices(windows[chunk])
+        return predictions
+
+    def features_key(self) -> tuple:
+        return ("BasicLSTM", self.model_path)
+
+    def signals_from_features(self, predictions: np.ndarray,
+                                closes_arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns boolean arrays (should_sell, should_buy) for every candle,
+        given the predictions returned by vectorised_features
+        """
+        closes_arr = np.asarray(closes_arr, dtype=float)
+        price_change = np.zeros_like(closes_arr)
+        price_change[1:] = np.diff(closes_arr)
+        should_sell = ((predictions <= closes_arr*(1-self.sell_threshold))
+                        & (price_change < 0))
+        should_buy = ((predictions >= closes_arr*(1+self.buy_threshold))
+                        & (price_change > 0))
+        return should_sell, should_buy
+
+
+def batch_predict_30_min_prices(strategies: List[BasicLSTM],
+                                    closes_arrs: List[np.ndarray]) -> List[float]:
+    """Predicts the price 30 mins in the future for several BasicLSTM
+    strategies at once, e.g. one per symbol, where closes_arrs[i] holds the
+    closing prices for strategies[i]. The windows of all strategies sharing a
+    model are passed through it in a single call, so the cost of a prediction
+    does not grow linearly with the number of symbols traded.
+    """
+    predictions = [None]*len(strategies)
+    idx_by_model = {}
+    for i, strategy in enumerate(strategies):
+        idx_by_model.setdefault(id(strategy.model), []).append(i)
+
+    for idx in idx_by_model.values():
+        windows = np.stack([np.asarray(closes_arrs[i][-120:], dtype=float) for i in idx])
+        model_predictions = strategies[idx[0]].predict_30_min_prices(windows)
+        for i, prediction in zip(idx, model_predictions):
+            predictions[i] = float(prediction)
+    return predictions
@@ -0,0 +1,130 @@
+import asyncio
+import random
+import time
+from typing import Any, Callable, Optional
+
+import websockets
+
+
+class StreamClient():
+    """Receives messages from a websocket stream on an asyncio event loop,
+    reconnecting whenever the connection drops. The connection is pinged
+    every ping_interval_secs and dropped if a pong takes longer than
+    ping_timeout_secs, and is also dropped if no message arrives for
+    max_silence_secs (Binance's kline streams send an update every few
+    seconds), so that a connection which has silently died is noticed.
+    Reconnects back off exponentially, with jitter, from min_backoff_secs up
+    to max_backoff_secs, and the backoff resets once messages are received
+    again.
+
+    on_open is called after each connection is made (e.g. to backfill any
+    candles missed while disconnected). As it may block on REST requests, it
+    is run in a worker thread, and no messages are passed to on_message until
+    it has returned. Messages arriving in the meantime are held, up to max_queue of
+    them, so none are lost.
+
+    Attributes
+    ----------
+    url : str
+        The websocket URL connected to
+    on_message : Callable[[Any, str], None]
+        Called on the event loop with each message received, as
+        on_message(client, message)
+    on_open : Callable[[Any], None], optional
+        Called with the client each time a connection is made
+    on_close : Callable[[Any], None], optional
+        Called with the client each time a connection is closed
+    num_connections : int
+        The number of connections made so far
+    last_message_time : float
+        time.monotonic() value at which the last message was received
+    """
+    def __init__(self, url: str, on_message: Callable[[Any, str], None],
+                    on_open: Optional[Callable[[Any], None]] = None,
+                    on_close: Optional[Callable[[Any], None]] = None,
+                    ping_interval_secs: float = 20, ping_timeout_secs: float = 20,
+                    max_silence_secs: float = 60, min_backoff_secs: float = 1,
+                    max_backoff_secs: float = 60, max_queue: int = 10_000) -> None:
+        self.url = url
+        self.on_message = on_message
+        self.on_open = on_open
+        self.on_close = on_close
+        self.ping_interval_secs = ping_interval_secs
+        self.ping_timeout_secs = ping_timeout_secs
+        self.max_silence_secs = max_silence_secs
+        self.min_backoff_secs = min_backoff_secs
+        self.max_backoff_secs = max_backoff_secs
+        self.max_queue = max_queue
+        self.num_connections = 0
+        self.last_message_time = time.monotonic()
+        self._stopped = asyncio.Event()
+        self._websocket = None
+        self._received_since_connecting = False
+
+    async def run(self) -> None:
+        """Connects and receives messages until stop is called
+        """
+        backoff_secs = self.min_backoff_secs
+        while not self._stopped.is_set():
+            self._received_since_connecting = False
+            try:
+                async with websockets.connect(self.url,
+                                                ping_interval=self.ping_interval_secs,
+                                                ping_timeout=self.ping_timeout_secs,
+                                                max_queue=self.max_queue) as websocket:
+                    self._websocket = websocket
+                    self.num_connections += 1
+                    if self.on_open is not None:
+                        await asyncio.to_thread(self.on_open, self)
+                    await self._receive(websocket)
+            except asyncio.TimeoutError:
+                print(f"No message received for {self.max_silence_secs}s, reconnecting")
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                print("Websocket connection error:", repr(e))
+            finally:
+                self._websocket = None
+
+            if self.on_close is not None:
+                self.on_close(self)
+            if self._stopped.is_set():
+                break
+
+            # Connections which received messages before dropping are retried
+            # straight away, and repeated failures back off exponentially
+            if self._received_since_connecting:
+                backoff_secs = self.min_backoff_secs
+            delay_secs = backoff_secs*random.uniform(0.5, 1)
+            print(f"Reconnecting in {delay_secs:.1f}s")
+            try:
+                await asyncio.wait_for(self._stopped.wait(), delay_secs)
+            except asyncio.TimeoutError:
+                pass
+            backoff_secs = min(backoff_secs*2, self.max_backoff_secs)
+
+    async def _receive(self, websocket: Any) -> None:
+        """Passes each message received to on_message, until the connection
+        closes, stop is called or the stream falls silent
+        """
+        self.last_message_time = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                message = await asyncio.wait_for(websocket.recv(), self.max_silence_secs)
+            except websockets.exceptions.ConnectionClosedOK:
+                return
+            self._received_since_connecting = True
+            self.last_message_time = time.monotonic()
+            try:
+                self.on_message(self, message)
+            except Exception as e:
+                print("Error handling message:", e)
+
+            # Giving other tasks on the loop a turn between messages
+            await asyncio.sleep(0)
+
+    def stop(self) -> None:
+        """Closes the connection and stops reconnecting. Must be called from
+        the event loop's thread.
+        """
+        self._stopped.set()
+        if self._websocket is not None:
+            asyncio.ensure_future(self._websocket.close())
@@ -0,0 +1,147 @@
+import functools
+import json
+import time
+from typing import Any, Union
+
+# The fastest JSON decoder installed is used to parse websocket messages,
+# falling back to the standard library
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        loads = ujson.loads
+    except ImportError:
+        loads = json.loads
+
+MS_PER_MINUTE = 60_000
+
+
+class KlineUpdate():
+    """The fields of a Binance kline event needed on every message. Only the
+    closing price is converted to a float up front, with the remaining fields
+    of the candle left in the raw kline dictionary until they are needed.
+
+    Attributes
+    ----------
+    symbol : str
+        The symbol the kline is for, e.g. "BTCUSDT"
+    event_time_ms : int
+        Time at which the event was sent, in milliseconds since the epoch
+    open_time_ms : int
+        Time at which the candle opened, in milliseconds since the epoch
+    is_closed : bool
+        Whether this is the final update for the candle (the kline's x flag)
+    close : float
+        The latest price, which is the closing price if is_closed is set
+    kline : dict
+        The raw kline, holding the candle's open, high, low and volume
+    """
+    __slots__ = ("symbol", "event_time_ms", "open_time_ms", "is_closed", "close",
+                    "kline")
+
+    def __init__(self, symbol: str, event_time_ms: int, open_time_ms: int,
+                    is_closed: bool, close: float, kline: dict) -> None:
+        self.symbol = symbol
+        self.event_time_ms = event_time_ms
+        self.open_time_ms = open_time_ms
+        self.is_closed = is_closed
+        self.close = close
+        self.kline = kline
+
+    @property
+    def minute(self) -> int:
+        """The minute in which the candle opened, counted from the epoch
+        """
+        return self.open_time_ms // MS_PER_MINUTE
+
+    def ohlcv(self) -> tuple:
+        kline = self.kline
+        return (float(kline['o']), float(kline['h']), float(kline['l']),
+                self.close, float(kline['v']))
+
+
+class TradeUpdate():
+    """The fields of a Binance trade or aggregate trade event
+
+    Attributes
+    ----------
+    symbol : str
+        The symbol traded, e.g. "BTCUSDT"
+    trade_time_ms : int
+        Time of the trade, in milliseconds since the epoch
+    price : float
+        The price traded at
+    quantity : float
+        The quantity traded
+    """
+    __slots__ = ("symbol", "trade_time_ms", "price", "quantity")
+
+    def __init__(self, symbol: str, trade_time_ms: int, price: float,
+                    quantity: float) -> None:
+        self.symbol = symbol
+        self.trade_time_ms = trade_time_ms
+        self.price = price
+        self.quantity = quantity
+
+
+def parse_stream_message(message: Union[str, bytes]
+                            ) -> Union[KlineUpdate, TradeUpdate, None]:
+    """Parses a kline, trade or aggregate trade message from a Binance
+    stream, either combined (with the event wrapped in a "data" field) or raw,
+    returning None for any other message. If a kline has no open time, the
+    candle is taken to have opened at the start of the minute of the event.
+    """
+    message_dict = loads(message)
+    data = message_dict.get('data', message_dict)
+    if 'k' in data:
+        return _kline_update(data)
+    if data.get('e') in ("trade", "aggTrade"):
+        return TradeUpdate(data['s'], int(data['T']), float(data['p']),
+                            float(data['q']))
+    return None
+
+
+def _kline_update(data: dict) -> KlineUpdate:
+    kline = data['k']
+    event_time_ms = int(data['E'])
+    open_time_ms = kline.get('t')
+    if open_time_ms is None:
+        open_time_ms = event_time_ms - event_time_ms % MS_PER_MINUTE
+    return KlineUpdate(data['s'], event_time_ms, int(open_time_ms),
+                        bool(kline.get('x', False)), float(kline['c']), kline)
+
+
+@functools.lru_cache(maxsize=64)
+def format_minute(minute: int) -> str:
+    """Formats a minute counted from the epoch as "%Y-%m-%d %H:%M" in UTC. The
+    result is cached, since every symbol formats the same minutes.
+    """
+    return time.strftime('%Y-%m-%d %H:%M', time.gmtime(minute*60))
+
+
+class RateLimitedPrinter():
+    """Limits console output to at most one line per key (e.g. per symbol)
+    every min_interval_secs, so that printing does not slow down handling of
+    high frequency streams. ready should be checked before formatting the
+    line, so that the cost of formatting is also avoided.
+
+    Attributes
+    ----------
+    min_interval_secs : float
+        Minimum time between lines printed for the same key
+    """
+    def __init__(self, min_interval_secs: float = 1.0) -> None:
+        self.min_interval_secs = min_interval_secs
+        self._last_printed = {}
+
+    def ready(self, key: Any) -> bool:
+        """Returns True, and records the time, if a line can be printed for key
+        """
+        now = time.monotonic()
+        last_printed = self._last_printed.get(key)
+        if last_printed is not None and now - last_printed < self.min_interval_secs:
+            return False
+        self._last_printed[key] = now
+        return True
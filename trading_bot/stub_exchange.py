@@ -0,0 +1,322 @@
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlparse
+
+import numpy as np
+
+# Weight counted against the per-minute request weight limit for each of the
+# REST endpoints served by StubAPIServer, as by Binance
+REQUEST_WEIGHTS = {"ping": 1, "klines": 2}
+
+
+class StubClient():
+    """Local stand-in for binance.client.Client, which fills market orders
+    immediately at the current price set for each symbol and keeps track of
+    balances in memory. It implements the methods used by the bot, so it can
+    be used in place of the real client to run the bot without touching the
+    exchange. An artificial delay can be added to every call to mimic the
+    latency of the REST API.
+
+    Attributes
+    ----------
+    prices : Dict[str, float]
+        Current price of each symbol, e.g. {"BTCUSDT": 20000}
+    balances : Dict[str, float]
+        Free balance of each asset, e.g. {"BTC": 0, "USDT": 1000}
+    commission_rate : float
+        Fraction of each fill charged as commission, in the asset received
+    latency_secs : float
+        Time each call sleeps for before returning
+    klines : Dict[str, np.ndarray]
+        Historical 1 minute candles served by get_klines for each symbol, as
+        arrays of candle_store.CANDLE_DTYPE records
+    orders : list
+        Every order filled so far
+    """
+    def __init__(self, prices: Optional[Dict[str, float]] = None,
+                    balances: Optional[Dict[str, float]] = None,
+                    commission_rate: float = 0.001,
+                    latency_secs: float = 0,
+                    klines: Optional[Dict[str, np.ndarray]] = None) -> None:
+        self.prices = dict(prices or {})
+        self.balances = dict(balances or {})
+        self.commission_rate = commission_rate
+        self.latency_secs = latency_secs
+        self.klines = dict(klines or {})
+        self.orders = []
+        self._lock = threading.Lock()
+        self._next_order_id = 1
+
+    def _wait(self) -> None:
+        if self.latency_secs:
+            time.sleep(self.latency_secs)
+
+    @staticmethod
+    def split_symbol(symbol: str) -> tuple:
+        """Splits a symbol into its base and quote assets, assuming the quote
+        asset is one of the common quote assets listed
+        """
+        for quote_asset in ("USDT", "BUSD", "USDC", "BTC", "ETH", "BNB"):
+            if symbol.endswith(quote_asset) and len(symbol) > len(quote_asset):
+                return symbol[:-len(quote_asset)], quote_asset
+        raise ValueError(f"Cannot split symbol {symbol}")
+
+    def set_price(self, symbol: str, price: float) -> None:
+        with self._lock:
+            self.prices[symbol] = float(price)
+
+    def create_order(self, symbol: str, side: str, type: str, quantity: float,
+                        **kwargs) -> dict:
+        """Fills a market order in full at the current price, raising an
+        exception if the price is unknown or the balance is insufficient
+        """
+        self._wait()
+        if type != "MARKET":
+            raise ValueError(f"Only market orders are supported, not {type}")
+
+        base_asset, quote_asset = self.split_symbol(symbol)
+        quantity = float(quantity)
+        with self._lock:
+            price = self.prices[symbol]
+            if side == "BUY":
+                cost = quantity*price
+                if self.balances.get(quote_asset, 0) < cost:
+                    raise ValueError("Account has insufficient balance for "
+                                        "requested action.")
+                commission = quantity*self.commission_rate
+                self.balances[quote_asset] = self.balances.get(quote_asset, 0) - cost
+                self.balances[base_asset] = (self.balances.get(base_asset, 0)
+                                                + quantity - commission)
+                commission_asset = base_asset
+            else:
+                if self.balances.get(base_asset, 0) < quantity:
+                    raise ValueError("Account has insufficient balance for "
+                                        "requested action.")
+                commission = quantity*price*self.commission_rate
+                self.balances[base_asset] = self.balances.get(base_asset, 0) - quantity
+                self.balances[quote_asset] = (self.balances.get(quote_asset, 0)
+                                                + quantity*price - commission)
+                commission_asset = quote_asset
+
+            order = {
+                "symbol": symbol,
+                "orderId": self._next_order_id,
+                "transactTime": int(time.time()*1000),
+                "executedQty": str(quantity),
+                "status": "FILLED",
+                "type": type,
+                "side": side,
+                "fills": [{
+                    "price": str(price),
+                    "qty": str(quantity),
+                    "commission": str(commission),
+                    "commissionAsset": commission_asset,
+                }],
+            }
+            self._next_order_id += 1
+            self.orders.append(order)
+        return order
+
+    def get_asset_balance(self, asset: str, **kwargs) -> dict:
+        self._wait()
+        with self._lock:
+            return {"asset": asset, "free": str(self.balances.get(asset, 0)),
+                    "locked": "0"}
+
+    def get_account(self, **kwargs) -> dict:
+        self._wait()
+        with self._lock:
+            return {"balances": [{"asset": asset, "free": str(balance), "locked": "0"}
+                                    for asset, balance in self.balances.items()]}
+
+    def get_symbol_ticker(self, symbol: Optional[str] = None, **kwargs):
+        self._wait()
+        with self._lock:
+            if symbol is not None:
+                return {"symbol": symbol, "price": str(self.prices[symbol])}
+            return [{"symbol": symbol, "price": str(price)}
+                    for symbol, price in self.prices.items()]
+
+    def get_klines(self, symbol: str, interval: str = "1m", limit: int = 500,
+                    startTime: Optional[int] = None, endTime: Optional[int] = None,
+                    **kwargs) -> list:
+        """Returns up to limit of the candles held for the symbol, opening
+        between startTime and endTime, in the format returned by Binance. If
+        startTime is not given, the most recent candles are returned.
+        """
+        self._wait()
+        if interval != "1m":
+            raise ValueError(f"Only 1m klines are held, not {interval}")
+        candles = self.klines.get(symbol, np.zeros(0, dtype=[("open_time", "<i8")]))
+        open_times = candles["open_time"]
+        start = 0 if startTime is None else np.searchsorted(open_times, startTime, "left")
+        end = len(candles) if endTime is None else np.searchsorted(open_times, endTime, "right")
+        if startTime is None:
+            start = max(start, end - limit)
+        end = min(end, start + limit)
+        return [[int(candle["open_time"]), str(candle["open"]), str(candle["high"]),
+                    str(candle["low"]), str(candle["close"]), str(candle["volume"]),
+                    int(candle["open_time"]) + 59_999]
+                for candle in candles[start:end]]
+
+    def get_avg_price(self, symbol: str, **kwargs) -> dict:
+        self._wait()
+        with self._lock:
+            return {"mins": 5, "price": str(self.prices[symbol])}
+
+
+class StubAPIServer():
+    """Serves the public market data endpoints of the Binance REST API used to
+    download candles (ping and klines) over HTTP on a local port, from the
+    klines held by a StubClient. A binance.client.Client with its API_URL
+    pointed at url can then be used against it, e.g. to test download.py
+    without touching the exchange.
+
+    Like Binance, the weight of the requests made in each minute is returned
+    in the X-MBX-USED-WEIGHT-1M header and, if max_weight_per_min is given,
+    requests beyond it are answered with 429 and a Retry-After header until
+    the minute is over.
+
+    Attributes
+    ----------
+    stub_client : StubClient
+        The client whose klines are served
+    max_weight_per_min : int, optional
+        The request weight allowed in each minute, or None for no limit
+    num_requests : int
+        The number of requests answered so far
+    num_rejected : int
+        The number of requests rejected for exceeding the weight limit
+    """
+    def __init__(self, stub_client: StubClient, host: str = "127.0.0.1", port: int = 0,
+                    max_weight_per_min: Optional[int] = None) -> None:
+        self.stub_client = stub_client
+        self.max_weight_per_min = max_weight_per_min
+        self.num_requests = 0
+        self.num_rejected = 0
+        self._lock = threading.Lock()
+        self._minute = 0
+        self._used_weight = 0
+        self._thread = None
+
+        api_server = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                api_server._handle(self)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _use_weight(self, weight: int) -> tuple:
+        """Counts the weight of a request against the current minute,
+        returning whether it is allowed and the weight used in the minute
+        """
+        with self._lock:
+            minute = int(time.time()//60)
+            if minute != self._minute:
+                self._minute = minute
+                self._used_weight = 0
+            self._used_weight += weight
+            self.num_requests += 1
+            allowed = (self.max_weight_per_min is None
+                        or self._used_weight <= self.max_weight_per_min)
+            if not allowed:
+                self.num_rejected += 1
+            return allowed, self._used_weight
+
+    def _handle(self, request: BaseHTTPRequestHandler) -> None:
+        parsed = urlparse(request.path)
+        endpoint = parsed.path.rstrip("/").rsplit("/", 1)[-1]
+        params = dict(parse_qsl(parsed.query))
+        if endpoint not in REQUEST_WEIGHTS:
+            self._respond(request, 404, {"code": -1, "msg": f"Unknown endpoint {endpoint}"})
+            return
+
+        allowed, used_weight = self._use_weight(REQUEST_WEIGHTS[endpoint])
+        headers = {"X-MBX-USED-WEIGHT-1M": str(used_weight)}
+        if not allowed:
+            headers["Retry-After"] = str(60 - int(time.time()) % 60)
+            self._respond(request, 429, {"code": -1003, "msg": "Too many requests."},
+                            headers)
+            return
+
+        if endpoint == "ping":
+            self._respond(request, 200, {}, headers)
+            return
+        try:
+            klines = self.stub_client.get_klines(
+                params["symbol"], params.get("interval", "1m"),
+                int(params.get("limit", 500)),
+                int(params["startTime"]) if "startTime" in params else None,
+                int(params["endTime"]) if "endTime" in params else None)
+        except (KeyError, ValueError) as e:
+            self._respond(request, 400, {"code": -1100, "msg": str(e)}, headers)
+            return
+        self._respond(request, 200, klines, headers)
+
+    @staticmethod
+    def _respond(request: BaseHTTPRequestHandler, status: int, body: object,
+                    headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+    def start(self) -> None:
+        """Serves requests from a background thread
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="stub-api", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+if __name__ == "__main__":
+    from candle_store import CandleStore
+
+    parser = argparse.ArgumentParser(description="Serve the klines held in a "
+                                        "candle store over a local stub of the "
+                                        "Binance REST API")
+    parser.add_argument("candle_store")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-weight", type=int, default=None,
+                        help="Request weight allowed per minute before requests "
+                                "are rejected with 429")
+    args = parser.parse_args()
+
+    candle_store = CandleStore(args.candle_store)
+    stub_client = StubClient(klines={symbol: np.array(candle_store.read(symbol))
+                                        for symbol in args.symbols})
+    api_server = StubAPIServer(stub_client, port=args.port,
+                                max_weight_per_min=args.max_weight)
+    print(f"Serving klines for {', '.join(args.symbols)} at {api_server.url}")
+    api_server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    api_server.stop()
@@ -1,80 +1,279 @@
 # Core Python modules
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
 import os
 from pathlib import Path
+import signal
+import time
+from typing import List, Optional
 
 # Binance modules
 from binance.client import Client
 from binance import enums
 
 # Project modules
-from utilities import append_data, CurrentTradingSession
-from strategies import BasicLSTM
+from account_cache import AccountSnapshot
+from aggregation import MultiTimeframeAggregator
+from batching import CandleBatcher
+from candle_store import CandleStore
+from ensemble import StrategyEnsemble
+from execution import OrderExecutor
+from latency import LatencyTracker
+from replay import StreamRecorder
+from session_store import SessionStateStore
+from signal_cache import SignalCache
+from stream_client import StreamClient
+from stub_exchange import StubClient
+from stream_parsing import (format_minute, KlineUpdate, MS_PER_MINUTE,
+                            parse_stream_message, RateLimitedPrinter, TradeUpdate)
+from utilities import ClosedCandle, CSVLogWriter, CurrentTradingSession
+from warm_start import load_recent_candles, warm_start_session
+from strategies import StrategyInterface, BasicLSTM, batch_predict_30_min_prices
 
 # Additional modules
 import numpy as np
 import pandas as pd
-import websocket
 
-# Constants adjustable by user
-ASSET_1 = "BTC" # Ticker for asset bought
-ASSET_2 = "USDT" # Ticker for asset sold
-TRADE_QUANTITY = 0.001
+# Constants adjustable by user. Each pair traded is given as a tuple of the
+# ticker for the asset bought, the ticker for the asset sold and the quantity
+# traded. All pairs are traded from this one process, over a single websocket.
+TRADING_PAIRS = [
+    ("BTC", "USDT", 0.001),
+]
 
 # Regardless of the strategy chosen, a a trailing stop loss is used, with the
 # parameters set below
 STOP_LOSS_THRESHOLD = 0.5/100
 STOP_LOSS_COOL_DOWN_MINS = 5
 
-# Strategy used to decide when to trade
-Strategy = BasicLSTM(
+# Candles closing in the same minute are handled together, so that LSTM
+# predictions for every symbol can be made in one batch. This is the maximum
+# time to wait for the remaining symbols once the first candle has closed.
+CANDLE_BATCH_MAX_WAIT_SECS = 2
+
+# Maximum number of candles for which strategy features (e.g. the RSI or the
+# LSTM's prediction) are cached, across all symbols
+SIGNAL_CACHE_MAX_ENTRIES = 1000
+
+# Balances and prices are cached, and refreshed in the background at this
+# interval, rather than being fetched after every trade
+ACCOUNT_REFRESH_INTERVAL_SECS = 30
+
+# Rows for the trading data and trades log CSVs are buffered, and written at
+# least this often
+LOG_FLUSH_INTERVAL_SECS = 5
+
+# Every closed 1 minute candle is appended to the candle store in this
+# directory, for use in backtests and training
+CANDLE_STORE_DIR = "../Candle store"
+
+# Each session's position and trailing stop loss state is saved to this
+# directory at every candle and fill, and restored on start-up, so that open
+# positions survive a restart
+SESSION_STATE_DIR = "../Session state"
+
+# On start-up, each session is seeded with up to this many recent candles,
+# read from the candle store or fetched from the exchange, so that trading can
+# begin without waiting for the strategy's prices to be collected live
+WARM_START_CANDLES = 1000
+
+# Number of bars held for each interval other than 1 minute used by a strategy
+TIMEFRAME_BARS_HELD = 1000
+
+# The latency of each stage between receiving a message and an order being
+# filled is tracked over this many recent occurrences, and the p50 and p99 of
+# each stage are written to the metrics file below at this interval
+LATENCY_WINDOW_SIZE = 1000
+LATENCY_EXPORT_INTERVAL_SECS = 60
+LATENCY_METRICS_PATH = "../Trading CSVs/latency_metrics.json"
+
+# The stream connection is pinged at this interval, and is reconnected if a
+# pong is not received within the timeout or no message arrives for
+# STREAM_MAX_SILENCE_SECS. Reconnects back off exponentially up to
+# RECONNECT_MAX_BACKOFF_SECS, and any candles missed while disconnected are
+# fetched from the exchange once reconnected.
+STREAM_PING_INTERVAL_SECS = 20
+STREAM_PING_TIMEOUT_SECS = 20
+STREAM_MAX_SILENCE_SECS = 60
+RECONNECT_MAX_BACKOFF_SECS = 60
+
+# Prices received are printed at most this often for each symbol
+PRICE_PRINT_INTERVAL_SECS = 10
+
+# Setting the environment variable TRADING_BOT_STUB_EXCHANGE=1 runs the bot
+# against stub_exchange.StubClient, which fills orders locally starting from
+# these balances, rather than against the exchange (e.g. for benchmarks).
+# No commission is charged, as the stub takes it from the asset received, and
+# the bot sells exactly the quantity it bought, which would leave too little
+# of the base asset for any sell to be filled.
+USE_STUB_EXCHANGE = os.environ.get("TRADING_BOT_STUB_EXCHANGE") == "1"
+STUB_EXCHANGE_BALANCES = {"USDT": 1000}
+STUB_EXCHANGE_COMMISSION_RATE = 0
+
+# Setting the environment variable TRADING_BOT_RECORD_STREAM to a file path
+# records every message received to it, so that the session can be replayed
+# later with replay.py
+STREAM_RECORDING_PATH = os.environ.get("TRADING_BOT_RECORD_STREAM")
+
+# Location of the LSTM model used by BasicLSTM, which may also be a .npz file
+# of weights exported by lstm_numpy.py. This can be overridden with the
+# environment variable TRADING_BOT_MODEL_PATH.
+LSTM_MODEL_PATH = os.environ.get(
+    "TRADING_BOT_MODEL_PATH",
     os.path.join(Path(os.getcwd()).parents[1], "models/LSTM/model_save"),
-    0.1,
-    1,
 )
 
+# Strategy used to decide when to trade. A separate instance is created for
+# each pair traded, although the LSTM model itself is only loaded once. A
+# StrategyEnsemble returned here should be given trade_quantity,
+# STOP_LOSS_THRESHOLD and STOP_LOSS_COOL_DOWN_MINS, so that its strategies are
+# paper traded as the pair is traded live.
+def create_strategy(trade_quantity: float) -> StrategyInterface:
+    return BasicLSTM(
+        LSTM_MODEL_PATH,
+        0.1,
+        1,
+    )
+
 # Other constants
-TRADE_SYMBOL = ASSET_1 + ASSET_2
-BINANCE_SOCKET = f"wss://stream.binance.com:9443/ws/{TRADE_SYMBOL.lower()}@kline_1m"
+TRADE_SYMBOLS = [asset_1 + asset_2 for asset_1, asset_2, _ in TRADING_PAIRS]
 START_DATETIME = str(datetime.now())
 
-# This object holds information about the current trading session, such as
-# whether a long position is being held and what the last buy price was
-cur_trading_sess = CurrentTradingSession()
-
-
-# Loading API key and secret, which are saved in an external file
-with open(
-    os.path.join(Path(os.getcwd()).parents[1], "config/algo_config.json"),
-) as f:
-    config_dict = json.load(f)
-
-client = Client(config_dict['api_key'], config_dict['api_secret'])
+# These objects hold information about the current trading session for each
+# pair, such as whether a long position is being held and what the last buy
+# price was, keyed by symbol
+trading_sessions = {}
+for asset_1, asset_2, trade_quantity in TRADING_PAIRS:
+    strategy = create_strategy(trade_quantity)
+
+    # Bars of any other intervals the strategy uses are built from the same
+    # stream, rather than subscribing to a stream per interval
+    extra_timeframes = [interval for interval in strategy.TIMEFRAMES if interval != "1m"]
+    timeframes = None
+    if extra_timeframes:
+        timeframes = MultiTimeframeAggregator(extra_timeframes, TIMEFRAME_BARS_HELD)
+
+    trading_sessions[asset_1 + asset_2] = CurrentTradingSession(
+        strategy.MAX_MINS_OF_PRICES_HELD_IN_MEMORY,
+        symbol=asset_1 + asset_2,
+        base_asset=asset_1,
+        quote_asset=asset_2,
+        trade_quantity=trade_quantity,
+        strategy=strategy,
+        timeframes=timeframes,
+    )
+
+# Every pair's 1 minute klines, and the trades of any pairs whose strategies
+# use sub-minute bars, are received over one combined stream
+STREAM_NAMES = []
+for symbol, sess in trading_sessions.items():
+    STREAM_NAMES.append(f"{symbol.lower()}@kline_1m")
+    if sess.timeframes is not None and sess.timeframes.needs_trades:
+        STREAM_NAMES.append(f"{symbol.lower()}@aggTrade")
+BINANCE_SOCKET = "wss://stream.binance.com:9443/stream?streams=" + "/".join(STREAM_NAMES)
+
+# Holds the features computed by each session's strategy, keyed by symbol and
+# candle, so that they are only computed once per candle however many times
+# they are read
+signal_cache = SignalCache(SIGNAL_CACHE_MAX_ENTRIES)
+
+# Gathers the closed candles of all symbols for each minute, before passing
+# them to on_candles_closed
+candle_batcher = CandleBatcher(lambda sessions: on_candles_closed(sessions),
+                                TRADE_SYMBOLS, CANDLE_BATCH_MAX_WAIT_SECS)
+
+# Limits how often the prices received are printed to the console
+price_printer = RateLimitedPrinter(PRICE_PRINT_INTERVAL_SECS)
+
+
+if USE_STUB_EXCHANGE:
+    client = StubClient(balances=STUB_EXCHANGE_BALANCES,
+                        commission_rate=STUB_EXCHANGE_COMMISSION_RATE)
+else:
+    # Loading API key and secret, which are saved in an external file
+    with open(
+        os.path.join(Path(os.getcwd()).parents[1], "config/algo_config.json"),
+    ) as f:
+        config_dict = json.load(f)
+
+    client = Client(config_dict['api_key'], config_dict['api_secret'])
+
+# Records the raw messages received, if enabled
+stream_recorder = StreamRecorder(STREAM_RECORDING_PATH) if STREAM_RECORDING_PATH else None
+
+# Times each stage of the tick-to-order path
+latency_tracker = LatencyTracker(LATENCY_WINDOW_SIZE)
+
+# Keeps each symbol's candle store file open, appending candles as they close
+candle_store = CandleStore(CANDLE_STORE_DIR)
+
+# Saves each session's position state, to be restored after a restart
+session_store = SessionStateStore(SESSION_STATE_DIR)
+
+# Keeps the CSV logs open, buffering rows rather than writing each one as it
+# arrives
+log_writer = CSVLogWriter(LOG_FLUSH_INTERVAL_SECS)
+
+# Snapshot of balances and prices read when logging trades
+account_snapshot = AccountSnapshot(client, ACCOUNT_REFRESH_INTERVAL_SECS)
+
+# Orders are sent, and trades logged, from worker threads rather than from the
+# websocket thread
+order_executor = OrderExecutor(client, "../Trading CSVs", START_DATETIME,
+                                account_snapshot=account_snapshot,
+                                log_writer=log_writer,
+                                latency_tracker=latency_tracker)
 
 
 # Functions determining what happens when the web socket is openened and closed,
-# and when a message is recieved
+# and when a message is recieved. Each time the connection opens, the sessions
+# are brought up to date with any candles closed since they were last updated,
+# so that after a reconnect the candles missed are backfilled.
 def on_open(ws):
     print("Opened connection")
+    warm_start_sessions()
 
 def on_close(ws):
     print("Closed connection")
 
+def warm_start_sessions() -> None:
+    """Seeds every trading session with recent closed candles. This is called
+    once the websocket has opened, so that any candle closing after the
+    candles are loaded is received from the stream, and the session carries
+    on from the stream without a gap.
+    """
+    for symbol, sess in trading_sessions.items():
+        try:
+            candles = load_recent_candles(symbol, WARM_START_CANDLES, client,
+                                            candle_store)
+            num_used = warm_start_session(sess, candles)
+            print(f"Warm started {symbol} with {num_used} candles")
+        except Exception as e:
+            print(f"Error warm starting {symbol}:", e)
+
 def on_message(ws, message):
+    received_at = time.perf_counter()
+    if stream_recorder is not None:
+        stream_recorder.record(message)
     try:
         on_message_helper(message)
 
     except Exception as e:
         print(e)
+    latency_tracker.record_since("handle_message", received_at)
 
 
 def on_message_helper(message: str) -> None:
-    """Loads the message from the Binance websocket into a dictionary, and
-    extracts the price and time returned. This is outputted to the console,
-    and saved into a dictionary mapping datetime values (accurate to the
-    nearest minute) to price values. If a new minute has begun, on_candle_close
-    is called.
+    """Parses the message from the Binance combined stream, finds the trading
+    session for the symbol it refers to, and updates the session with the
+    latest price. Trade messages are instead passed to on_trade. Candles are
+    tracked by the minute in which they opened, using integer arithmetic on
+    the kline's open time. A candle is closed as soon as its final message
+    arrives (with the kline's x flag set) or, if that message was missed,
+    once the first message of a later candle arrives, in which case the last
+    price seen is used as its close.
 
     Parameters
     ----------
@@ -85,56 +284,241 @@ def on_message_helper(message: str) -> None:
     -------
     None
     """
-    message_dict = json.loads(message)
-
-    # Pull out the timestamp, and round it down to the nearest minute
-    unix_ts = int(message_dict['E'])/1000
-    cur_ts = datetime.utcfromtimestamp(unix_ts).strftime('%Y-%m-%d %H:%M:%S')
-    cur_ts = cur_ts[:-3]
-    
-    # The first condition checks whether the previous minute candle has closed.
-    # The second condition ensures that this first condition will not be
-    # triggered by accident, when we first begin trading and there will not be
-    # a valid previous timestamp.
-    if (cur_ts != cur_trading_sess.prev_ts) and (cur_trading_sess.prev_price != -1):
-        cur_trading_sess.prev_ts = cur_ts
-
-        # Updates the list of closing prices, only keeping the most recent data
-        # as required by the strategy chosen
-        prev_candle_close = cur_trading_sess.prev_price
-        cur_trading_sess.closes_list.append(prev_candle_close)
-        cur_trading_sess.closes_list = cur_trading_sess.closes_list[-Strategy.MAX_MINS_OF_PRICES_HELD_IN_MEMORY:]
-
-        closes_arr = np.array(cur_trading_sess.closes_list)
-        on_candle_close(closes_arr)
-
-    # Displays ticker information and new closing price
-    ticker = message_dict['s']
-    close_price = float(message_dict['k']['c'])
-    print(f"{ticker} price at {cur_ts}: {close_price}")
-
-    # Updates the previous price attribute
+    parse_started_at = time.perf_counter()
+    stream_update = parse_stream_message(message)
+    latency_tracker.record_since("parse", parse_started_at)
+    if stream_update is None:
+        return
+    cur_trading_sess = trading_sessions.get(stream_update.symbol)
+    if cur_trading_sess is None:
+        return
+    if isinstance(stream_update, TradeUpdate):
+        on_trade(cur_trading_sess, stream_update)
+        return
+    kline_update = stream_update
+
+    # Time between the exchange sending the message and it being received,
+    # which includes any difference between the exchange's clock and ours
+    latency_tracker.record("exchange_to_receive",
+                            time.time() - kline_update.event_time_ms/1000)
+
+    # Messages for candles that have already been closed are ignored
+    candle_minute = kline_update.minute
+    if candle_minute < cur_trading_sess.cur_candle_minute:
+        return
+    if candle_minute > cur_trading_sess.cur_candle_minute:
+        # The condition on the previous price ensures that a candle is not
+        # closed by accident when we first begin trading, and there is not a
+        # valid previous candle
+        if (not cur_trading_sess.cur_candle_closed) and (cur_trading_sess.prev_price != -1):
+            close_candle(cur_trading_sess, cur_trading_sess.cur_candle_minute,
+                            cur_trading_sess.prev_price, cur_trading_sess.prev_kline)
+        cur_trading_sess.cur_candle_minute = candle_minute
+        cur_trading_sess.cur_candle_closed = False
+    elif cur_trading_sess.cur_candle_closed:
+        return
+
+    # Updates the previous price attribute, and keeps the kline so that the
+    # full candle can be read if the candle has to be closed later
+    close_price = kline_update.close
     cur_trading_sess.prev_price = close_price
-    
+    cur_trading_sess.prev_kline = kline_update
+
+    if kline_update.is_closed:
+        close_candle(cur_trading_sess, candle_minute, close_price, kline_update)
+
+    # Displays ticker information and new closing price, at most once per
+    # PRICE_PRINT_INTERVAL_SECS
+    if price_printer.ready(kline_update.symbol):
+        event_ts = datetime.utcfromtimestamp(kline_update.event_time_ms/1000)
+        print(f"{kline_update.symbol} price at {event_ts:%Y-%m-%d %H:%M:%S}: {close_price}")
+
+
+def close_candle(cur_trading_sess: CurrentTradingSession, candle_minute: int,
+                    close_price: float, kline_update: KlineUpdate) -> None:
+    """Saves the closing price of the candle which opened in candle_minute
+    into the session's buffer of closing prices, and passes the candle to the
+    candle batcher, which calls on_candles_closed. The candle is labelled with
+    the minute at which it closed, and is then appended to the candle store.
+
+    Parameters
+    ----------
+    cur_trading_sess : CurrentTradingSession
+        The trading session for the symbol whose candle closed
+    candle_minute : int
+        The minute, counted from the epoch, in which the candle opened
+    close_price : float
+        The candle's closing price
+    kline_update : KlineUpdate
+        The last kline received for the candle
+
+    Returns
+    -------
+    None
+    """
+    cur_trading_sess.cur_candle_closed = True
+    cur_trading_sess.last_closed_minute = candle_minute
+    closed_at = time.perf_counter()
+    cur_ts = format_minute(candle_minute + 1)
+    cur_trading_sess.prev_ts = cur_ts
+
+    # Updates the buffer of closing prices, only keeping the most recent data
+    # as required by the strategy chosen
+    ohlcv = kline_update.ohlcv()
+    cur_trading_sess.closes.append(close_price)
+    if cur_trading_sess.timeframes is not None:
+        completed = cur_trading_sess.timeframes.add_kline(candle_minute*MS_PER_MINUTE,
+                                                            ohlcv)
+        on_bars_completed(cur_trading_sess, completed)
+    # Strategies with incrementally updated indicators return their features
+    # here, for use once the candle is processed
+    features = cur_trading_sess.strategy.update(close_price)
+
+    # The stub exchange fills orders at the latest closing price
+    if USE_STUB_EXCHANGE:
+        client.set_price(cur_trading_sess.symbol, close_price)
+
+    # The candle is processed on the candle worker thread, while later candles
+    # (or a backfill after a reconnect) may change the session, so it is given
+    # a copy of the prices and everything else it needs from this moment
+    candle = ClosedCandle(cur_trading_sess, cur_ts, candle_minute,
+                            cur_trading_sess.closes.view().copy(), closed_at, features)
+    candle_batcher.submit(cur_ts, cur_trading_sess.symbol, candle)
+
+    try:
+        candle_store.append_candle(cur_trading_sess.symbol,
+                                    candle_minute*MS_PER_MINUTE, ohlcv)
+    except Exception as e:
+        print("Error appending candle to store:", e)
 
 
-def on_candle_close(closes_arr: np.ndarray) -> None:
+def on_trade(cur_trading_sess: CurrentTradingSession,
+                trade_update: TradeUpdate) -> None:
+    """Adds a trade to the sub-minute bars built for the session, passing any
+    bars completed by it to the strategy.
+
+    Parameters
+    ----------
+    cur_trading_sess : CurrentTradingSession
+        The trading session for the symbol traded
+    trade_update : TradeUpdate
+        The trade received
+
+    Returns
+    -------
+    None
+    """
+    if cur_trading_sess.timeframes is None:
+        return
+    completed = cur_trading_sess.timeframes.add_trade(trade_update.trade_time_ms,
+                                                        trade_update.price,
+                                                        trade_update.quantity)
+    on_bars_completed(cur_trading_sess, completed)
+
+
+def on_bars_completed(cur_trading_sess: CurrentTradingSession,
+                        intervals: List[str]) -> None:
+    """Passes the closing prices of each interval for which a bar has just
+    completed to the session's strategy
+    """
+    for interval in intervals:
+        cur_trading_sess.strategy.on_bar(
+            interval, cur_trading_sess.timeframes[interval].closes.view())
+
+
+def on_candles_closed(candles: List[ClosedCandle]) -> None:
+    """Makes the LSTM predictions needed by any of the candles which have
+    closed in a single batch, including those of the LSTMs in
+    StrategyEnsembles, storing them (or the ensembles' features) in the signal
+    cache, and then calls on_candle_close for each candle.
+
+    Parameters
+    ----------
+    candles : List[ClosedCandle]
+        The candles closed, one for each symbol
+
+    Returns
+    -------
+    None
+    """
+    for candle in candles:
+        latency_tracker.record_since("candle_batch_wait", candle.closed_at)
+
+    # Each LSTM needing a prediction is held with its candle and the group it
+    # belongs to in the candle's StrategyEnsemble, or None if it is the
+    # session's strategy. Those which do not need one are given None, so that
+    # one is not made when their features are read from the cache.
+    to_predict = []
+    ensemble_predictions = {}
+    for candle in candles:
+        strategy = candle.session.strategy
+        in_long_position = candle.session.in_long_position
+        if isinstance(strategy, BasicLSTM):
+            if strategy.needs_prediction(candle.closes, in_long_position):
+                to_predict.append((candle, None, strategy))
+            else:
+                signal_cache.put(candle.session.symbol, candle.ts, None)
+        elif isinstance(strategy, StrategyEnsemble):
+            groups = strategy.lstm_groups(candle.closes, in_long_position)
+            if groups:
+                ensemble_predictions[candle] = {}
+            for group, leader in groups.items():
+                if leader is None:
+                    ensemble_predictions[candle][group] = None
+                else:
+                    to_predict.append((candle, group, leader))
+
+    if to_predict:
+        with latency_tracker.time("inference"):
+            predictions = batch_predict_30_min_prices(
+                [strategy for _, _, strategy in to_predict],
+                [candle.closes for candle, _, _ in to_predict],
+            )
+    else:
+        predictions = []
+    for (candle, group, _), prediction in zip(to_predict, predictions):
+        if group is None:
+            signal_cache.put(candle.session.symbol, candle.ts, prediction)
+        else:
+            ensemble_predictions[candle][group] = prediction
+
+    # The rest of each ensemble's features are then computed around its
+    # predictions
+    for candle, group_predictions in ensemble_predictions.items():
+        updated = dict(candle.features or {})
+        updated.update(group_predictions)
+        signal_cache.put(candle.session.symbol, candle.ts,
+                            candle.session.strategy.calc_after_update(candle.closes, updated))
+
+    for candle in candles:
+        try:
+            on_candle_close(candle)
+        except Exception as e:
+            print(e)
+
+
+def on_candle_close(candle: ClosedCandle) -> None:
     """Outputs the closing prices array to the console (for debugging
     purposes), and appends the most recent closing price to a trading data CSV.
     If sufficient data has been collected then a there is the possiblity of
-    making a trade, in which case consider_trade will be called.
+    making a trade, in which case consider_trade will be called. If an order
+    is submitted, the candle's row is instead written by on_order_complete,
+    once it is known whether the trade was made. If the session's strategy is
+    a StrategyEnsemble, its strategies are then paper traded.
 
     Parameters
     ----------
-    closes_arr : np.ndarray
-        Numpy array of closing prices
+    candle : ClosedCandle
+        The candle which closed
 
     Returns
     -------
     None
     """
+    cur_trading_sess = candle.session
+    closes_arr = candle.closes
 
-    print("\nClosing prices:", closes_arr, "\n")
+    print(f"\n{cur_trading_sess.symbol} closing prices:", closes_arr, "\n")
 
     if len(closes_arr) >= 2:
 
@@ -143,53 +527,113 @@ def on_candle_close(closes_arr: np.ndarray) -> None:
             cur_trading_sess.max_price_since_buy = max(cur_trading_sess.max_price_since_buy,
                                                         closes_arr[-1])
 
-        trade_executed = consider_trade(closes_arr)
+        order_submitted_type = consider_trade(candle)
+        save_session_state(cur_trading_sess)
+        if isinstance(cur_trading_sess.strategy, StrategyEnsemble):
+            paper_trade(candle)
+
+        if order_submitted_type is None:
+            log_candle(cur_trading_sess, candle.ts, closes_arr[-1], None)
+
 
-        col_names = ["datetime_collected", "datetime", "price", "trade_made"]
-        row = [START_DATETIME,
-               cur_trading_sess.prev_ts,
-               cur_trading_sess.prev_price,
-               trade_executed
-              ]
+def log_candle(cur_trading_sess: CurrentTradingSession, candle_ts: str,
+                price: float, trade_made: Optional[str]) -> None:
+    """Appends a candle's closing price, and the trade made at it ("buy",
+    "sell" or None), to the session's trading data CSV
+    """
+    col_names = ["datetime_collected", "datetime", "price", "trade_made"]
+    row = [START_DATETIME,
+           candle_ts,
+           price,
+           trade_made
+          ]
 
-        append_data(f"../Trading CSVs/{TRADE_SYMBOL}_data.csv", col_names, row)
+    with latency_tracker.time("data_log"):
+        log_writer.append(f"../Trading CSVs/{cur_trading_sess.symbol}_data.csv",
+                            col_names, row)
 
 
-def consider_trade(closes_arr: np.ndarray) -> str:
-    """Uses the trading strategy encapsulated in the Strategy object to
-    determine whether to make a trade, either buying or selling, possibly
-    due to the stop loss threshold being reached.
+def paper_trade(candle: ClosedCandle) -> None:
+    """Paper trades every strategy in the session's StrategyEnsemble, using
+    the features already computed for the candle, and appends the trade made
+    by each, and its position and profit or loss, to a shadow trading CSV.
 
     Parameters
     ----------
-    closes_arr : np.ndarray
-        Numpy array of closing prices
+    candle : ClosedCandle
+        The candle which closed
 
     Returns
     -------
-    order_executed_type : str
-        The type of order that was executed, if any. This takes values "buy",
-        "sell" or None.
+    None
     """
-    should_sell = Strategy.should_sell(closes_arr,
-                                        cur_trading_sess.in_long_position)
-    should_buy = Strategy.should_buy(closes_arr,
-                                        cur_trading_sess.in_long_position)
+    cur_trading_sess = candle.session
+    closes_arr = candle.closes
+    strategy = cur_trading_sess.strategy
+    with latency_tracker.time("paper_trade"):
+        features = signal_cache.get_or_compute(
+            cur_trading_sess.symbol, candle.ts,
+            lambda: strategy.calc_after_update(closes_arr, candle.features))
+        trades = strategy.paper_trade(features, closes_arr)
+
+    col_names = ["datetime_collected", "datetime", "strategy", "mode", "price",
+                    "trade_made", "in_long_position", "realised_pnl"]
+    for name, trade in trades.items():
+        position = strategy.positions[name]
+        row = [START_DATETIME, candle.ts, name, strategy.modes[name],
+                closes_arr[-1], trade, position.in_long_position, position.realised_pnl]
+        log_writer.append(f"../Trading CSVs/{cur_trading_sess.symbol}_shadow.csv",
+                            col_names, row)
+
+
+def consider_trade(candle: ClosedCandle) -> str:
+    """Uses the trading strategy held by the trading session to determine
+    whether to make a trade, either buying or selling, possibly due to the
+    stop loss threshold being reached. The strategy's features for the candle
+    are read from the signal cache, and only computed if not already held.
+
+    Parameters
+    ----------
+    candle : ClosedCandle
+        The candle which closed, for the symbol being considered
+
+    Returns
+    -------
+    order_submitted_type : str
+        The type of order that was submitted, if any. This takes values "buy",
+        "sell" or None. Whether it was filled is only known once
+        on_order_complete is called.
+    """
+    cur_trading_sess = candle.session
+    closes_arr = candle.closes
+
+    # The position is only updated once an order completes, so no further
+    # trades are considered while one is in flight
+    if cur_trading_sess.pending_order_side is not None:
+        print(f"{cur_trading_sess.symbol} {cur_trading_sess.pending_order_side} "
+              "order still in flight, not considering trade")
+        return None
+
+    strategy = cur_trading_sess.strategy
+    with latency_tracker.time("strategy"):
+        features = signal_cache.get_or_compute(
+            cur_trading_sess.symbol, candle.ts,
+            lambda: strategy.calc_after_update(closes_arr, candle.features))
+        should_sell, should_buy = strategy.should_sell_and_buy(
+            features, closes_arr, cur_trading_sess.in_long_position)
 
     # Checking if the price has gone below (or is at) the stop loss threshold.
     # Again, this is a trailing stop loss, so we compare with the maximum price
     # achieved since buying
-    should_trigger_stop_loss = (closes_arr[-1] <= (1 - STOP_LOSS_THRESHOLD)*cur_trading_sess.max_price_since_buy)
+    should_trigger_stop_loss = bool(closes_arr[-1] <= (1 - STOP_LOSS_THRESHOLD)*cur_trading_sess.max_price_since_buy)
 
-    order_executed_type = None
+    order_submitted_type = None
 
     # For debugging purposes
     cur_price, prev_price = closes_arr[-1], closes_arr[-2]
-    # Can be modified if using an RSI-based strategy
-    prev_rsi = 0
-    print("Considering trade: cur_price:", cur_price,
+    print(f"Considering {cur_trading_sess.symbol} trade: cur_price:", cur_price,
             ", prev_price:", prev_price,
-            ", prev_rsi:", prev_rsi,
+            ", features:", features,
             ", should_sell:", should_sell,
             ", should_buy:", should_buy,
             ", should_trigger_stop_loss:", should_trigger_stop_loss,
@@ -199,144 +643,184 @@ def consider_trade(closes_arr: np.ndarray) -> str:
     # Deciding whether to sell
     if should_sell or (should_trigger_stop_loss and cur_trading_sess.in_long_position):
         print("Attempting to sell" + should_trigger_stop_loss*" (stop loss executed)")
-        order_succeeded = order(TRADE_SYMBOL, enums.SIDE_SELL,
-                                enums.ORDER_TYPE_MARKET, TRADE_QUANTITY,
-                                closes_arr)
-        
-        # Resetting for next time a buy order is executed
-        cur_trading_sess.max_price_since_buy = 0
-
-        if should_trigger_stop_loss:
-            cur_trading_sess.last_position_stop_triggered = cur_trading_sess.cur_closes_dict_len
-
-        if order_succeeded:
-            cur_trading_sess.in_long_position = False
-            order_executed_type = "sell"
+        order(candle, enums.SIDE_SELL, enums.ORDER_TYPE_MARKET,
+                cur_trading_sess.trade_quantity, should_trigger_stop_loss)
+        order_submitted_type = "sell"
 
     # Otherwise, deciding whether to buy
     elif should_buy\
-        and (cur_trading_sess.cur_closes_dict_len >=
+        and (candle.minute >=
                 cur_trading_sess.last_position_stop_triggered + STOP_LOSS_COOL_DOWN_MINS):
         
         print("Attempting to buy...")
-        order_succeeded = order(TRADE_SYMBOL, enums.SIDE_BUY,
-                                enums.ORDER_TYPE_MARKET, TRADE_QUANTITY,
-                                closes_arr)
-        
-        if order_succeeded:
-            cur_trading_sess.max_price_since_buy = closes_arr[-1]
-            cur_trading_sess.in_long_position = True
-            order_executed_type = "buy"
+        order(candle, enums.SIDE_BUY, enums.ORDER_TYPE_MARKET,
+                cur_trading_sess.trade_quantity)
+        order_submitted_type = "buy"
     
-    return order_executed_type
+    return order_submitted_type
 
 
-def order(symbol: str, side: str, order_type: str,
-            quantity: float, closes_arr: np.ndarray) -> bool:
-    """Attempts to send the order specified to Binance. If this was successful,
-    details of the trade are saved to the trades log CSV, as well as account
-    balances and other useful information.
+def order(candle: ClosedCandle, side: str, order_type: str, quantity: float,
+            stop_loss_triggered: bool = False) -> None:
+    """Submits the order specified to the order executor, which sends it to
+    Binance from a worker thread and returns immediately. Once the order has
+    completed, on_order_complete updates the trading session, and details of
+    the trade are saved to the trades log CSV, as well as account balances and
+    other useful information.
 
     Parameters
     ----------
-    symbol : str
-        The symbol (ticker) for the asset to be traded
+    candle : ClosedCandle
+        The candle at whose close the order is placed, for the symbol (ticker)
+        to be traded
     side : str
         The side to be traded (representing buying or selling)
     order type : str
         The type of order to be made, e.g. market order
     quantity : float
         The quantity of the aforementioned symbol to be traded
-    closes_arr : np.ndarray
-        Numpy array of closing prices
+    stop_loss_triggered : bool, optional
+        Whether a sell order was made because the stop loss was reached
 
     Returns
     -------
-    order_was_successful : bool
-        Boolean set to true if the order was completed successfully, otherwise
-        false.
+    None
     """
-    order_was_successful = False
-    
-    # Using a number of try-except statements, as there are a number of issues
-    # that can occur when trying to execute an order, which are otherwise
-    # handled by the websocket without displaying any feedback.
-    try:
-        print("Sending order")
-        order = client.create_order(symbol=symbol,
-                                    side=side,
-                                    type=order_type,
-                                    quantity=quantity)
-        print("Order successful:", order, "\n\n")
+    cur_trading_sess = candle.session
+    expected_price = candle.closes[-1]
+    latency_tracker.record_since("candle_to_order", candle.closed_at)
+    cur_trading_sess.pending_order_side = side
+    order_executor.submit_order(
+        cur_trading_sess.symbol,
+        cur_trading_sess.base_asset,
+        cur_trading_sess.quote_asset,
+        side,
+        order_type,
+        quantity,
+        expected_price,
+        lambda order_succeeded: on_order_complete(cur_trading_sess, side,
+                                                    expected_price, order_succeeded,
+                                                    candle, stop_loss_triggered),
+    )
+
+
+def on_order_complete(cur_trading_sess: CurrentTradingSession, side: str,
+                        expected_price: float, order_succeeded: bool,
+                        candle: Optional[ClosedCandle] = None,
+                        stop_loss_triggered: bool = False) -> None:
+    """Called from the order executor's worker thread once an order has
+    completed, updating the position held and the trailing stop loss if the
+    order succeeded, and appending the row for the candle at which it was
+    placed to the trading data CSV, with the trade made only if it succeeded.
 
-        order_was_successful = True
+    Parameters
+    ----------
+    cur_trading_sess : CurrentTradingSession
+        The trading session for the symbol traded
+    side : str
+        The side traded (representing buying or selling)
+    expected_price : float
+        The closing price at the time the order was placed
+    order_succeeded : bool
+        Whether the order was completed successfully
+    candle : ClosedCandle, optional
+        The candle at whose close the order was placed, from which the stop
+        loss cool-down is counted. No row is written to the trading data CSV
+        if not given.
+    stop_loss_triggered : bool, optional
+        Whether a sell order was made because the stop loss was reached
 
-        # Fetching executed price and quantity, for logs
-        try:
-            actual_price = order['fills'][0]['price']
-            actual_quantity = order['fills'][0]['qty']
-            commission = order['fills'][0]['commission']
-        except Exception as e:
-            actual_price = ""
-            actual_quantity = ""
-            commission = ""
-            print("Error getting order details:", e)
+    Returns
+    -------
+    None
+    """
+    if order_succeeded:
+        if candle is not None:
+            latency_tracker.record_since("candle_to_fill", candle.closed_at)
+        if side == enums.SIDE_BUY:
+            cur_trading_sess.max_price_since_buy = expected_price
+            cur_trading_sess.in_long_position = True
+        else:
+            cur_trading_sess.in_long_position = False
 
-        # Fetching balances of both assets traded, for logs
-        try:
-            balance_1 = float(client.get_asset_balance(asset=ASSET_1)['free'])
-            usd_price_1 = float(client.get_avg_price(symbol=f'{ASSET_1}USDT')['price'])
-            balance_2 = float(client.get_asset_balance(asset=ASSET_2)['free'])
-            if ASSET_1 == "USDT":
-                usd_price_2 = 1
-            else:
-                usd_price_2 = float(client.get_avg_price(symbol=f'{ASSET_1}USDT')['price'])
-            balance_usd = balance_1*usd_price_1 + balance_2*usd_price_2
-        except Exception as e:
-            balance_1 = ""
-            balance_2 = ""
-            balance_usd = ""
-            print("Error getting balances:", e)
-
-        col_names = ["collection_started_datetime",
-                        "order_placed_datetime",
-                        "ticker",
-                        "side", 
-                        "order_type",
-                        "quantity_attempted",
-                        "expected_price",
-                        "actual_price",
-                        "actual_quantity",
-                        "commission",
-                        f"{ASSET_1}_balance",
-                        f"{ASSET_2}_balance",
-                        "total_balance_usd"
-                        ]
-        row = [START_DATETIME,
-                datetime.now(),
-                symbol,
-                side,
-                order_type,
-                quantity,
-                closes_arr[-1],
-                actual_price,
-                actual_quantity,
-                commission,
-                balance_1,
-                balance_2,
-                balance_usd
-            ]
-        append_data(f"../Trading CSVs/{TRADE_SYMBOL}_trades_log.csv", col_names, row)
-    
+            # Resetting for next time a buy order is executed
+            cur_trading_sess.max_price_since_buy = 0
+            if stop_loss_triggered and candle is not None:
+                cur_trading_sess.last_position_stop_triggered = candle.minute
+        save_session_state(cur_trading_sess)
+    cur_trading_sess.pending_order_side = None
+
+    if candle is not None:
+        trade_made = ("buy" if side == enums.SIDE_BUY else "sell") if order_succeeded else None
+        log_candle(cur_trading_sess, candle.ts, expected_price, trade_made)
+
+
+def save_session_state(cur_trading_sess: CurrentTradingSession) -> None:
+    """Saves the session's position state to the session store, printing any
+    error rather than raising it
+    """
+    try:
+        session_store.save(cur_trading_sess)
+    except Exception as e:
+        print(f"Error saving {cur_trading_sess.symbol} state:", e)
+
+
+def process_candle_batch(candles: List[ClosedCandle]) -> None:
+    """Calls on_candles_closed, printing any error rather than raising it, for
+    use on the candle worker thread
+    """
+    try:
+        on_candles_closed(candles)
     except Exception as e:
-        print("Order failed:", e, "\n")
+        print("Error processing candle batch:", e)
 
-    return order_was_successful
+
+async def run_bot() -> None:
+    """Receives the combined stream on an asyncio event loop, reconnecting
+    whenever the connection drops, until interrupted. Messages are handled on
+    the loop as they arrive, while each minute's candle batch (the strategy,
+    LSTM inference and orders) is processed in order on a worker thread, so
+    that messages for every symbol keep being received meanwhile.
+
+    Returns
+    -------
+    None
+    """
+    candle_executor = ThreadPoolExecutor(1, thread_name_prefix="candles")
+    candle_batcher.process_batch = (lambda candles:
+                                    candle_executor.submit(process_candle_batch, candles))
+
+    stream_client = StreamClient(BINANCE_SOCKET, on_message, on_open, on_close,
+                                    ping_interval_secs=STREAM_PING_INTERVAL_SECS,
+                                    ping_timeout_secs=STREAM_PING_TIMEOUT_SECS,
+                                    max_silence_secs=STREAM_MAX_SILENCE_SECS,
+                                    max_backoff_secs=RECONNECT_MAX_BACKOFF_SECS)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stream_client.stop)
+        except NotImplementedError:
+            # Signal handlers cannot be added to the event loop on Windows, where
+            # Ctrl+C instead interrupts asyncio.run
+            pass
+    try:
+        await stream_client.run()
+    finally:
+        candle_executor.shutdown(wait=True)
 
 
 if __name__ == "__main__":
-    binance_ws = websocket.WebSocketApp(BINANCE_SOCKET,
-                                        on_open=on_open,
-                                        on_close=on_close,
-                                        on_message=on_message)
-    binance_ws.run_forever()
\ No newline at end of file
+    session_store.restore_all(trading_sessions)
+    account_snapshot.start()
+    latency_tracker.start_exporting(LATENCY_METRICS_PATH, LATENCY_EXPORT_INTERVAL_SECS)
+    try:
+        asyncio.run(run_bot())
+    except KeyboardInterrupt:
+        pass
+    order_executor.shutdown()
+    account_snapshot.stop()
+    log_writer.close()
+    candle_store.close()
+    if stream_recorder is not None:
+        stream_recorder.close()
+    latency_tracker.stop_exporting(LATENCY_METRICS_PATH)
\ No newline at end of file
@@ -1,9 +1,27 @@
+import atexit
+import csv
+import io
 from pathlib import Path
-from typing import List, Any, Tuple
+import threading
+import time
+from typing import List, Any, Tuple, Optional, TextIO
+
+import numpy as np
+
+def format_csv_rows(rows: List[List[Any]]) -> str:
+    """Formats rows as CSV text, quoting fields where required. Each row is
+    preceded by a newline, matching the layout of the CSVs written by
+    append_data, where the file does not end in a newline.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(
+        [[str(x) for x in row] for row in rows])
+    return "\n" + buffer.getvalue()[:-1]
 
 def append_data(csv_path: str, col_names: List[Any], row: List[Any]) -> None:
     """Function used to add data to a CSV. Either appends to a CSV if the file
-    already exists, or creates a new CSV if not.
+    already exists, or creates a new CSV if not. This opens and closes the
+    file on every call, so CSVLogWriter should be used for frequent writes.
 
     Parameters
     ----------
@@ -18,28 +36,296 @@ def append_data(csv_path: str, col_names: List[Any], row: List[Any]) -> None:
     -------
     None
     """
-    col_names = [str(x) for x in col_names]
-    col_names_str = ",".join(col_names)
-    row = [str(x) for x in row]
-    row_str = ",".join(row)
-    
     path_obj = Path(csv_path)
-    if not path_obj.is_file():
-        with open(csv_path, 'w+') as csv_file:
-            csv_file.write(col_names_str)
-
     with open(csv_path, 'a') as csv_file:
-        csv_file.write("\n" + row_str)
+        if not path_obj.stat().st_size:
+            csv_file.write(format_csv_rows([col_names])[1:])
+        csv_file.write(format_csv_rows([row]))
+
+class CSVLogWriter():
+    """Writes rows to CSV logs, keeping each file open and buffering rows in
+    memory, so that writing a row does not touch the file system. Buffered
+    rows are written when max_buffered_rows is reached, when a row is
+    appended flush_interval_secs or more after the last write, by a
+    background thread if no rows arrive for that long, and when the writer is
+    closed (including at interpreter exit). The files written are laid out as
+    by append_data, so the two can be used on the same file.
+
+    Attributes
+    ----------
+    flush_interval_secs : float
+        Maximum time a row is held in memory before being written
+    max_buffered_rows : int
+        Maximum number of rows held in memory for each file
+    """
+    def __init__(self, flush_interval_secs: float = 5.0,
+                    max_buffered_rows: int = 100) -> None:
+        self.flush_interval_secs = flush_interval_secs
+        self.max_buffered_rows = max_buffered_rows
+        self._files = {}
+        self._buffers = {}
+        self._last_flush_time = time.monotonic()
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._flush_thread = threading.Thread(target=self._flush_loop,
+                                                name="csv-log-writer", daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.close)
+
+    def _open(self, csv_path: str, col_names: List[Any]) -> TextIO:
+        """Opens the file for appending, writing the header if it is new.
+        Must be called with the lock held.
+        """
+        csv_file = open(csv_path, 'a')
+        if csv_file.tell() == 0:
+            csv_file.write(format_csv_rows([col_names])[1:])
+        self._files[csv_path] = csv_file
+        self._buffers[csv_path] = []
+        return csv_file
+
+    def append(self, csv_path: str, col_names: List[Any], row: List[Any]) -> None:
+        """Buffers a row to be written to csv_path, which is created with the
+        header col_names if it does not exist
+        """
+        with self._lock:
+            if self._closed.is_set():
+                raise ValueError("Cannot append to a closed CSVLogWriter")
+            if csv_path not in self._files:
+                self._open(csv_path, col_names)
+            buffer = self._buffers[csv_path]
+            buffer.append(row)
+            if len(buffer) >= self.max_buffered_rows:
+                self._write(csv_path)
+            elif time.monotonic() - self._last_flush_time >= self.flush_interval_secs:
+                self.flush()
+
+    def _write(self, csv_path: str) -> None:
+        buffer = self._buffers[csv_path]
+        if buffer:
+            csv_file = self._files[csv_path]
+            csv_file.write(format_csv_rows(buffer))
+            csv_file.flush()
+            buffer.clear()
+
+    def flush(self) -> None:
+        """Writes all buffered rows to their files
+        """
+        with self._lock:
+            for csv_path in self._files:
+                self._write(csv_path)
+            self._last_flush_time = time.monotonic()
+
+    def _flush_loop(self) -> None:
+        while not self._closed.wait(self.flush_interval_secs):
+            try:
+                self.flush()
+            except Exception as e:
+                print("Error flushing CSV logs:", e)
+
+    def close(self) -> None:
+        """Writes any buffered rows and closes the files
+        """
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self.flush()
+            self._closed.set()
+            for csv_file in self._files.values():
+                csv_file.close()
+            self._files = {}
+            self._buffers = {}
+
+class RingBuffer():
+    """Preallocated buffer holding the most recent values appended to it, up to
+    a fixed capacity. Each value is written to two positions in an array of
+    twice the capacity, so that the held values are always contiguous and can
+    be returned as a view, without copying or allocating.
+
+    Attributes
+    ----------
+    capacity : int
+        The maximum number of values held
+    width : int, optional
+        If given, each value is a row of this many fields (e.g. 5 for OHLCV),
+        otherwise each value is a single number
+    """
+    def __init__(self, capacity: int, width: Optional[int] = None,
+                    dtype: type = np.float64) -> None:
+        self.capacity = capacity
+        self.width = width
+        shape = (2*capacity,) if width is None else (2*capacity, width)
+        self._data = np.zeros(shape, dtype=dtype)
+        self._pos = 0
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def append(self, value: Any) -> None:
+        """Adds a value, overwriting the oldest value if the buffer is full
+        """
+        self._data[self._pos] = value
+        self._data[self._pos + self.capacity] = value
+        self._pos = (self._pos + 1) % self.capacity
+        self._len = min(self._len + 1, self.capacity)
+
+    def extend(self, values: np.ndarray) -> None:
+        """Adds an array of values in one go, equivalent to appending each in
+        turn
+        """
+        values = np.asarray(values)
+        num_values = len(values)
+        values = values[-self.capacity:]
+        idx = (self._pos + num_values - len(values) + np.arange(len(values))) % self.capacity
+        self._data[idx] = values
+        self._data[idx + self.capacity] = values
+        self._pos = (self._pos + num_values) % self.capacity
+        self._len = min(self._len + num_values, self.capacity)
+
+    def view(self) -> np.ndarray:
+        """Returns the held values, oldest first, as a read-only view into the
+        buffer. The view is only valid until the next append, so should be
+        copied if it needs to be kept.
+        """
+        if self._len < self.capacity:
+            view = self._data[:self._len]
+        else:
+            view = self._data[self._pos:self._pos + self.capacity]
+        view = view.view()
+        view.flags.writeable = False
+        return view
+
+
+# Each session's position and trailing stop loss state is saved as a single
+# fixed-width record, along with the last candle it was saved at
+SESSION_STATE_VERSION = 1
+SESSION_STATE_DTYPE = np.dtype([
+    ("version", "<u2"),
+    ("in_long_position", "?"),
+    ("max_price_since_buy", "<f8"),
+    ("last_position_stop_triggered", "<i8"),
+    ("last_closed_minute", "<i8"),
+])
+
 
 class CurrentTradingSession():
     """The nature of the web socket used means that variables regarding the
     current trading session cannot easily be passed around, so instead they are
     encapsulated in this class.
+
+    Closing prices are held in a RingBuffer of max_closes values. When
+    several pairs are traded, one session is created per symbol, holding its
+    own strategy instance.
+
+    If the strategy uses bars of intervals other than 1 minute, timeframes
+    holds a MultiTimeframeAggregator (see aggregation.py) building them.
+
+    cur_candle_minute is the minute (counted from the epoch) in which the
+    candle currently being received opened, or -1 before the first message,
+    and cur_candle_closed records whether that candle has been closed yet.
+    last_closed_minute is the minute in which the last candle closed opened.
+    Minutes are used as the candle counter for the stop loss cool-down, so
+    that last_position_stop_triggered is also held as a minute and remains
+    valid across restarts. Each closed candle is processed on the candle
+    worker thread from a ClosedCandle, rather than from the session, which
+    keeps changing as later candles close.
+
+    Attributes are held in slots rather than a dict, keeping each session
+    small when many symbols are traded. The position and trailing stop loss
+    state can be saved with snapshot as a fixed-width binary record (see
+    SESSION_STATE_DTYPE), and loaded back with restore after a restart.
     """
-    def __init__(self) -> None:
+    __slots__ = ("symbol", "base_asset", "quote_asset", "trade_quantity", "strategy",
+                    "in_long_position", "max_price_since_buy",
+                    "last_position_stop_triggered", "closes", "timeframes",
+                    "prev_ts", "prev_price", "prev_kline", "cur_candle_minute",
+                    "cur_candle_closed", "last_closed_minute", "pending_order_side")
+
+    def __init__(self, max_closes: int = 120,
+                    symbol: str = "", base_asset: str = "", quote_asset: str = "",
+                    trade_quantity: float = 0, strategy: Any = None,
+                    timeframes: Any = None) -> None:
+        self.symbol = symbol
+        self.base_asset = base_asset
+        self.quote_asset = quote_asset
+        self.trade_quantity = trade_quantity
+        self.strategy = strategy
         self.in_long_position = False
         self.max_price_since_buy = 0
         self.last_position_stop_triggered = -1000
-        self.closes_list = []
+        self.closes = RingBuffer(max_closes)
+        self.timeframes = timeframes
         self.prev_ts = ""
-        self.prev_price = -1
\ No newline at end of file
+        self.prev_price = -1
+        self.prev_kline = None
+        self.cur_candle_minute = -1
+        self.cur_candle_closed = False
+        self.last_closed_minute = -1
+        self.pending_order_side = None
+
+    def snapshot(self) -> bytes:
+        """Returns the position and trailing stop loss state as a
+        SESSION_STATE_DTYPE record
+        """
+        state = np.zeros((), dtype=SESSION_STATE_DTYPE)
+        state["version"] = SESSION_STATE_VERSION
+        state["in_long_position"] = self.in_long_position
+        state["max_price_since_buy"] = self.max_price_since_buy
+        state["last_position_stop_triggered"] = self.last_position_stop_triggered
+        state["last_closed_minute"] = self.last_closed_minute
+        return state.tobytes()
+
+    def restore(self, snapshot: bytes) -> None:
+        """Sets the position and trailing stop loss state from a record
+        returned by snapshot. The candles themselves are not restored, as
+        they are reloaded by warm starting the session, but the minute of the
+        last candle closed is, so that the stop loss cool-down is measured
+        correctly even if warm starting fails.
+        """
+        if len(snapshot) != SESSION_STATE_DTYPE.itemsize:
+            raise ValueError(f"Session snapshot is {len(snapshot)} bytes, "
+                                f"not {SESSION_STATE_DTYPE.itemsize}")
+        state = np.frombuffer(snapshot, dtype=SESSION_STATE_DTYPE)[0]
+        if state["version"] != SESSION_STATE_VERSION:
+            raise ValueError(f"Unsupported session snapshot version {state['version']}")
+        self.in_long_position = bool(state["in_long_position"])
+        self.max_price_since_buy = float(state["max_price_since_buy"])
+        self.last_position_stop_triggered = int(state["last_position_stop_triggered"])
+        self.last_closed_minute = int(state["last_closed_minute"])
+
+
+class ClosedCandle():
+    """A candle which has closed, as passed from the stream to the candle
+    worker thread. The session keeps changing on the stream's thread as later
+    candles close (or are backfilled after a reconnect), so everything the
+    worker needs from the moment the candle closed is captured here.
+
+    Attributes
+    ----------
+    session : CurrentTradingSession
+        The trading session for the symbol whose candle closed
+    ts : str
+        The candle's label in the trading data CSV, the minute at which it
+        closed
+    minute : int
+        The minute, counted from the epoch, in which the candle opened
+    closes : np.ndarray
+        A copy of the session's closing prices, up to and including the
+        candle's
+    closed_at : float
+        The time.perf_counter() value at which the candle was closed, from
+        which the latency of later stages is measured
+    features : Any
+        What the strategy's update returned for the candle, e.g. features
+        computed incrementally, or None
+    """
+    __slots__ = ("session", "ts", "minute", "closes", "closed_at", "features")
+
+    def __init__(self, session: CurrentTradingSession, ts: str, minute: int,
+                    closes: np.ndarray, closed_at: float, features: Any = None) -> None:
+        self.session = session
+        self.ts = ts
+        self.minute = minute
+        self.closes = closes
+        self.closed_at = closed_at
+        self.features = features
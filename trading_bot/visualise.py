@@ -1,3 +1,6 @@
+import io
+import os
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -8,7 +11,121 @@ register_matplotlib_converters()
 fig = plt.figure()
 ax = fig.add_subplot(111)
 
-def plot_trade_data(data_loc):
+# The lines are created once, and their data updated in place on each refresh
+price_line, = ax.plot([], [], c='gray', label="Closing price")
+buy_line, = ax.plot([], [], 'g-', marker='o', linewidth=3, ms=12)
+sell_line, = ax.plot([], [], 'r-', marker='o', linewidth=3, ms=12)
+ax.set_ylabel('Closing price')
+ax.set_xlabel("Datetime")
+
+
+class TradeDataTail():
+    """Reads the trading data CSV written by trading_bot.py incrementally,
+    remembering how far through the file it has read so that each update only
+    parses the rows appended since the last one. Only rows from the current
+    trading session (the most recent datetime_collected) are kept, and when
+    first opened the start of that session is found by reading backwards from
+    the end of the file, so earlier sessions are never parsed.
+
+    Attributes
+    ----------
+    data_loc : str
+        The location of the CSV file containing trading and order data
+    session : str
+        The datetime_collected value of the current trading session
+    datetimes : np.ndarray
+        Datetime of each closing price in the current session
+    closing_prices : np.ndarray
+        Closing prices in the current session
+    trades : np.ndarray
+        The trade made at each closing price ("buy", "sell" or "None")
+    """
+    COL_NAMES = ["datetime_collected", "datetime", "price", "trade_made"]
+
+    def __init__(self, data_loc: str) -> None:
+        self.data_loc = data_loc
+        self.session = None
+        self.offset = None
+        self.datetimes = np.array([], dtype='datetime64[ns]')
+        self.closing_prices = np.array([], dtype=float)
+        self.trades = np.array([], dtype=object)
+
+    def find_session_start(self, csv_file, block_size: int = 1 << 20) -> int:
+        """Returns the offset of the first row of the last trading session in
+        the file, reading backwards from the end a block at a time
+        """
+        end = csv_file.seek(0, os.SEEK_END)
+        pos, tail = end, b""
+        session_prefix = None
+        while pos > 0:
+            read_size = min(block_size, pos)
+            pos -= read_size
+            csv_file.seek(pos)
+            tail = csv_file.read(read_size) + tail
+            lines = tail.split(b"\n")
+
+            line_starts = []
+            line_start = pos
+            for line in lines:
+                line_starts.append(line_start)
+                line_start += len(line) + 1
+
+            # The first line may be incomplete unless the start of the file
+            # has been reached, in which case it is left for the next block
+            first_complete_line = 0 if pos == 0 else 1
+            for i in range(len(lines) - 1, first_complete_line - 1, -1):
+                if not lines[i].strip():
+                    continue
+                if session_prefix is None:
+                    session_prefix = lines[i].split(b",")[0] + b","
+                if not lines[i].startswith(session_prefix):
+                    return line_starts[i] + len(lines[i]) + 1
+        return 0
+
+    def read_new_rows(self) -> bool:
+        """Parses any rows appended since the last call, returning True if
+        the data held has changed
+        """
+        with open(self.data_loc, 'rb') as csv_file:
+            if self.offset is None:
+                self.offset = self.find_session_start(csv_file)
+            csv_file.seek(self.offset)
+            new_bytes = csv_file.read()
+
+        # The last row is only used once all of its fields have been written
+        lines = new_bytes.split(b"\n")
+        if lines and len(lines[-1].split(b",")) < len(self.COL_NAMES):
+            new_bytes = new_bytes[:len(new_bytes) - len(lines[-1])]
+        self.offset += len(new_bytes)
+
+        new_text = new_bytes.decode()
+        if not new_text.strip():
+            return False
+        df = pd.read_csv(io.StringIO(new_text), header=None, names=self.COL_NAMES,
+                            dtype={"datetime_collected": str, "trade_made": str},
+                            keep_default_na=False)
+        df = df[df['datetime_collected'] != self.COL_NAMES[0]]
+        if df.empty:
+            return False
+
+        # A new trading session replaces the data held
+        latest_session = df['datetime_collected'].iloc[-1]
+        if latest_session != self.session:
+            self.session = latest_session
+            self.datetimes = self.datetimes[:0]
+            self.closing_prices = self.closing_prices[:0]
+            self.trades = self.trades[:0]
+        df = df[df['datetime_collected'].values == latest_session]
+
+        self.datetimes = np.concatenate([self.datetimes,
+                                            pd.to_datetime(df['datetime']).values])
+        self.closing_prices = np.concatenate([self.closing_prices,
+                                                df['price'].values.astype(float)])
+        self.trades = np.concatenate([self.trades, df['trade_made'].values])
+        return True
+
+
+def plot_trade_data(trade_data_tail: TradeDataTail) -> None:
     """Plots live trading data, auto-updating at the close of each minute
     candle. The matplotlib FuncAnimation plot used here can be particular about
     the IDEs it will run with, so please experiement with different IDEs if
@@ -16,42 +133,40 @@ def plot_trade_data(data_loc):
 
     Parameters
     ----------
-    data_loc : str
-        The location of the CSV file containing trading and order data.
+    trade_data_tail : TradeDataTail
+        Reader for the CSV file containing trading and order data.
 
     Returns
     -------
     None
     """
-    df_full = pd.read_csv(data_loc)
-
-    # Only using data from current trading session
-    df = df_full[df_full['datetime_collected'] == df_full['datetime_collected'].iloc[-1]]
-    closing_prices = df['price'].values.reshape(-1)
-
-    # Defining numpy arrays for plotting
-    trades = df['trade_made'].values.reshape(-1)
-    buy_executed = np.array([closing_prices[i] if (trades[i] == "buy") else None\
-                                for i in range(len(closing_prices))])
-    sell_executed = np.array([closing_prices[i] if (trades[i] == "sell") else None\
-                                for i in range(len(closing_prices))])
-    x = pd.to_datetime(df['datetime'])
-
-    # Plotting graph
-    ax.clear()
-    ax.plot(x, closing_prices, c='gray', label="Closing price")
-    ax.plot(x, buy_executed, 'g-', marker='o', linewidth=3, ms=12)
-    ax.plot(x, sell_executed, 'r-', marker='o', linewidth=3, ms=12)
-    ax.set_ylabel('Closing price')
-    ax.set_xlabel("Datetime")
-
-
-trade_data_loc = "../Trading CSVs/BTCUSDT_data.csv"
-     
-def animate(i):
-    plot_trade_data(trade_data_loc)
-
-# Automatically update every 15 seconds
-update_interval_ms = 15000
-a = FuncAnimation(fig, animate, interval=update_interval_ms)
-plt.show()
+    if not trade_data_tail.read_new_rows():
+        return
+
+    # Defining numpy arrays for plotting, where prices are only shown at the
+    # points at which trades were made
+    closing_prices = trade_data_tail.closing_prices
+    trades = trade_data_tail.trades
+    buy_executed = np.where(trades == "buy", closing_prices, np.nan)
+    sell_executed = np.where(trades == "sell", closing_prices, np.nan)
+    x = trade_data_tail.datetimes
+
+    # Updating the existing lines, and rescaling the axes to fit them
+    price_line.set_data(x, closing_prices)
+    buy_line.set_data(x, buy_executed)
+    sell_line.set_data(x, sell_executed)
+    ax.relim()
+    ax.autoscale_view()
+
+
+if __name__ == "__main__":
+    trade_data_loc = "../Trading CSVs/BTCUSDT_data.csv"
+    trade_data_tail = TradeDataTail(trade_data_loc)
+
+    def animate(i):
+        plot_trade_data(trade_data_tail)
+
+    # Automatically update every 15 seconds
+    update_interval_ms = 15000
+    a = FuncAnimation(fig, animate, interval=update_interval_ms)
+    plt.show()
@@ -0,0 +1,141 @@
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+
+from candle_store import CANDLE_DTYPE, CandleStore
+from stream_parsing import format_minute, MS_PER_MINUTE
+from utilities import CurrentTradingSession
+
+# The maximum number of klines Binance returns from a single request
+MAX_KLINES_PER_REQUEST = 1000
+
+# When the candle store is behind, the missing candles are fetched with up to
+# this many requests (about 20 days of 1 minute candles). A store which is
+# further behind is left for download.py to fill in.
+MAX_CATCH_UP_REQUESTS = 30
+
+
+def klines_to_candles(klines: List[list]) -> np.ndarray:
+    """Converts klines in the format returned by Binance's get_klines into an
+    array of candle_store.CANDLE_DTYPE records
+    """
+    candles = np.empty(len(klines), dtype=CANDLE_DTYPE)
+    if len(klines):
+        fields = np.array([kline[:6] for kline in klines], dtype=float)
+        candles["open_time"] = fields[:, 0].astype(np.int64)
+        for i, name in enumerate(("open", "high", "low", "close", "volume"), 1):
+            candles[name] = fields[:, i]
+    return candles
+
+
+def fetch_closed_candles(client: Any, symbol: str, limit: int = MAX_KLINES_PER_REQUEST,
+                            start_ms: Optional[int] = None,
+                            now_ms: Optional[int] = None) -> np.ndarray:
+    """Fetches up to limit 1 minute candles for the symbol in a single request,
+    either the most recent or the first opening from start_ms onwards,
+    leaving out the candle which is still open
+    """
+    if limit <= 0:
+        return np.zeros(0, dtype=CANDLE_DTYPE)
+    if now_ms is None:
+        now_ms = int(time.time()*1000)
+    kwargs = {"symbol": symbol, "interval": "1m",
+                "limit": min(limit + 1, MAX_KLINES_PER_REQUEST)}
+    if start_ms is not None:
+        kwargs["startTime"] = start_ms
+    candles = klines_to_candles(client.get_klines(**kwargs))
+    candles = candles[candles["open_time"] + MS_PER_MINUTE <= now_ms]
+    return candles[:limit] if start_ms is not None else candles[-limit:]
+
+
+def load_recent_candles(symbol: str, num_candles: int, client: Any = None,
+                            candle_store: Optional[CandleStore] = None,
+                            now_ms: Optional[int] = None) -> np.ndarray:
+    """Returns the most recent num_candles closed 1 minute candles for the
+    symbol, oldest first. Candles are read from the candle store if given, and
+    any which have closed since the last one stored are fetched from the
+    exchange, continuing on from it a request at a time, and added to the
+    store. If the store has no candles for the symbol, the most recent
+    candles are fetched (and stored) instead. If it is too far behind to be
+    brought up to date within MAX_CATCH_UP_REQUESTS requests, only the most
+    recent candles are fetched, and they are not added to the store, as that
+    would leave a gap in it.
+    """
+    if now_ms is None:
+        now_ms = int(time.time()*1000)
+    last_closed_open_ms = now_ms - now_ms % MS_PER_MINUTE - MS_PER_MINUTE
+
+    stored = np.zeros(0, dtype=CANDLE_DTYPE)
+    last_stored_ms = -1
+    if candle_store is not None:
+        start_ms = last_closed_open_ms - (num_candles - 1)*MS_PER_MINUTE
+        stored = candle_store.read(symbol, start_ms, now_ms)
+        last_stored_ms = candle_store.last_open_time(symbol)
+    if last_stored_ms >= last_closed_open_ms or client is None:
+        return np.array(stored[-num_candles:])
+
+    num_missing = int(last_closed_open_ms - last_stored_ms)//MS_PER_MINUTE
+    max_catch_up = MAX_CATCH_UP_REQUESTS*(MAX_KLINES_PER_REQUEST - 1)
+    if last_stored_ms == -1 or num_missing > max_catch_up:
+        fetched = fetch_closed_candles(client, symbol,
+                                        min(num_candles, MAX_KLINES_PER_REQUEST - 1),
+                                        now_ms=now_ms)
+        if last_stored_ms == -1:
+            if candle_store is not None:
+                candle_store.append(symbol, fetched)
+        else:
+            print(f"{symbol}: candle store is {num_missing} candles behind, so only "
+                    "the most recent are fetched (fill it in with download.py --backfill)")
+        return np.concatenate([stored, fetched])[-num_candles:]
+
+    # The store is brought up to date a request at a time, starting from the
+    # candle after the last one stored, so that it is left without gaps
+    fetched = []
+    start_ms = last_stored_ms + MS_PER_MINUTE
+    while start_ms <= last_closed_open_ms:
+        limit = min((last_closed_open_ms - start_ms)//MS_PER_MINUTE + 1,
+                    MAX_KLINES_PER_REQUEST - 1)
+        candles = fetch_closed_candles(client, symbol, limit, start_ms, now_ms)
+        if len(candles) == 0:
+            break
+        candle_store.append(symbol, candles)
+        fetched.append(candles)
+        start_ms = int(candles["open_time"][-1]) + MS_PER_MINUTE
+    return np.concatenate([stored] + fetched)[-num_candles:]
+
+
+def warm_start_session(sess: CurrentTradingSession, candles: np.ndarray) -> int:
+    """Seeds the session with recent candles, as if they had been received
+    from the stream, so that its strategy can trade as soon as the next
+    candle closes. Only candles newer than the last one the session has
+    closed are used, so the session then carries on from the live stream
+    without gaps or duplicates, and this can also be used to fill in candles
+    missed while the stream was disconnected. Returns the number of candles
+    used.
+    """
+    if sess.cur_candle_minute != -1:
+        last_closed_minute = sess.cur_candle_minute - (not sess.cur_candle_closed)
+        candles = candles[candles["open_time"]//MS_PER_MINUTE > last_closed_minute]
+    if len(candles) == 0:
+        return 0
+
+    closes_arr = np.ascontiguousarray(candles["close"])
+    sess.closes.extend(closes_arr)
+    sess.strategy.warm_up(closes_arr)
+    if sess.timeframes is not None:
+        completed = set()
+        for candle in candles.tolist():
+            completed.update(sess.timeframes.add_kline(candle[0], candle[1:]))
+        for interval in completed:
+            sess.strategy.on_bar(interval, sess.timeframes[interval].closes.view())
+
+    # The stream's messages for the last candle used are now ignored, and the
+    # next candle is closed as normal
+    last_minute = int(candles["open_time"][-1])//MS_PER_MINUTE
+    sess.cur_candle_minute = last_minute
+    sess.cur_candle_closed = True
+    sess.last_closed_minute = last_minute
+    sess.prev_ts = format_minute(last_minute + 1)
+    sess.prev_price = float(closes_arr[-1])
+    return len(candles)